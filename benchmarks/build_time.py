@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+"""Time the grid build across the number of cells and the dimension.
+
+The build of each index mode is compared with the dict of cells built
+point by point of the first GriSPy versions, whose loop is reproduced
+here. Run it as::
+
+    python benchmarks/build_time.py [--points N] [--repeat R]
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from grispy import GriSPy
+
+
+CONFIGURATIONS = [
+    # (dim, N_cells)
+    (2, 64),
+    (2, 512),
+    (3, 16),
+    (3, 64),
+    (3, 128),
+    (4, 32),
+    (6, 8),
+    (8, 6),
+]
+
+ROW = "{:>4} {:>8} {:>12} {:>10.4f} {:>10.4f} {:>10.4f} {:>7.0f}x"
+
+
+def legacy_build(data, N_cells, epsilon=1.0e-6):
+    """Build the dict of cells with a Python loop over the points."""
+    dim = data.shape[1]
+    k_digit = np.zeros(data.shape, dtype=int)
+    for k in range(dim):
+        k_data = data[:, k]
+        bins = np.linspace(
+            k_data.min() - epsilon, k_data.max() + epsilon, N_cells + 1)
+        k_digit[:, k] = (
+            N_cells * (k_data - bins[0]) / (bins[-1] - bins[0])).astype(int)
+
+    grid = {}
+    for i in range(len(data)):
+        cell_point = tuple(k_digit[i, :])
+        if cell_point not in grid:
+            grid[cell_point] = [i]
+        else:
+            grid[cell_point].append(i)
+    return grid
+
+
+def best_time(func, repeat):
+    """Return the best wall time of ``repeat`` calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(42)
+    header = "{:>4} {:>8} {:>12} {:>10} {:>10} {:>10} {:>8}".format(
+        "dim", "N_cells", "cells", "legacy", "dense", "sparse", "speedup")
+    print(header)
+    print("-" * len(header))
+    for dim, N_cells in CONFIGURATIONS:
+        data = random.uniform(0, 1, size=(args.points, dim))
+        total_cells = N_cells ** dim
+
+        legacy = best_time(lambda: legacy_build(data, N_cells), args.repeat)
+        dense = np.nan
+        if total_cells <= 10 ** 8:
+            dense = best_time(
+                lambda: GriSPy(data, N_cells=N_cells, index_mode="dense"),
+                args.repeat)
+        sparse = best_time(
+            lambda: GriSPy(data, N_cells=N_cells, index_mode="sparse"),
+            args.repeat)
+
+        speedup = legacy / np.nanmin([dense, sparse])
+        print(ROW.format(
+            dim, N_cells, total_cells, legacy, dense, sparse, speedup))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,10 +18,11 @@
 # IMPORTS
 # =============================================================================
 
+import os
 import time
+import functools
 import datetime
-
-import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
@@ -35,14 +36,73 @@ from . import distances, validators as vlds
 # =============================================================================
 
 METRICS = {
-    "euclid": distances.euclid,
-    "haversine": distances.haversine,
-    "vincenty": distances.vincenty}
+    "euclid": distances.euclid_pairs,
+    "manhattan": distances.manhattan_pairs,
+    "chebyshev": distances.chebyshev_pairs,
+    "minkowski": distances.minkowski_pairs,
+    "haversine": distances.haversine_pairs,
+    "vincenty": distances.vincenty_pairs}
 
 
 EMPTY_ARRAY = np.array([], dtype=int)
 
 
+# Relative to the cell size, margin given to the bounds of the distance from
+# a centre to a cell, which are computed with rounding errors.
+CELL_TOLERANCE = 1.0e-9
+
+PERIODIC_MODES = ["mirror", "wrap"]
+
+BACKENDS = ["numpy", "numba"]
+
+# With N_cells='auto', the cells are at least this many times smaller than
+# the expected radius. Smaller cells are accepted whole more often, but more
+# cells have to be visited.
+CELLS_PER_RADIUS = 4
+
+INDEX_MODES = ["auto", "dense", "sparse"]
+
+# The cells are numbered with an int64 flat index, the grids can not have
+# more cells. Half of them, so the boxes of cells that go around a wrapped
+# axis can be numbered too.
+MAX_CELLS = 2 ** 62
+
+# With index_mode='auto', the index is sparse if the grid has more than this
+# many cells per data point.
+SPARSE_CELLS_PER_POINT = 16
+
+# The boxes larger than the occupied cells of a sparse index are split in
+# chunks of about this many (centre, occupied cell) tests.
+BOX_CHUNK_SIZE = 1 << 18
+
+# The queries are split in chunks of centres of about this many (centre,
+# cell) pairs, or candidate points if the cells hold more than one point, so
+# the memory does not grow with the number of centres.
+QUERY_CHUNK_SIZE = 1 << 20
+
+# The metrics whose distances are angles on the sphere, in degrees, the only
+# ones that can index the sky in bands or as unit vectors.
+SKY_METRICS = ["haversine", "vincenty"]
+
+# The metrics separable by axis and their power p: the distance to the power
+# p is a sum of one term per axis, or with p=inf the distance is the largest
+# term. Their cells are pruned with the exact distance to the closest and
+# farthest point of each cell, and the cells within the radius are accepted
+# whole. The power of 'minkowski' can be changed with metric_params.
+SEPARABLE_METRICS = {
+    "euclid": 2., "manhattan": 1., "chebyshev": np.inf, "minkowski": 2.}
+
+# The keys of metric_params that each metric accepts.
+METRIC_PARAMS = {
+    "euclid": ["weights"],
+    "manhattan": ["weights"],
+    "minkowski": ["p", "weights"]}
+
+# The removed points stay in the cell index as tombstones until they are more
+# than this fraction of the indexed points, then the index is compacted.
+COMPACT_FRACTION = 0.25
+
+
 # =============================================================================
 #  TIME CLASS
 # =============================================================================
@@ -59,11 +119,66 @@ class BuildStats:
         The date and time when the periodicity was setted.
     datetime: datetime.datetime
         The date and time of build.
+    loadtime: float or None
+        The number of seconds expended in load the grid from disk, or None
+        if the grid was not loaded.
+    n_cells: tuple of int or None
+        The number of cells of the grid along each dimension, as chosen at
+        build time.
     """
 
     buildtime = attr.ib()
     periodicity_set_at = attr.ib()
     datetime = attr.ib()
+    loadtime = attr.ib(default=None)
+    n_cells = attr.ib(default=None)
+
+
+@attr.s(frozen=True)
+class UpdateStats:
+    """Statistics about an update of the positions of the points.
+
+    Attributes
+    ----------
+    updatetime: float
+        The number of seconds expended in update the grid.
+    n_migrated: int
+        The number of points that changed of cell, they were moved in the
+        cell index.
+    n_overflow: int
+        The number of points out of the bins of the grid after the update.
+    """
+
+    updatetime = attr.ib()
+    n_migrated = attr.ib()
+    n_overflow = attr.ib()
+
+
+@attr.s(frozen=True)
+class CellIndex:
+    """Compressed representation of the points indexed in the grid.
+
+    The indices of the data points are stored sorted by the flat index of
+    the cell that contains them, so the points within the flat cell ``c``
+    are ``order[offsets[c]:offsets[c + 1]]``.
+
+    A sparse index only keeps the occupied cells: the points within the
+    flat cell ``cells[i]`` are ``order[offsets[i]:offsets[i + 1]]``.
+
+    Attributes
+    ----------
+    order: ndarray, shape (n,)
+        Indices of the data points sorted by cell.
+    offsets: ndarray, shape (total number of cells + 1,)
+        Position in ``order`` where each cell starts. In a sparse index the
+        shape is (number of occupied cells + 1,).
+    cells: ndarray or None
+        Only in a sparse index. The sorted flat index of the occupied cells.
+    """
+
+    order = attr.ib()
+    offsets = attr.ib()
+    cells = attr.ib(default=None)
 
 
 @attr.s(frozen=True)
@@ -98,14 +213,25 @@ class GriSPy(object):
     - shell_neighbors: find neighbors within given lower and upper radius.
     Different lower and upper radius can be provided for each centre.
     - nearest_neighbors: find the nth nearest neighbors for each centre.
+    - count_neighbors: count the neighbors within a given radius.
+    - box_neighbors: find neighbors within a box aligned with the axes,
+    of given half widths along each axis.
 
     Other methods:
     - set_periodicity: set periodicity condition after the grid was built.
+    - insert: add points to the built grid.
+    - remove: remove points from the built grid.
+    - update_positions: move the points of the built grid.
+
+    The periodicity can be solved in two ways. In the 'mirror' mode the
+    centres close to a periodic edge are mirrored to the other side of the
+    domain and searched again. In the 'wrap' mode the cells of the periodic
+    axes are aligned with the periodic range, the cells around each centre
+    wrap around the domain and the distances are computed to the closest
+    periodic image of each point, so each centre is searched only once.
 
-    To be implemented:
-    - box_neighbors: find neighbors within a k-dimensional squared box of
-    a given size and orientation.
-    - n_jobs: number of cores for parallel computation.
+    The queries can run in parallel over chunks of centres with the n_jobs
+    keyword.
 
     Parameters
     ----------
@@ -113,9 +239,15 @@ class GriSPy(object):
         The n data points of dimension k to be indexed. This array is not
         copied, and so modifying this data may result in erroneous results.
         The data can be copied if the grid is built with copy_data=True.
-    N_cells: positive int, optional
-        The number of cells of each dimension to build the grid. The final
-        grid will have N_cells**k number of cells. Default: 64
+    N_cells: positive int, sequence of positive int or 'auto', optional
+        The number of cells of each dimension to build the grid. A sequence
+        gives the number of cells of each dimension individually. With
+        'auto' the number of cells is chosen from the extent of the data so
+        the cells have about ``mean_occupancy`` points each, and are not
+        smaller than a quarter of ``expected_radius`` if it is given. The
+        axes thinner than a cell get a single cell. The final grid will
+        have N_cells**k number of cells, or the product of the number of
+        cells of each dimension. Default: 64
     copy_data: bool, optional
         Flag to indicate if the data should be copied in memory.
         Default: False
@@ -129,21 +261,92 @@ class GriSPy(object):
         periodic range. Default: all axis set to None.
         Example, periodic = { 0: (0, 360), 1: None}.
     metric: str, optional
-        Metric definition to compute distances. Options: 'euclid', 'haversine'
-        'vincenty' or a custom callable.
+        Metric definition to compute distances. Options: 'euclid',
+        'manhattan', 'chebyshev', 'minkowski', 'haversine', 'vincenty' or a
+        custom callable. The 'euclid', 'manhattan' (L1), 'chebyshev'
+        (L-infinity) and 'minkowski' metrics are separable by axis, their
+        cells are pruned with exact distance bounds and the cells entirely
+        within the search radius are accepted whole, without computing the
+        distance of their points. The callable is called once for
+        each centre as ``metric(c0, centres, dim)``, or once for many
+        centres as ``metric(centres, centre_ids, points)`` if it is marked
+        with ``grispy.distances.batched``, see ``grispy.distances``.
+    periodic_mode: str, optional
+        How the periodicity is solved. Options: 'mirror' or 'wrap'. In the
+        'wrap' mode each data point is found at most once for each centre,
+        the one of its periodic images that is closest to the centre.
+        Default: 'mirror'
+    backend: str, optional
+        Implementation of the bubble and shell searches. Options: 'numpy' or
+        'numba'. The 'numba' backend visits the cells, computes the distances
+        and filters them in a single compiled loop. It is only used with the
+        'euclid' metric without weights and if Numba is installed, otherwise
+        the 'numpy' backend is used. Default: 'numpy'
+    expected_radius: positive float, optional
+        Only with N_cells='auto'. The typical search radius of the queries.
+        Default: None
+    mean_occupancy: positive float, optional
+        Only with N_cells='auto'. The mean number of points per cell that
+        the grid is built for. Default: 2
+    index_mode: str, optional
+        How the points are indexed in the cells. Options: 'dense', 'sparse'
+        or 'auto'. The 'dense' index stores the position of the points of
+        every cell. The 'sparse' index only stores the occupied cells, so
+        its memory does not grow with the number of cells, and the searches
+        only visit occupied cells. It is the index for grids with many more
+        cells than points, such as high dimensional grids. With 'auto' the
+        index is sparse if the grid has more than 16 cells per point.
+        Default: 'auto'
+    sky_bands: bool, optional
+        Only with the 'haversine' and 'vincenty' metrics, for data of
+        longitudes and latitudes in degrees. The grid is made of bands of
+        latitude and the cells of each band cover the full circle of
+        longitude, with fewer cells in the bands closer to the poles so all
+        the cells have about the same area. The searches wrap around the
+        longitude and each band is only searched over the longitudes the
+        search radius spans there, so the cost of a centre does not grow
+        near the poles. The number of cells of the axis 0 is that of the
+        bands at the equator, over the full circle. The grid can not be
+        periodic. Default: False
+    unit_vectors: bool, optional
+        Only with the 'haversine' and 'vincenty' metrics, for data of
+        longitudes and latitudes in degrees. The points are indexed as their
+        unit vectors (x, y, z) in a 3D grid, and the angular radius of the
+        searches is turned into the chord ``2 sin(radius / 2)`` of the unit
+        sphere, so the searches are euclidean: no trigonometry per
+        candidate and the cells entirely within the radius are accepted
+        whole. Only the distances of the neighbors found are turned back
+        into angles. N_cells, expected_radius, n_cells_ and the bins refer
+        to the 3D grid, with the expected radius as an angle. The grid can
+        not be periodic nor in sky bands. Default: False
+    metric_params: dict, optional
+        Parameters of the metric. With 'minkowski' the key 'p' is its power,
+        a number not smaller than 1 or inf, 2 by default. With 'euclid',
+        'manhattan' and 'minkowski' the key 'weights' gives a positive
+        weight to each dimension, the distance is then
+        ``(sum_k w_k |x_k - c_k| ** p) ** (1 / p)``. The weights have no
+        effect with p inf, so they are not accepted with it. Default: None
 
 
     Attributes
     ----------
     dim: int
-        The dimension of a single data-point.
-    grid_: dict
-        This dictionary contains the data indexed in a grid. The key is a
-        tuple with the k-dimensional index of each grid cell. Empty cells
-        do not have a key. The value is a list of data points indices which
-        are located within the given cell.
-    k_bins_: ndarray, shape (N_cells+1,k)
-        The limits of the grid cells in each dimension.
+        The dimension of a single data-point, or 3 with unit_vectors, the
+        dimension of the grid.
+    grid_: grispy.core.CellIndex
+        The data indexed in the grid. The indices of the data points are
+        sorted by cell and an array of offsets gives the slice of each cell,
+        where the cells are numbered with their flat (Fortran order) index.
+    k_bins_: ndarray, shape (N_cells+1,k) or None
+        The limits of the grid cells in each dimension. Only if all the
+        dimensions have the same number of cells, otherwise None, see
+        axis_bins_.
+    axis_bins_: list of k ndarrays
+        The limits of the grid cells in each dimension, with one more value
+        than the number of cells of the dimension.
+    n_cells_: ndarray, shape (k,)
+        The number of cells of the grid in each dimension. With sky_bands
+        the number of bands and of cells along the longitude at the equator.
     periodic_flag_: bool
         If any dimension has periodicity.
     periodic_conf_: grispy.core.PeriodicityConf
@@ -151,6 +354,21 @@ class GriSPy(object):
         with periodicity.
     time_: grispy.core.BuildStats
         Object containing the building time and the date of build.
+    removed_: ndarray of bool, shape (n,)
+        Whether each data point was removed. The rows of the removed points
+        stay in the data, so the indices of the other points do not change,
+        and are reused by the points inserted later.
+    overflow_: ndarray
+        Indices of the points inserted out of the bins of the grid. They
+        are in no cell, so they are tested against every centre.
+    n_tombstones_: int
+        Number of removed points that are still in the cell index.
+    vectors_: ndarray, shape (n, 3) or None
+        Only with unit_vectors. The unit vector of each data point, the
+        points indexed in the grid.
+    shared_blocks_: list or None
+        Only for the grids attached with ``from_shared_memory``. The shared
+        memory blocks of the arrays, kept open while the grid exists.
 
     """
 
@@ -161,13 +379,27 @@ class GriSPy(object):
     metric = attr.ib(default="euclid")
     copy_data = attr.ib(
         default=False, validator=attr.validators.instance_of(bool))
+    periodic_mode = attr.ib(default="mirror")
+    backend = attr.ib(default="numpy")
+    expected_radius = attr.ib(default=None)
+    mean_occupancy = attr.ib(default=2)
+    index_mode = attr.ib(default="auto")
+    sky_bands = attr.ib(default=False)
+    unit_vectors = attr.ib(default=False)
+    metric_params = attr.ib(default=None)
 
     # params
     dim_ = attr.ib(init=False, repr=False)
     grid_ = attr.ib(init=False, repr=False)
-    k_bins_ = attr.ib(init=False, repr=False)
+    axis_bins_ = attr.ib(init=False, repr=False)
+    n_cells_ = attr.ib(init=False, repr=False)
     periodic_conf_ = attr.ib(init=False, repr=False)
     time_ = attr.ib(init=False, repr=False)
+    removed_ = attr.ib(init=False, repr=False)
+    overflow_ = attr.ib(init=False, repr=False)
+    n_tombstones_ = attr.ib(init=False, repr=False)
+    vectors_ = attr.ib(init=False, repr=False)
+    shared_blocks_ = attr.ib(init=False, repr=False)
 
     # =========================================================================
     # ATTRS INITIALIZATION
@@ -179,21 +411,31 @@ class GriSPy(object):
 
         if self.copy_data:
             self.data = self.data.copy()
-        self.dim_ = self.data.shape[1]
+        self.vectors_ = None
+        if self.unit_vectors:
+            self.vectors_ = distances.unit_vectors(self.data)
+        grid_data = self._grid_data()
+        self.dim_ = grid_data.shape[1]
 
         self.periodic, self.periodic_conf_ = self._build_periodicity(
             periodic=self.periodic, dim=self.dim_)
 
-        self.grid_, self.k_bins_ = self._build_grid(
-            data=self.data,
-            N_cells=self.N_cells,
+        self.n_cells_ = self._resolve_n_cells(data=grid_data, dim=self.dim_)
+        self.grid_, self.axis_bins_ = self._build_grid(
+            data=grid_data,
+            n_cells=self.n_cells_,
             dim=self.dim_)
+        self.removed_ = np.zeros(len(self.data), dtype=bool)
+        self.overflow_ = EMPTY_ARRAY.copy()
+        self.n_tombstones_ = 0
+        self.shared_blocks_ = None
 
         # Record date and build time
         now = datetime.datetime.now()
         self.time_ = BuildStats(
             buildtime=time.time() - t0,
-            periodicity_set_at=now, datetime=now)
+            periodicity_set_at=now, datetime=now,
+            n_cells=tuple(self.n_cells_.tolist()))
 
     @data.validator
     def _validate_data(self, attribute, value):
@@ -219,16 +461,44 @@ class GriSPy(object):
     @N_cells.validator
     def _validate_N_cells(self, attr, value):
         """Validate init params: N_cells."""
-        # Chek if int
-        if not isinstance(value, int):
-            raise TypeError(
-                "N_cells: Argument must be an integer. "
-                "Got instead type {}".format(type(value)))
-        # Check if N_cells is valid, i.e. higher than 1
-        if value < 1:
+        if isinstance(value, str):
+            if value != "auto":
+                raise ValueError(
+                    "N_cells: Got an invalid name: '{}'. "
+                    "The only option is: auto".format(value))
+            return
+
+        # One value for each dimension, of the grid of the unit vectors
+        dim = 3 if self.unit_vectors is True else self.data.shape[1]
+        if isinstance(value, (tuple, list, np.ndarray)):
+            if len(value) != dim:
+                raise ValueError(
+                    "N_cells: Argument must have one value for each "
+                    "dimension. Got instead {}".format(value))
+            values = list(value)
+        else:
+            values = [value] * dim
+
+        for value in values:
+            # Chek if int
+            if not isinstance(value, (int, np.integer)):
+                raise TypeError(
+                    "N_cells: Argument must be an integer. "
+                    "Got instead type {}".format(type(value)))
+            # Check if N_cells is valid, i.e. higher than 1
+            if value < 1:
+                raise ValueError(
+                    "N_cells: Argument must be higher than 1. "
+                    "Got instead {}".format(value))
+
+        # Check if the cells can be numbered, python ints do not overflow
+        total_cells = functools.reduce(
+            lambda total, value: total * int(value), values, 1)
+        if total_cells > MAX_CELLS:
             raise ValueError(
-                "N_cells: Argument must be higher than 1. "
-                "Got instead {}".format(value))
+                "N_cells: The grid would have {} cells, more than the {} "
+                "that can be indexed. Use fewer cells along each "
+                "dimension".format(total_cells, MAX_CELLS))
 
     @metric.validator
     def _validate_metric(self, attr, value):
@@ -240,6 +510,171 @@ class GriSPy(object):
                 "Metric: Got an invalid name: '{}'. "
                 "Options are: {} or a callable".format(value, metric_names))
 
+    @periodic_mode.validator
+    def _validate_periodic_mode(self, attr, value):
+        """Validate init params: periodic_mode."""
+        # Check if name is valid
+        if value not in PERIODIC_MODES:
+            raise ValueError(
+                "Periodic mode: Got an invalid name: '{}'. "
+                "Options are: {}".format(value, PERIODIC_MODES))
+
+    @backend.validator
+    def _validate_backend(self, attr, value):
+        """Validate init params: backend."""
+        # Check if name is valid
+        if value not in BACKENDS:
+            raise ValueError(
+                "Backend: Got an invalid name: '{}'. "
+                "Options are: {}".format(value, BACKENDS))
+
+    @index_mode.validator
+    def _validate_index_mode(self, attr, value):
+        """Validate init params: index_mode."""
+        # Check if name is valid
+        if value not in INDEX_MODES:
+            raise ValueError(
+                "Index mode: Got an invalid name: '{}'. "
+                "Options are: {}".format(value, INDEX_MODES))
+
+    @sky_bands.validator
+    def _validate_sky_bands(self, attr, value):
+        """Validate init params: sky_bands."""
+        # Chek if bool
+        if not isinstance(value, bool):
+            raise TypeError(
+                "Sky bands: Argument must be a bool. "
+                "Got instead type {}".format(type(value)))
+        if value:
+            self._validate_sphere("Sky bands")
+
+    @unit_vectors.validator
+    def _validate_unit_vectors(self, attr, value):
+        """Validate init params: unit_vectors."""
+        # Chek if bool
+        if not isinstance(value, bool):
+            raise TypeError(
+                "Unit vectors: Argument must be a bool. "
+                "Got instead type {}".format(type(value)))
+        if not value:
+            return
+
+        self._validate_sphere("Unit vectors")
+        if self.sky_bands:
+            raise ValueError(
+                "Unit vectors: The grid can not be in sky bands too")
+
+    def _validate_sphere(self, name):
+        """Check the data and params of a grid of the sphere.
+
+        ``name`` is that of the param that asks for it, for the messages.
+
+        """
+        # Only longitudes and latitudes with an angular metric
+        if self.metric not in SKY_METRICS:
+            raise ValueError(
+                "{}: Only with the metrics: {}. Got instead '{}'".format(
+                    name, ", ".join(SKY_METRICS), self.metric))
+        if self.data.shape[1] != 2:
+            raise ValueError(
+                "{}: Data must have the longitude and latitude of each "
+                "point, with shape (n, 2). Got instead {}".format(
+                    name, self.data.shape))
+        if np.any(np.abs(self.data[:, 1]) > 90):
+            raise ValueError(
+                "{}: The latitudes must be within -90 and 90 "
+                "degrees".format(name))
+        self._validate_sphere_periodic(self.periodic)
+
+    def _validate_sphere_periodic(self, periodic):
+        """Check that a grid of the sphere has no periodic axis."""
+        if any(v is not None for v in periodic.values()):
+            raise ValueError(
+                "Periodicity: A grid of the sphere can not be periodic, the "
+                "longitude already wraps around")
+
+    @metric_params.validator
+    def _validate_metric_params(self, attr, value):
+        """Validate init params: metric_params."""
+        if value is None:
+            return
+        # Chek if dict
+        if not isinstance(value, dict):
+            raise TypeError(
+                "Metric params: Argument must be a dictionary. "
+                "Got instead type {}".format(type(value)))
+        # Only the keys of the metric
+        options = [] if callable(self.metric) else METRIC_PARAMS.get(
+            self.metric, [])
+        invalid = [key for key in value if key not in options]
+        if invalid:
+            raise ValueError(
+                "Metric params: Got invalid keys {} for the metric '{}'. "
+                "Options are: {}".format(
+                    invalid, self.metric, ", ".join(options) or "none"))
+
+        if "p" in value:
+            p = value["p"]
+            # Chek if a real number not smaller than 1
+            if isinstance(p, bool) or not isinstance(
+                    p, (int, float, np.number)):
+                raise TypeError(
+                    "Metric params: p must be a real number. "
+                    "Got instead type {}".format(type(p)))
+            if not p >= 1:
+                raise ValueError(
+                    "Metric params: p must be 1 or larger. "
+                    "Got instead {}".format(p))
+
+        if "weights" in value:
+            weights = np.asarray(value["weights"])
+            # Chek if one positive real number per dimension
+            if weights.dtype.kind not in "uif":
+                raise TypeError(
+                    "Metric params: weights must be real numbers. "
+                    "Got instead dtype {}".format(weights.dtype))
+            if weights.shape != (self.data.shape[1],):
+                raise ValueError(
+                    "Metric params: There must be one weight for each of "
+                    "the {} dimensions. Got instead shape {}".format(
+                        self.data.shape[1], weights.shape))
+            if not np.all(np.isfinite(weights) & (weights > 0)):
+                raise ValueError(
+                    "Metric params: weights must be positive and finite. "
+                    "Got instead {}".format(weights))
+            # w_k ** (1 / p) is 1 for every weight
+            if np.isinf(value.get("p", 2.)):
+                raise ValueError(
+                    "Metric params: weights have no effect with p = inf")
+
+    @expected_radius.validator
+    def _validate_expected_radius(self, attr, value):
+        """Validate init params: expected_radius."""
+        if value is None:
+            return
+        # Chek if a positive real number
+        if not isinstance(value, (int, float, np.number)):
+            raise TypeError(
+                "Expected radius: Argument must be a real number. "
+                "Got instead type {}".format(type(value)))
+        if not value > 0:
+            raise ValueError(
+                "Expected radius: Argument must be positive. "
+                "Got instead {}".format(value))
+
+    @mean_occupancy.validator
+    def _validate_mean_occupancy(self, attr, value):
+        """Validate init params: mean_occupancy."""
+        # Chek if a positive real number
+        if not isinstance(value, (int, float, np.number)):
+            raise TypeError(
+                "Mean occupancy: Argument must be a real number. "
+                "Got instead type {}".format(type(value)))
+        if not value > 0:
+            raise ValueError(
+                "Mean occupancy: Argument must be positive. "
+                "Got instead {}".format(value))
+
     @periodic.validator
     def _validate_periodic(self, attr, value):
 
@@ -293,6 +728,107 @@ class GriSPy(object):
         """Proxy to ``periodic_conf_.periodic_flag``."""
         return self.periodic_conf_.periodic_flag
 
+    @property
+    def k_bins_(self):
+        """Bins of ``axis_bins_`` as columns, None if their lengths differ."""
+        if len(set(len(bins) for bins in self.axis_bins_)) > 1:
+            return None
+        return np.stack(self.axis_bins_, axis=1)
+
+    # =========================================================================
+    # ALTERNATIVE CONSTRUCTORS
+    # =========================================================================
+
+    @classmethod
+    def _from_index(
+        cls, data, k_bins, grid, params, time_, removed=None, overflow=None,
+        vectors=None,
+    ):
+        """Create a GriSPy around an already built grid.
+
+        The grid is not built again and the data is not validated nor
+        copied, so the arrays can be views of memory owned by someone else.
+        ``params`` has the init params other than the data. ``removed`` and
+        ``overflow`` are those of a grid edited with insert and remove.
+        ``vectors`` are the unit vectors of a grid with unit_vectors, they
+        are computed from the data if not given.
+
+        """
+        gsp = cls.__new__(cls)
+        for field in attr.fields(cls):
+            if not field.init or field.name == "data":
+                continue
+            if field.name in params:
+                value = params[field.name]
+            elif isinstance(field.default, attr.Factory):
+                value = field.default.factory()
+            else:
+                value = field.default
+            setattr(gsp, field.name, value)
+
+        gsp.data = data
+        gsp.copy_data = False
+        gsp.vectors_ = None
+        if gsp.unit_vectors:
+            gsp.vectors_ = vectors
+            if vectors is None:
+                gsp.vectors_ = distances.unit_vectors(data)
+        gsp.dim_ = gsp._grid_data().shape[1]
+        gsp.periodic, gsp.periodic_conf_ = gsp._build_periodicity(
+            periodic=gsp.periodic, dim=gsp.dim_)
+        gsp.grid_ = grid
+        gsp.axis_bins_ = k_bins
+        gsp.n_cells_ = np.array([len(bins) - 1 for bins in k_bins])
+        gsp.time_ = time_
+        gsp.removed_ = removed
+        if removed is None:
+            gsp.removed_ = np.zeros(len(data), dtype=bool)
+        gsp.overflow_ = EMPTY_ARRAY.copy() if overflow is None else overflow
+        indexed = np.append(grid.order, gsp.overflow_)
+        gsp.n_tombstones_ = int(np.count_nonzero(gsp.removed_[indexed]))
+        gsp.shared_blocks_ = None
+        return gsp
+
+    @classmethod
+    def _from_arrays(cls, arrays, params, time_):
+        """Create a GriSPy from the arrays given by ``_index_arrays``."""
+        grid = {
+            name.split(".", 1)[1]: array
+            for name, array in arrays.items() if name.startswith("grid_.")}
+        # one array of bins for each axis of the grid
+        n_axes = sum(name.startswith("axis_bins_.") for name in arrays)
+        k_bins = [arrays["axis_bins_.{}".format(k)] for k in range(n_axes)]
+        return cls._from_index(
+            data=arrays["data"], k_bins=k_bins,
+            grid=CellIndex(**grid), params=params, time_=time_,
+            removed=arrays.get("removed_"), overflow=arrays.get("overflow_"),
+            vectors=arrays.get("vectors_"))
+
+    def _index_arrays(self):
+        """Return the arrays that describe the built grid, by name."""
+        arrays = {"data": self.data}
+        if self.unit_vectors:
+            # the points indexed in the grid
+            arrays["vectors_"] = self.vectors_
+        for k, bins in enumerate(self.axis_bins_):
+            arrays["axis_bins_.{}".format(k)] = bins
+        for name, value in attr.asdict(self.grid_, recurse=False).items():
+            if value is not None:
+                arrays["grid_." + name] = value
+        # only the grids edited with insert and remove
+        if np.any(self.removed_):
+            arrays["removed_"] = self.removed_
+        if len(self.overflow_):
+            arrays["overflow_"] = self.overflow_
+        return arrays
+
+    def _init_params(self):
+        """Return the init params of the grid other than the data."""
+        return {
+            field.name: getattr(self, field.name)
+            for field in attr.fields(type(self))
+            if field.init and field.name != "data"}
+
     # =========================================================================
     # INTERNAL IMPLEMENTATION
     # =========================================================================
@@ -350,94 +886,839 @@ class GriSPy(object):
     def _digitize(self, data, bins):
         """Return data bin index."""
         N = len(bins) - 1
-        d = (N * (data - bins[0]) / (bins[-1] - bins[0])).astype(np.int)
+        d = (N * (data - bins[0]) / (bins[-1] - bins[0])).astype(int)
         return d
 
-    def _build_grid(self, data, N_cells, dim, epsilon=1.0e-6):
+    def _floor_cell(self, data, bins):
+        """Return data bin index, also for the data out of the bins."""
+        N = len(bins) - 1
+        d = np.floor(N * (data - bins[0]) / (bins[-1] - bins[0]))
+        return d.astype(int)
+
+    def _flat_cell(self, k_digit, n_cells):
+        """Return the flat index of the cells given by their k-dim index."""
+        return np.ravel_multi_index(k_digit.T, tuple(n_cells), order="F")
+
+    def _resolve_n_cells(self, data, dim):
+        """Return the number of cells of the grid along each axis."""
+        if not isinstance(self.N_cells, str):
+            return np.broadcast_to(self.N_cells, dim).astype(int)
+
+        # 'auto': cubic cells with the mean occupancy asked, or not much
+        # smaller than the expected radius
+        wrapped_axes = self._wrapped_axes()
+        extent = np.ptp(data, axis=0).astype(float)
+        for k in wrapped_axes:
+            extent[k] = self.periodic[k][1] - self.periodic[k][0]
+        if self.sky_bands:
+            extent[0] = self._lon_arc(data[:, 0])
+        if self.unit_vectors:
+            return self._surface_n_cells(extent)
+        n_cells = np.ones(dim, dtype=int)
+
+        # the axes thinner than a cell get a single cell, and the side is
+        # found again for the other axes
+        spread = extent > 0
+        while np.any(spread):
+            volume = np.prod(extent[spread])
+            cell_side = (volume * self.mean_occupancy / len(data)) ** (
+                1. / spread.sum())
+            if self.expected_radius is not None:
+                cell_side = max(
+                    cell_side, self.expected_radius / CELLS_PER_RADIUS)
+            thin = spread & (extent < cell_side)
+            if not np.any(thin):
+                n_cells[spread] = np.floor(extent[spread] / cell_side)
+                break
+            spread &= ~thin
+
+        if self.sky_bands and extent[0] > 0:
+            # the cells of the bands cover the full circle of longitude
+            n_cells[0] = np.floor(n_cells[0] * 360. / extent[0])
+        return n_cells
+
+    def _lon_arc(self, lon):
+        """Return the shortest arc of longitude with all the points."""
+        lon = np.sort(np.mod(lon, 360.))
+        return 360. - np.diff(lon, append=lon[0] + 360.).max()
+
+    def _surface_n_cells(self, extent):
+        """Return the cells of the grid of unit vectors with N_cells='auto'.
+
+        The vectors are on the surface of the sphere, so the cells have the
+        mean occupancy asked over the area of the sphere within the arc of
+        longitude and the band of latitude of the data.
+
+        """
+        lat = np.deg2rad(self.data[:, 1])
+        area = np.deg2rad(self._lon_arc(self.data[:, 0])) * (
+            np.sin(lat.max()) - np.sin(lat.min()))
+        cell_side = (area * self.mean_occupancy / len(self.data)) ** 0.5
+        if self.expected_radius is not None:
+            chord = distances.angle_to_chord(self.expected_radius)
+            cell_side = max(cell_side, chord / CELLS_PER_RADIUS)
+        if cell_side == 0:
+            # all the points at the same place
+            return np.ones(len(extent), dtype=int)
+        return np.maximum(np.floor(extent / cell_side), 1).astype(int)
+
+    def _build_grid(self, data, n_cells, dim, epsilon=1.0e-6):
         """Build the grid."""
-        data_ind = np.arange(len(data))
-        k_bins = np.zeros((N_cells + 1, dim))
+        if self.sky_bands:
+            # the longitude bins are those of the bands at the equator
+            lat = data[:, 1]
+            k_bins = [
+                np.linspace(0., 360., n_cells[0] + 1),
+                np.linspace(
+                    lat.min() - epsilon, lat.max() + epsilon, n_cells[1] + 1)]
+            flat_cells, _ = self._sky_cells(data, k_bins)
+            total_cells = self._sky_bands(k_bins)[1][-1]
+        else:
+            k_bins, flat_cells = self._regular_cells(
+                data, n_cells, dim, epsilon)
+            total_cells = np.prod(n_cells)
+
+        # Sort the points by cell and find where each cell starts
+        order = np.argsort(flat_cells)
+        many_cells = total_cells > SPARSE_CELLS_PER_POINT * len(data)
+        sparse = self.index_mode == "sparse" or (
+            self.index_mode == "auto" and many_cells)
+        grid = self._make_index(order, flat_cells[order], total_cells, sparse)
+        return grid, k_bins
+
+    def _regular_cells(self, data, n_cells, dim, epsilon):
+        """Bins of the regular grid and flat cell of each point."""
+        wrapped_axes = self._wrapped_axes()
+        k_bins = []
         k_digit = np.zeros(data.shape, dtype=int)
         for k in range(dim):
             k_data = data[:, k]
-            k_bins[:, k] = np.linspace(
-                k_data.min() - epsilon,
-                k_data.max() + epsilon,
-                N_cells + 1)
-            k_digit[:, k] = self._digitize(k_data, bins=k_bins[:, k])
-
-        # Check that there is at least one point per cell
-        grid = {}
-        if N_cells ** dim < len(data):
-            compact_ind = np.ravel_multi_index(
-                k_digit.T, (N_cells,) * dim, order="F")
-
-            compact_ind_sort = np.argsort(compact_ind)
-            compact_ind = compact_ind[compact_ind_sort]
-            k_digit = k_digit[compact_ind_sort]
-
-            split_ind = np.searchsorted(
-                compact_ind, np.arange(N_cells ** dim))
-            deleted_cells = np.diff(np.append(-1, split_ind)).astype(bool)
-            split_ind = split_ind[deleted_cells]
-            if split_ind[-1] > data_ind[-1]:
-                split_ind = split_ind[:-1]
-
-            list_ind = np.split(data_ind[compact_ind_sort], split_ind[1:])
-            k_digit = k_digit[split_ind]
-
-            for i, j in enumerate(k_digit):
-                grid[tuple(j)] = tuple(list_ind[i])
+            if k in wrapped_axes:
+                # the cells tile the periodic range, so they wrap around
+                bins = np.linspace(*self.periodic[k], n_cells[k] + 1)
+                k_digit[:, k] = np.mod(
+                    self._floor_cell(k_data, bins), n_cells[k])
+            else:
+                bins = np.linspace(
+                    k_data.min() - epsilon,
+                    k_data.max() + epsilon,
+                    n_cells[k] + 1)
+                k_digit[:, k] = self._digitize(k_data, bins=bins)
+            k_bins.append(bins)
+        return k_bins, self._flat_cell(k_digit, n_cells)
+
+    def _make_index(self, order, sorted_cells, total_cells, sparse):
+        """Create the cell index of the points ``order``.
+
+        ``sorted_cells`` are the flat cells of the points, sorted. A sparse
+        index keeps only the occupied cells, and at least one cell.
+
+        """
+        if sparse:
+            # only the occupied cells, where the sorted cells change
+            starts = np.flatnonzero(np.diff(sorted_cells, prepend=-1))
+            offsets = np.append(starts, len(order))
+            cells = sorted_cells[starts]
+            if len(cells) == 0:
+                cells, offsets = np.zeros(1, dtype=int), np.zeros(2, dtype=int)
+            return CellIndex(order=order, offsets=offsets, cells=cells)
+
+        offsets = np.zeros(total_cells + 1, dtype=int)
+        np.cumsum(
+            np.bincount(sorted_cells, minlength=total_cells), out=offsets[1:])
+        return CellIndex(order=order, offsets=offsets)
+
+    # Edition methods
+    def _locate(self, points):
+        """Flat cell of the points and whether they are within the bins.
+
+        The flat cell of the points out of the bins is -1.
+
+        """
+        if self.sky_bands:
+            return self._sky_cells(points, self.axis_bins_)
+
+        wrapped_axes = self._wrapped_axes()
+        strides = self._cell_strides()
+        flat_cells = np.zeros(len(points), dtype=int)
+        in_grid = np.ones(len(points), dtype=bool)
+        for k in range(self.dim_):
+            k_digit = self._floor_cell(points[:, k], self.axis_bins_[k])
+            if k in wrapped_axes:
+                k_digit %= self.n_cells_[k]
+            else:
+                in_grid &= k_digit >= 0
+                in_grid &= k_digit < self.n_cells_[k]
+            k_digit *= strides[k]
+            flat_cells += k_digit
+        flat_cells[~in_grid] = -1
+        return flat_cells, in_grid
+
+    def _insert_cells(self, indices, flat_cells):
+        """Return the cell index with the points added to the given cells.
+
+        The points are put at the end of their cells, in a single pass over
+        the index, without sorting it again.
+
+        """
+        grid = self.grid_
+        by_cell = np.argsort(flat_cells, kind="stable")
+        indices, flat_cells = indices[by_cell], flat_cells[by_cell]
+
+        if grid.cells is None:
+            position = grid.offsets[flat_cells + 1]
+            length = np.bincount(flat_cells, minlength=len(grid.offsets) - 1)
+            offsets = grid.offsets + np.append(0, np.cumsum(length))
+            cells = None
         else:
-            for i in range(len(data)):
-                cell_point = tuple(k_digit[i, :])
-                if cell_point not in grid:
-                    grid[cell_point] = [i]
-                else:
-                    grid[cell_point].append(i)
-        return grid, k_bins
+            # the end of the cell of each point, or where its cell goes
+            position = grid.offsets[
+                np.searchsorted(grid.cells, flat_cells, side="right")]
+            cells = np.union1d(grid.cells, flat_cells)
+            length = np.zeros(len(cells), dtype=int)
+            length[np.searchsorted(cells, grid.cells)] = np.diff(grid.offsets)
+            length += np.bincount(
+                np.searchsorted(cells, flat_cells), minlength=len(cells))
+            offsets = np.append(0, np.cumsum(length))
 
-    def _distance(self, centre_0, centres):
-        """Compute distance between points.
+        order = np.insert(grid.order, position, indices)
+        return CellIndex(order=order, offsets=offsets, cells=cells)
 
-        metric options: 'euclid', 'sphere'
+    def _filter_index(self, keep):
+        """Return the cell index with only the points ``order[keep]``.
 
-        Notes: In the case of 'sphere' metric, the input units must be degrees.
+        The kept points do not move within their cells. A sparse index
+        drops the cells left empty, but keeps at least one cell.
 
         """
-        if len(centres) == 0:
-            return EMPTY_ARRAY.copy()
-        metric_func = (
-            self.metric if callable(self.metric) else METRICS[self.metric])
-        return metric_func(centre_0, centres, self.dim_)
+        grid = self.grid_
+        kept = np.append(0, np.cumsum(keep))
+        offsets, cells = kept[grid.offsets], grid.cells
+        occupied = np.diff(offsets) > 0
+        if cells is not None and np.any(occupied):
+            cells = cells[occupied]
+            offsets = np.append(offsets[:-1][occupied], offsets[-1])
+        return CellIndex(order=grid.order[keep], offsets=offsets, cells=cells)
+
+    def _compact(self):
+        """Drop the removed points from the cell index."""
+        if not self.n_tombstones_:
+            return
+        self.grid_ = self._filter_index(~self.removed_[self.grid_.order])
+        self.overflow_ = self.overflow_[~self.removed_[self.overflow_]]
+        self.n_tombstones_ = 0
 
-    def _get_neighbor_distance(self, centres, neighbor_cells):
-        """Retrieve neighbor distances whithin the given cells."""
-        # combine the centres with the neighbors
-        centres_ngb = zip(centres, neighbor_cells)
+    # Sky bands methods
+    def _sky_bands(self, k_bins):
+        """Return the cells of each band and where its flat cells start.
 
-        n_idxs, n_dis = [], []
-        for centre, neighbors in centres_ngb:
+        The longitude cells of a band cover the full circle. A band has the
+        cells of the equator times the cosine of its latitude closest to the
+        equator, so its cells are about as wide as those at the equator.
 
-            if len(neighbors) == 0:  # no hay celdas vecinas
-                n_idxs.append(EMPTY_ARRAY.copy())
-                n_dis.append(EMPTY_ARRAY.copy())
-                continue
+        """
+        n_lon = len(k_bins[0]) - 1
+        lat_bins = np.deg2rad(np.clip(k_bins[1], -90., 90.))
+        low, high = lat_bins[:-1], lat_bins[1:]
+        equator = (low <= 0) & (high >= 0)
+        widest = np.where(
+            equator, 1., np.maximum(np.cos(low), np.cos(high)))
+        band_cells = np.maximum(1, np.ceil(n_lon * widest)).astype(int)
+        return band_cells, np.append(0, np.cumsum(band_cells))
+
+    def _sky_cells(self, points, k_bins):
+        """Flat cell of the points in the sky bands and if they are in a band.
+
+        The flat cell of the points out of the bands is -1.
+
+        """
+        band_cells, band_starts = self._sky_bands(k_bins)
+        bands = self._floor_cell(points[:, 1], k_bins[1])
+        in_grid = (bands >= 0) & (bands < len(band_cells))
+        bands = bands[in_grid]
+
+        lon = np.mod(points[in_grid, 0], 360.)
+        lon_cells = (lon * band_cells[bands] / 360.).astype(int)
+        np.minimum(lon_cells, band_cells[bands] - 1, out=lon_cells)
+
+        flat_cells = np.full(len(points), -1)
+        flat_cells[in_grid] = band_starts[bands] + lon_cells
+        return flat_cells, in_grid
+
+    def _cap_half_width(self, lat, radius, band_low, band_high):
+        """Longitude half width of the caps of the centres over the bands.
+
+        All in degrees. The cap of a centre at latitude ``lat`` spans the
+        widest longitude at the latitude ``asin(sin(lat) / cos(radius))``,
+        and less the farther from it, so only the latitude of the band
+        closest to it is checked. The caps over a pole span the full circle,
+        a half width of 180.
+
+        """
+        phi, rad = np.deg2rad(lat), np.deg2rad(np.minimum(radius, 180.))
+        low = np.deg2rad(np.clip(np.maximum(band_low, lat - radius), -90, 90))
+        high = np.deg2rad(
+            np.clip(np.minimum(band_high, lat + radius), -90, 90))
+
+        # the caps over a pole are fixed afterwards
+        with np.errstate(divide="ignore", invalid="ignore"):
+            widest = np.arcsin(np.clip(np.sin(phi) / np.cos(rad), -1, 1))
+            psi = np.clip(widest, low, high)
+            cos_width = np.cos(rad) - np.sin(phi) * np.sin(psi)
+            cos_width /= np.cos(phi) * np.cos(psi)
+            half_width = np.rad2deg(np.arccos(np.clip(cos_width, -1, 1)))
+
+        over_pole = (lat + radius >= 90) | (lat - radius <= -90)
+        half_width[over_pole] = 180.
+        return half_width
+
+    def _expand_ranges(self, first, length):
+        """Owner and value of each item of the ranges ``first + arange``."""
+        owners = np.repeat(np.arange(len(length)), length)
+        starts = np.repeat(first - (np.cumsum(length) - length), length)
+        return owners, starts + np.arange(len(owners))
+
+    def _sky_neighbor_cells(self, centres, distance_upper_bound):
+        """Retrieve the cells of the sky bands touched by the search radius.
+
+        The bands within the latitudes of the search cap are visited, each
+        one over the longitudes the cap spans within the band, which wrap
+        around the circle. The results are those of ``_get_neighbor_cells``
+        without classification.
+
+        """
+        lat_bins = self.axis_bins_[1]
+        band_cells, band_starts = self._sky_bands(self.axis_bins_)
+        n_bands = len(band_cells)
+        lon, lat = np.mod(centres[:, 0], 360.), centres[:, 1]
+        # the distances have rounding errors, be conservative
+        radius = distance_upper_bound + CELL_TOLERANCE * 360.
+
+        # the bands of each centre
+        band_min = self._floor_cell(lat - radius, lat_bins)
+        band_max = self._floor_cell(lat + radius, lat_bins)
+        out_of_field = (band_max < 0) | (band_min >= n_bands)
+        band_min = np.clip(band_min, 0, n_bands - 1)
+        band_max = np.clip(band_max, 0, n_bands - 1)
+        n_pair_bands = np.maximum(band_max - band_min + 1, 0)
+        n_pair_bands[out_of_field] = 0
+        centre_ids, bands = self._expand_ranges(band_min, n_pair_bands)
+
+        # the cells of each band, at most the whole band
+        half_width = self._cap_half_width(
+            lat[centre_ids], radius[centre_ids],
+            lat_bins[bands], lat_bins[bands + 1])
+        n_lon = band_cells[bands]
+        cell_width = 360. / n_lon
+        lon_min = np.floor((lon[centre_ids] - half_width) / cell_width)
+        lon_max = np.floor((lon[centre_ids] + half_width) / cell_width)
+        n_pair_cells = np.minimum(lon_max - lon_min + 1, n_lon).astype(int)
+        pairs, lon_cells = self._expand_ranges(
+            lon_min.astype(int), n_pair_cells)
+
+        neighbor_cells = band_starts[bands[pairs]] + lon_cells % n_lon[pairs]
+        centre_ids = centre_ids[pairs]
+        if self.grid_.cells is not None:
+            # the empty cells are not in a sparse index
+            occupied = self._occupied(neighbor_cells)
+            centre_ids, neighbor_cells = (
+                centre_ids[occupied], neighbor_cells[occupied])
+        return centre_ids, neighbor_cells
+
+    # Unit vectors methods
+    def _grid_data(self):
+        """Return the points indexed in the grid, the data or its vectors."""
+        if self.vectors_ is None:
+            return self.data
+        return self.vectors_
+
+    def _to_chords(self, centres, *bounds):
+        """Return the vectors of the centres and chords of the bounds."""
+        chords = [
+            None if bound is None else distances.angle_to_chord(bound)
+            for bound in bounds]
+        return (distances.unit_vectors(centres), *chords)
+
+    # Separable metrics methods
+    def _metric_power(self):
+        """Return the power p of the metric in the grid, None if unknown.
+
+        The grid of unit vectors is searched with the euclidean distance.
+
+        """
+        if self.unit_vectors:
+            return 2.
+        if callable(self.metric) or self.metric not in SEPARABLE_METRICS:
+            return None
+        params = self.metric_params or {}
+        return float(params.get("p", SEPARABLE_METRICS[self.metric]))
+
+    def _separable(self):
+        """Check if the metric in the grid is separable by axis."""
+        return self._metric_power() is not None
+
+    def _axis_scale(self):
+        """Return the factor of the differences along each axis.
+
+        The distance of a separable metric is that of the differences times
+        ``w_k ** (1 / p)``, with the weights ``w_k`` of metric_params.
+
+        """
+        params = self.metric_params or {}
+        if "weights" not in params:
+            return np.ones(self.dim_)
+        weights = np.asarray(params["weights"], dtype=float)
+        return weights ** (1. / self._metric_power())
+
+    def _axis_reach(self, distance):
+        """Return how far the distances reach along each axis.
+
+        A distance ``d`` reaches ``d / scale_k`` along the axis k, see
+        ``_axis_scale``. Returns an array of shape (len(distance), dim).
+
+        """
+        distance = np.asarray(distance, dtype=float)
+        return distance[:, np.newaxis] / self._axis_scale()
+
+    def _reduce(self, distance):
+        """Return the reduced distance, its power p.
+
+        The reduced distances of a separable metric are sums of one term
+        per axis, or their maximum if p is inf. They keep the order of the
+        distances, so they can be compared without taking roots.
+
+        """
+        p = self._metric_power()
+        if p == 2:
+            return distance ** 2
+        if np.isinf(p):
+            return np.abs(distance)
+        return np.abs(distance) ** p
+
+    def _unreduce(self, reduced):
+        """Return the distances of the reduced distances, in place."""
+        p = self._metric_power()
+        if p == 2:
+            return np.sqrt(reduced, out=reduced)
+        if np.isinf(p) or p == 1:
+            return reduced
+        return np.power(reduced, 1. / p, out=reduced)
+
+    def _combine_axes(self):
+        """Return the ufunc that combines the reduced terms of the axes."""
+        return np.maximum if np.isinf(self._metric_power()) else np.add
+
+    def _norm(self, diff):
+        """Distance of the displacements ``diff``, of shape (m, dim)."""
+        terms = self._reduce(diff * self._axis_scale())
+        reduced = self._combine_axes().reduce(terms, axis=1)
+        return self._unreduce(reduced)
+
+    # Periodic wrap methods
+    def _wrapped_axes(self):
+        """Return the periodic axes solved wrapping the cells."""
+        if self.periodic_mode != "wrap":
+            return []
+        return [k for k, v in sorted(self.periodic.items()) if v is not None]
+
+    def _wrap_centres(self, centres):
+        """Move the centres within the periodic range of the wrapped axes."""
+        wrapped_axes = self._wrapped_axes()
+        if not wrapped_axes:
+            return centres
+        centres = np.array(centres, dtype=float)
+        for k in wrapped_axes:
+            low, high = self.periodic[k]
+            centres[:, k] = low + np.mod(centres[:, k] - low, high - low)
+        return centres
+
+    def _min_image(self, diff):
+        """Wrap the displacements to the closest periodic image, in place.
+
+        The last axis of ``diff`` runs over the dimensions.
+
+        """
+        for k in self._wrapped_axes():
+            low, high = self.periodic[k]
+            period = high - low
+            diff[..., k] -= period * np.round(diff[..., k] / period)
+        return diff
+
+    def _cell_edges(self, k_cells, k):
+        """Lower and upper edges along the axis k of the given cells.
+
+        The cells can be out of the grid, when they wrap around a periodic
+        axis.
+
+        """
+        bins = self.axis_bins_[k]
+        cell_size = (bins[-1] - bins[0]) / self.n_cells_[k]
+        lower = bins[0] + k_cells * cell_size
+        return lower, lower + cell_size
+
+    def _grid_edges(self):
+        """Lower and upper limits of the grid along each axis."""
+        low = np.array([bins[0] for bins in self.axis_bins_])
+        high = np.array([bins[-1] for bins in self.axis_bins_])
+        return low, high
+
+    def _cell_size(self):
+        """Size of the cells along each axis."""
+        low, high = self._grid_edges()
+        return (high - low) / self.n_cells_
+
+    def _cell_slices(self, flat_cells):
+        """Position in the index of the points of each cell and how many.
+
+        The empty cells have no points, also those missing in a sparse index.
+
+        """
+        offsets = self.grid_.offsets
+        if self.grid_.cells is None:
+            start = offsets[flat_cells]
+            return start, offsets[flat_cells + 1] - start
+
+        cells = self.grid_.cells
+        position = np.searchsorted(cells, flat_cells)
+        np.minimum(position, len(cells) - 1, out=position)
+        start = offsets[position]
+        length = offsets[position + 1] - start
+        length[cells[position] != flat_cells] = 0
+        return start, length
+
+    def _occupied(self, flat_cells):
+        """Check if the cells have points."""
+        return self._cell_slices(flat_cells)[1] > 0
+
+    def _cells_points(self, flat_cells):
+        """Return the indices of the points within the given flat cells.
+
+        The number of points found in each cell is also returned, so the
+        indices can be mapped back to the cell that contains them. The
+        removed points are skipped.
+
+        """
+        start, length = self._cell_slices(flat_cells)
+        total = length.sum()
+
+        # position in order of each point: the start of its cell plus the
+        # running count inside the cell
+        first = np.cumsum(length) - length
+        pos = np.arange(total) + np.repeat(start - first, length)
+        inds = self.grid_.order[pos]
+        if self.n_tombstones_:
+            alive = ~self.removed_[inds]
+            cell_ids = np.repeat(np.arange(len(length)), length)
+            length = np.bincount(cell_ids[alive], minlength=len(length))
+            inds = inds[alive]
+        return inds, length
+
+    def _overflow_neighbors(
+        self, centres, distance_upper_bound, distance_lower_bound=None,
+        roots=True,
+    ):
+        """Find the neighbors among the points out of the grid.
+
+        Those points are in no cell, so they are tested against every
+        centre. The results are flat as those of ``_get_neighbors``.
+
+        """
+        overflow = self.overflow_[~self.removed_[self.overflow_]]
+        centre_ids = np.repeat(np.arange(len(centres)), len(overflow))
+        indices = np.tile(overflow, len(centres))
+        reduced = self._separable()
+        distances = self._pair_distance(
+            centres, centre_ids, self._grid_data()[indices], reduced=reduced)
+
+        upper = distance_upper_bound[centre_ids]
+        if reduced:
+            upper = self._reduce(upper)
+        mask_distances = distances <= upper
+        if distance_lower_bound is not None:
+            lower = distance_lower_bound[centre_ids]
+            if reduced:
+                lower = self._reduce(lower)
+            mask_distances &= distances > lower
+
+        centre_ids = centre_ids[mask_distances]
+        distances = distances[mask_distances]
+        indices = indices[mask_distances]
+        if reduced and roots:
+            self._unreduce(distances)
+        return centre_ids, distances, indices
+
+    def _add_overflow(
+        self, neighbors, centres, distance_upper_bound,
+        distance_lower_bound=None, roots=True,
+    ):
+        """Merge the neighbors out of the grid into the flat ``neighbors``."""
+        if len(self.overflow_) == 0:
+            return neighbors
+        overflow = self._overflow_neighbors(
+            centres, distance_upper_bound, distance_lower_bound, roots=roots)
+        return self._merge_groups(*[
+            [found, more] for found, more in zip(neighbors, overflow)])
+
+    def _metric_func(self):
+        """Return the metric as a batched metric.
+
+        The callables of the per-centre protocol are adapted, see
+        ``grispy.distances``. In the case of the 'haversine' and 'vincenty'
+        metrics the input units must be degrees.
+
+        """
+        if not callable(self.metric):
+            return METRICS[self.metric]
+        if distances.is_batched(self.metric):
+            return self.metric
+        return distances.per_centre(self.metric)
+
+    def _pair_distance(self, centres, centre_ids, points, reduced=False):
+        """Compute the distance of each point to the centre it is paired with.
+
+        ``centre_ids`` must be sorted, so the points of each centre are
+        contiguous, and the metric gets all the pairs at once. With wrapped
+        axes the distance is computed to the periodic image of each point
+        that is closest to its centre. With a metric separable by axis the
+        reduced distances are returned if ``reduced`` is True, see
+        ``_reduce``.
+
+        """
+        wrapped_axes = self._wrapped_axes()
+        if self._separable():
+            scale = self._axis_scale()
+            combine = self._combine_axes()
+            dis = np.zeros(len(points))
+            for k in range(self.dim_):
+                k_diff = points[:, k] - centres[centre_ids, k]
+                if k in wrapped_axes:
+                    low, high = self.periodic[k]
+                    k_diff -= (high - low) * np.round(k_diff / (high - low))
+                if scale[k] != 1:
+                    k_diff *= scale[k]
+                combine(dis, self._reduce(k_diff), out=dis)
+            return dis if reduced else self._unreduce(dis)
+
+        if wrapped_axes:
+            pair_centres = centres[centre_ids]
+            points = pair_centres + self._min_image(points - pair_centres)
+        return self._metric_func()(centres, centre_ids, points)
+
+    def _get_neighbor_distance(
+        self, centres, centre_ids, neighbor_cells, reduced=False,
+    ):
+        """Retrieve neighbor distances whithin the given cells.
+
+        Returns
+        -------
+        centre_ids: ndarray
+            Index of the centre of each neighbor, sorted.
+        distances: ndarray
+            Distance of each neighbor to its centre.
+        indices: ndarray
+            Index of each neighbor in the data.
+
+        """
+        inds, length = self._cells_points(neighbor_cells)
+        inds_centre = np.repeat(centre_ids, length)
+        dis = self._pair_distance(
+            centres, inds_centre, self._grid_data()[inds], reduced=reduced)
+        return inds_centre, dis, inds
+
+    def _get_neighbors(
+        self, centres, distance_upper_bound, distance_lower_bound=None,
+        roots=True, need_distance=True,
+    ):
+        """Retrieve the neighbors within the given distances.
 
-            # Genera una lista con los vecinos de cada celda
-            ind_tmp = [self.grid_.get(nt, []) for nt in map(tuple, neighbors)]
+        The results are flat as those of ``_get_neighbor_distance``. The
+        neighbors at a distance ``d`` of its centre are kept if ``d <= upper``
+        and, if a lower bound is given, ``d > lower``. If ``roots`` is False
+        the reduced distances can be returned with a separable metric, they
+        are only good to sort the neighbors. If ``need_distance`` is False the
+        distances of the points accepted with their whole cell can be left
+        as NaN.
 
-            # Une en una sola lista todos sus vecinos
-            inds = np.fromiter(itertools.chain(*ind_tmp), dtype=np.int)
-            n_idxs.append(inds)
+        """
+        if self._use_numba():
+            return self._run_kernel(
+                centres, distance_upper_bound, distance_lower_bound)[:3]
+
+        neighbors = self._get_grid_neighbors(
+            centres, distance_upper_bound, distance_lower_bound, roots=roots,
+            need_distance=need_distance)
+        return self._add_overflow(
+            neighbors, centres, distance_upper_bound, distance_lower_bound,
+            roots=roots)
+
+    def _get_grid_neighbors(
+        self, centres, distance_upper_bound, distance_lower_bound, roots,
+        need_distance,
+    ):
+        """Retrieve the neighbors within the cells of the grid."""
+        # With a separable metric the cells entirely within the distances are
+        # accepted whole, and the reduced distances are filtered and only the
+        # roots of the kept ones are taken
+        reduced = self._separable()
+        if distance_lower_bound is None:
+            cells = self._get_neighbor_cells(
+                centres, distance_upper_bound, classify=reduced)
+        else:
+            cells = self._get_neighbor_cells(
+                centres,
+                distance_upper_bound=distance_upper_bound,
+                distance_lower_bound=distance_lower_bound,
+                shell_flag=True,
+                classify=reduced)
+
+        if reduced:
+            centre_ids, distances, indices, inside = self._classified_distance(
+                centres, *cells, need_distance=need_distance)
+        else:
+            centre_ids, distances, indices = self._get_neighbor_distance(
+                centres, *cells)
+
+        upper = distance_upper_bound[centre_ids]
+        if reduced:
+            upper = self._reduce(upper)
+        mask_distances = distances <= upper
+        if distance_lower_bound is not None:
+            lower = distance_lower_bound[centre_ids]
+            if reduced:
+                lower = self._reduce(lower)
+            mask_distances &= distances > lower
+        if reduced:
+            mask_distances |= inside
+
+        centre_ids = centre_ids[mask_distances]
+        distances = distances[mask_distances]
+        indices = indices[mask_distances]
+        if reduced and roots:
+            self._unreduce(distances)
+        return centre_ids, distances, indices
+
+    def _classified_distance(
+        self, centres, centre_ids, neighbor_cells, inside, need_distance,
+    ):
+        """Retrieve the reduced distances of the points within the cells.
+
+        ``inside`` flags the cells entirely within the search distances, the
+        distances of their points are only computed if ``need_distance`` is
+        True, otherwise they are NaN. Returns the same flat arrays of
+        ``_get_neighbor_distance`` and if each point is in an inside cell.
+
+        """
+        inds, length = self._cells_points(neighbor_cells)
+        inds_centre = np.repeat(centre_ids, length)
+        inside = np.repeat(inside, length)
+        points = self._grid_data()
+        if need_distance:
+            dis = self._pair_distance(
+                centres, inds_centre, points[inds], reduced=True)
+            return inds_centre, dis, inds, inside
+
+        boundary = ~inside
+        dis = np.full(len(inds), np.nan)
+        dis[boundary] = self._pair_distance(
+            centres, inds_centre[boundary], points[inds[boundary]],
+            reduced=True)
+        return inds_centre, dis, inds, inside
+
+    def _count_neighbors(self, centres, distance_upper_bound):
+        """Count the neighbors within the given distances.
+
+        With a separable metric the cells entirely within the distance are
+        counted from the index, without computing any distance.
 
-            if self.dim_ == 1:
-                dis = self._distance(centre, self.data[inds])
+        """
+        if self._use_numba():
+            return self._run_kernel(
+                centres, distance_upper_bound, count_only=True)[3]
+
+        counts = np.zeros(len(centres), dtype=int)
+        reduced = self._separable()
+        cells = self._get_neighbor_cells(
+            centres, distance_upper_bound, classify=reduced)
+        if reduced:
+            # the cells entirely within the distance are counted whole
+            centre_ids, neighbor_cells, inside = cells
+            if self.n_tombstones_:
+                _, length = self._cells_points(neighbor_cells[inside])
             else:
-                dis = self._distance(centre, self.data.take(inds, axis=0))
-            n_dis.append(dis)
+                _, length = self._cell_slices(neighbor_cells[inside])
+            counts += np.bincount(
+                centre_ids[inside], weights=length,
+                minlength=len(centres)).astype(int)
+            cells = centre_ids[~inside], neighbor_cells[~inside]
+
+        centre_ids, distances, _ = self._get_neighbor_distance(
+            centres, *cells, reduced=reduced)
+        upper = distance_upper_bound[centre_ids]
+        if reduced:
+            upper = self._reduce(upper)
+        counts += np.bincount(
+            centre_ids[distances <= upper], minlength=len(centres))
+
+        if len(self.overflow_):
+            overflow_ids, _, _ = self._overflow_neighbors(
+                centres, distance_upper_bound, roots=False)
+            counts += np.bincount(overflow_ids, minlength=len(centres))
+        return counts
+
+    def _run_kernel(
+        self, centres, distance_upper_bound, distance_lower_bound=None,
+        count_only=False,
+    ):
+        """Search the neighbors with the compiled kernel.
 
-        return n_dis, n_idxs
+        The kernel walks the cell index as it is, so in an edited grid the
+        removed points are dropped and the points out of the grid are added
+        afterwards.
+
+        """
+        from . import kernels
+
+        lower_bound = distance_lower_bound
+        if distance_lower_bound is None:
+            distance_lower_bound = np.full(len(centres), -np.inf)
+        periods = np.zeros(self.dim_)
+        for k in self._wrapped_axes():
+            periods[k] = self.periodic[k][1] - self.periodic[k][0]
+        cells = self.grid_.cells
+        if cells is None:
+            cells = EMPTY_ARRAY
+        edited = self.n_tombstones_ or len(self.overflow_)
+        result = kernels.euclid_neighbors(
+            np.asarray(centres, dtype=float),
+            np.asarray(distance_upper_bound, dtype=float),
+            np.asarray(distance_lower_bound, dtype=float),
+            self._grid_data(), self.grid_.order, self.grid_.offsets, cells,
+            *self._grid_edges(), self.n_cells_, periods,
+            count_only and not edited)
+        if not edited:
+            return result
+
+        centre_ids, distances, indices, _ = result
+        if self.n_tombstones_:
+            alive = ~self.removed_[indices]
+            centre_ids = centre_ids[alive]
+            distances = distances[alive]
+            indices = indices[alive]
+        centre_ids, distances, indices = self._add_overflow(
+            (centre_ids, distances, indices), centres, distance_upper_bound,
+            lower_bound)
+        counts = np.bincount(centre_ids, minlength=len(centres))
+        return centre_ids, distances, indices, counts
+
+    def _use_numba(self):
+        """Check if the searches run in the compiled kernels."""
+        if self.backend != "numba" or self._metric_power() != 2:
+            return False
+        if "weights" in (self.metric_params or {}):
+            return False
+        from . import kernels
+
+        return kernels.NUMBA_AVAILABLE
 
     # Neighbor-cells methods
     def _get_neighbor_cells(
@@ -446,132 +1727,1195 @@ class GriSPy(object):
         distance_upper_bound,
         distance_lower_bound=0,
         shell_flag=False,
+        classify=False,
     ):
-        """Retrieve cells touched by the search radius."""
+        """Retrieve cells touched by the search radius.
+
+        With a metric separable by axis the cells are pruned with the exact
+        distance from the centre to their closest and farthest points. With
+        other metrics the distance to the cell centre and the cell radii are
+        used. If ``classify`` is True the cells entirely within the search
+        radius (or the shell) are also flagged, all their points are
+        neighbors. Only the separable metrics can classify the cells.
+
+        Returns
+        -------
+        centre_ids: ndarray
+            Index of the centre of each pair, sorted.
+        neighbor_cells: ndarray
+            Flat index of the cell of each pair.
+        inside: ndarray
+            Only if classify is True. Whether the cell of each pair is
+            entirely within the search radius.
+
+        """
+        if self.sky_bands:
+            return self._sky_neighbor_cells(centres, distance_upper_bound)
+
+        cell_ranges = self._cell_ranges(
+            centres, self._axis_reach(distance_upper_bound))
+        if cell_ranges is None:
+            # no neighbor cells
+            if classify:
+                empty_inside = EMPTY_ARRAY.astype(bool)
+                return EMPTY_ARRAY.copy(), EMPTY_ARRAY.copy(), empty_inside
+            return EMPTY_ARRAY.copy(), EMPTY_ARRAY.copy()
+        k_cell_min, k_cell_max = cell_ranges
+
+        cell_size = self._cell_size()
+        cell_radii = 0.5 * np.sum(cell_size ** 2) ** 0.5
+        # the distances have rounding errors, be conservative
+        tolerance = CELL_TOLERANCE * np.max(cell_size * self._axis_scale())
+
+        pair_centres, pair_cells, pair_inside = [], [], []
+        for group, corner, stencil in self._box_stencils(
+                k_cell_min, k_cell_max):
+            group_cells = self._box_cells(corner, stencil)
+
+            upper = distance_upper_bound[group, np.newaxis]
+            lower = None
+            if shell_flag:
+                lower = distance_lower_bound[group, np.newaxis]
+
+            if self._separable():
+                # Distancia exacta al punto mas cercano y al mas lejano de
+                # cada celda, las celdas que no toca la esfera se descartan
+                near, far = self._cells_bounds(
+                    centres[group], corner, stencil, cell_size,
+                    with_far=classify or shell_flag)
+                mask_cells = near <= self._reduce(upper + tolerance)
+                if shell_flag:
+                    lower_reach = lower - tolerance
+                    mask_cells &= far > np.where(
+                        lower_reach > 0, self._reduce(lower_reach), -1.)
+            else:
+                # Calculo la distancia de cada centro a sus celdas vecinas,
+                # luego descarto las celdas que no toca el circulo definido
+                # por la distancia
+                cells_distance = self._cells_distance(
+                    centres[group], corner, stencil, cell_size)
+                mask_cells = cells_distance < upper + cell_radii
+                if shell_flag:
+                    mask_cells *= cells_distance > lower - cell_radii
+
+            if self.grid_.cells is not None:
+                # the empty cells are not in a sparse index
+                mask_cells &= self._occupied(group_cells)
+
+            pair_centres.append(group[np.nonzero(mask_cells)[0]])
+            pair_cells.append(group_cells[mask_cells])
+            if not classify:
+                continue
+
+            # Las celdas enteramente dentro del radio no se testean
+            upper_reach = upper - tolerance
+            inside = far <= np.where(
+                upper_reach >= 0, self._reduce(upper_reach), -1.)
+            if shell_flag:
+                lower_reach = lower + tolerance
+                inside &= near > np.where(
+                    lower_reach > 0, self._reduce(lower_reach), -1.)
+            pair_inside.append(inside[mask_cells])
+
+        if not classify:
+            return self._merge_groups(pair_centres, pair_cells)
+        centre_ids, neighbor_cells, inside = self._merge_groups(
+            pair_centres, pair_cells, pair_inside)
+        return centre_ids, neighbor_cells, inside.astype(bool)
+
+    def _cell_ranges(self, centres, reach):
+        """Return the box of cells that each centre reaches.
+
+        ``reach`` is how far the search of each centre spans along each
+        axis, an array of shape (len(centres), dim). Returns the first and
+        last cell of the box along each axis, or None if no centre reaches
+        the grid. Along a wrapped axis the cells can be out of the grid.
+
+        """
+        wrapped_axes = self._wrapped_axes()
         cell_point = np.zeros((len(centres), self.dim_), dtype=int)
         out_of_field = np.zeros(len(cell_point), dtype=bool)
         for k in range(self.dim_):
             cell_point[:, k] = (
-                self._digitize(centres[:, k], bins=self.k_bins_[:, k])
+                self._digitize(centres[:, k], bins=self.axis_bins_[k])
             )
+            if k in wrapped_axes:
+                # the centres are within the periodic range
+                continue
             out_of_field[
-                (centres[:, k] - distance_upper_bound > self.k_bins_[-1, k])
+                (centres[:, k] - reach[:, k] > self.axis_bins_[k][-1])
             ] = True
             out_of_field[
-                (centres[:, k] + distance_upper_bound < self.k_bins_[0, k])
+                (centres[:, k] + reach[:, k] < self.axis_bins_[k][0])
             ] = True
 
         if np.all(out_of_field):
-            # no neighbor cells
-            return [EMPTY_ARRAY.copy() for _ in centres]
+            return None
 
         # Armo la caja con celdas a explorar
         k_cell_min = np.zeros((len(centres), self.dim_), dtype=int)
         k_cell_max = np.zeros((len(centres), self.dim_), dtype=int)
         for k in range(self.dim_):
+            if k in wrapped_axes:
+                # the box can go around the axis, but only once
+                k_cell_min[:, k] = self._floor_cell(
+                    centres[:, k] - reach[:, k], self.axis_bins_[k])
+                k_cell_max[:, k] = self._floor_cell(
+                    centres[:, k] + reach[:, k], self.axis_bins_[k])
+                k_cell_len = k_cell_max[:, k] - k_cell_min[:, k] + 1
+                whole_axis = k_cell_len >= self.n_cells_[k]
+                k_cell_min[whole_axis, k] = 0
+                k_cell_max[whole_axis, k] = self.n_cells_[k] - 1
+                continue
+
             k_cell_min[:, k] = self._digitize(
-                centres[:, k] - distance_upper_bound, bins=self.k_bins_[:, k])
+                centres[:, k] - reach[:, k], bins=self.axis_bins_[k])
             k_cell_max[:, k] = self._digitize(
-                centres[:, k] + distance_upper_bound, bins=self.k_bins_[:, k])
+                centres[:, k] + reach[:, k], bins=self.axis_bins_[k])
 
-            k_cell_min[k_cell_min[:, k] < 0, k] = 0
-            k_cell_max[k_cell_max[:, k] < 0, k] = 0
-            k_cell_min[k_cell_min[:, k] >= self.N_cells, k] = self.N_cells - 1
-            k_cell_max[k_cell_max[:, k] >= self.N_cells, k] = self.N_cells - 1
-
-        cell_size = self.k_bins_[1, :] - self.k_bins_[0, :]
-        cell_radii = 0.5 * np.sum(cell_size ** 2) ** 0.5
+            k_cell_min[:, k] = np.clip(
+                k_cell_min[:, k], 0, self.n_cells_[k] - 1)
+            k_cell_max[:, k] = np.clip(
+                k_cell_max[:, k], 0, self.n_cells_[k] - 1)
+        return k_cell_min, k_cell_max
 
-        neighbor_cells = []
-        for i, centre in enumerate(centres):
-            # Para cada centro i, agrego un arreglo con shape (:,k)
-            k_grids = [
-                np.arange(k_cell_min[i, k], k_cell_max[i, k] + 1)
-                for k in range(self.dim_)]
-            k_grids = np.meshgrid(*k_grids)
-            neighbor_cells += [
-                np.array(list(map(np.ndarray.flatten, k_grids))).T]
-
-            # Calculo la distancia de cada centro i a sus celdas vecinas,
-            # luego descarto las celdas que no toca el circulo definido por
-            # la distancia
-            cells_physical = [
-                self.k_bins_[neighbor_cells[i][:, k], k] + 0.5 * cell_size[k]
-                for k in range(self.dim_)]
-
-            cells_physical = np.array(cells_physical).T
-            mask_cells = (
-                self._distance(
-                    centre, cells_physical
-                ) < distance_upper_bound[i] + cell_radii)
+    def _cell_strides(self):
+        """Return the step of the flat cell index along each axis."""
+        return np.cumprod(np.append(1, self.n_cells_[:-1]))
 
-            if shell_flag:
-                mask_cells *= (
-                    self._distance(
-                        centre, cells_physical
-                    ) > distance_lower_bound[i] - cell_radii)
+    def _box_cells(self, corner, stencil):
+        """Flat index of the cells ``corner + stencil`` of each box.
 
-            if np.any(mask_cells):
-                neighbor_cells[i] = neighbor_cells[i][mask_cells]
-            else:
-                neighbor_cells[i] = EMPTY_ARRAY.copy()
-        return neighbor_cells
+        The cells out of the grid along a wrapped axis are taken modulo the
+        number of cells.
 
-    def _near_boundary(self, centres, distance_upper_bound):
-        mask = np.zeros((len(centres), self.dim_), dtype=bool)
-        for k in range(self.dim_):
-            if self.periodic[k] is None:
+        """
+        strides = self._cell_strides()
+        cells = np.add.outer(corner.dot(strides), strides.dot(stencil))
+        for k in self._wrapped_axes():
+            # number of turns around the axis of each row of cells, only the
+            # boxes that cross the edges need to be fixed
+            k_cells = corner[:, k, np.newaxis] + np.arange(
+                stencil[k].max() + 1)
+            turns = np.floor_divide(k_cells, self.n_cells_[k])
+            crossing = np.flatnonzero(np.any(turns, axis=1))
+            if len(crossing) == 0:
                 continue
-            mask[:, k] = abs(
-                centres[:, k] - self.periodic[k][0]) < distance_upper_bound
-            mask[:, k] += abs(
-                centres[:, k] - self.periodic[k][1]) < distance_upper_bound
-        return mask.sum(axis=1, dtype=bool)
-
-    def _mirror(self, centre, distance_upper_bound):
-        pd_hi, pd_low, periodic_edges, periodic_direc = (
-            self.periodic_conf_.pd_hi, self.periodic_conf_.pd_low,
-            self.periodic_conf_.periodic_edges,
-            self.periodic_conf_.periodic_direc)
+            fix = (self.n_cells_[k] * strides[k]) * turns[crossing]
+            cells[crossing] -= fix[:, stencil[k]]
+        return cells
 
-        mirror_centre = centre - periodic_edges
+    def _box_stencils(self, k_cell_min, k_cell_max):
+        """Group the boxes of cells by shape.
 
-        mask = periodic_direc * distance_upper_bound
-        mask = mask + mirror_centre
-        mask = (mask >= pd_low) * (mask <= pd_hi)
-        mask = np.prod(mask, 1, dtype=bool)
-        return mirror_centre[mask]
+        The boxes with the same shape share the same stencil of cell offsets,
+        so the cells of each box are its corner plus the stencil. For each
+        shape yields the index of its boxes, their corners and the stencil,
+        with shape (k, cells per box) and the axis 0 varying faster.
 
-    def _mirror_universe(self, centres, distance_upper_bound):
-        """Generate Terran centres in the Mirror Universe."""
-        terran_centres = np.array([[]] * self.dim_).T
-        terran_indices = np.array([], dtype=int)
-        near_boundary = self._near_boundary(centres, distance_upper_bound)
-        if not np.any(near_boundary):
-            return terran_centres, terran_indices
+        With a sparse index the boxes with more cells than the occupied ones
+        are instead made of their occupied cells, see ``_occupied_boxes``.
 
-        for i, centre in enumerate(centres):
-            if not near_boundary[i]:
+        """
+        max_size = np.inf
+        if self.grid_.cells is not None:
+            max_size = len(self.grid_.cells)
+
+        k_cell_len = k_cell_max - k_cell_min + 1
+        shapes, shape_ids = np.unique(
+            k_cell_len, axis=0, return_inverse=True)
+        shape_ids = shape_ids.reshape(-1)
+        for i, shape in enumerate(shapes):
+            group = np.flatnonzero(shape_ids == i)
+            if np.prod(shape, dtype=float) > max_size:
+                yield from self._occupied_boxes(
+                    group, k_cell_min[group], k_cell_max[group])
                 continue
-            mirror_centre = self._mirror(centre, distance_upper_bound[i])
-            if len(mirror_centre) > 0:
-                terran_centres = np.concatenate(
-                    (terran_centres, mirror_centre), axis=0)
-                terran_indices = np.concatenate(
-                    (terran_indices, np.repeat(i, len(mirror_centre))))
-        return terran_centres, terran_indices
-
-    # =========================================================================
-    # PERIODICITY
-    # =========================================================================
+            stencil = np.indices(shape[::-1]).reshape(self.dim_, -1)[::-1]
+            yield group, k_cell_min[group], stencil
 
-    def set_periodicity(self, periodic, inplace=False):
-        """Set periodicity conditions.
+    def _occupied_boxes(self, group, k_cell_min, k_cell_max):
+        """Split the boxes of cells into their occupied cells.
 
-        This allows to define or change the periodicity limits without
-        having to construct the grid again.
+        Each occupied cell of a box is yielded as a box of a single cell,
+        with the index of its centre, the cell as the corner and a stencil
+        with no offset. Along a wrapped axis the cell
+        is numbered as in the box, from ``k_cell_min`` on.
 
-        Important: The periodicity only works within one periodic range.
+        """
+        k_occupied = np.stack(np.unravel_index(
+            self.grid_.cells, self.n_cells_, order="F"), axis=1)
+        wrapped = np.zeros(self.dim_, dtype=bool)
+        wrapped[self._wrapped_axes()] = True
+        stencil = np.zeros((self.dim_, 1), dtype=int)
+
+        # bounded memory, each centre is tested against every occupied cell
+        chunk = max(1, BOX_CHUNK_SIZE // len(k_occupied))
+        for start in range(0, len(group), chunk):
+            k_min = k_cell_min[start:start + chunk, np.newaxis]
+            k_max = k_cell_max[start:start + chunk, np.newaxis]
+            k_cells = np.where(
+                wrapped, k_min + (k_occupied - k_min) % self.n_cells_,
+                k_occupied)
+            in_box = np.all((k_cells >= k_min) & (k_cells <= k_max), axis=2)
+            box_ids, cell_ids = np.nonzero(in_box)
+            corner = k_cells[box_ids, cell_ids]
+            yield group[start + box_ids], corner, stencil
+
+    def _merge_groups(self, pair_centres, *pair_arrays):
+        """Join the (centre, cell) pairs found by groups, sorted by centre.
+
+        ``pair_arrays`` are the cells of the pairs and any other value of
+        them, they are sorted as the centres.
+
+        """
+        if len(pair_centres) == 0:
+            return (EMPTY_ARRAY.copy(),) * (len(pair_arrays) + 1)
+
+        centre_ids = np.concatenate(pair_centres)
+        arrays = [np.concatenate(pair_array) for pair_array in pair_arrays]
+        if len(pair_centres) > 1:
+            # each group is sorted by centre, so merging them is cheap
+            by_centre = np.argsort(centre_ids, kind="stable")
+            centre_ids = centre_ids[by_centre]
+            arrays = [array[by_centre] for array in arrays]
+        return (centre_ids, *arrays)
+
+    def _cells_bounds(
+        self, centres, corner, stencil, cell_size, with_far=True,
+    ):
+        """Distance from each centre to the cells of its box.
+
+        The box of the centre ``i`` is made of the cells ``corner[i] +
+        stencil``. The reduced distances to the closest and to the farthest
+        point of each cell are returned, as arrays of shape (len(centres),
+        stencil size). The metric is separable by axis, so the bounds are
+        computed once for each row of cells and then combined. If
+        ``with_far`` is False only the closest distance is computed.
+
+        """
+        n_stencil = stencil.shape[1]
+        near = np.zeros((len(centres), n_stencil))
+        far = np.zeros((len(centres), n_stencil)) if with_far else None
+        wrapped_axes = self._wrapped_axes()
+        scale = self._axis_scale()
+        combine = self._combine_axes()
+        for k in range(self.dim_):
+            k_cells = corner[:, k, np.newaxis] + np.arange(
+                stencil[k].max() + 1)
+            k_low, _ = self._cell_edges(k_cells, k)
+            k_diff = k_low + 0.5 * cell_size[k] - centres[:, k, np.newaxis]
+            if k in wrapped_axes:
+                low, high = self.periodic[k]
+                k_diff -= (high - low) * np.round(k_diff / (high - low))
+            np.abs(k_diff, out=k_diff)
+
+            k_near = np.maximum(k_diff - 0.5 * cell_size[k], 0.) * scale[k]
+            combine(near, self._reduce(k_near)[:, stencil[k]], out=near)
+            if with_far:
+                k_far = (k_diff + 0.5 * cell_size[k]) * scale[k]
+                combine(far, self._reduce(k_far)[:, stencil[k]], out=far)
+        return near, far
+
+    def _cells_distance(self, centres, corner, stencil, cell_size):
+        """Distance from each centre to the centre of the cells of its box.
+
+        The box of the centre ``i`` is made of the cells ``corner[i] +
+        stencil``. Returns an array of shape (len(centres), stencil size).
+
+        """
+        n_stencil = stencil.shape[1]
+        cells_physical = np.empty((len(centres), n_stencil, self.dim_))
+        for k in range(self.dim_):
+            k_cells = corner[:, k, np.newaxis] + stencil[k]
+            cells_physical[:, :, k] = (
+                self._cell_edges(k_cells, k)[0] + 0.5 * cell_size[k])
+        centre_ids = np.repeat(np.arange(len(centres)), n_stencil)
+        dis = self._pair_distance(
+            centres, centre_ids, cells_physical.reshape(-1, self.dim_))
+        return dis.reshape(len(centres), n_stencil)
+
+    # Box query methods
+    def _box_neighbor_cells(self, centres, half_widths):
+        """Retrieve the cells touched by the box around each centre.
+
+        The box of the centre ``i`` spans ``half_widths[i, k]`` along each
+        axis k. Returns the flat arrays of ``_get_neighbor_cells`` with
+        ``classify=True``: the cells entirely within the box are flagged,
+        all their points are neighbors.
+
+        """
+        cell_ranges = self._cell_ranges(centres, half_widths)
+        if cell_ranges is None:
+            empty_inside = EMPTY_ARRAY.astype(bool)
+            return EMPTY_ARRAY.copy(), EMPTY_ARRAY.copy(), empty_inside
+
+        cell_size = self._cell_size()
+        # the cell edges have rounding errors, be conservative
+        tolerance = CELL_TOLERANCE * cell_size.max()
+        pair_centres, pair_cells, pair_inside = [], [], []
+        for group, corner, stencil in self._box_stencils(*cell_ranges):
+            group_cells = self._box_cells(corner, stencil)
+            touched, inside = self._cells_in_box(
+                centres[group], half_widths[group], corner, stencil,
+                cell_size, tolerance)
+            if self.grid_.cells is not None:
+                # the empty cells are not in a sparse index
+                touched &= self._occupied(group_cells)
+
+            pair_centres.append(group[np.nonzero(touched)[0]])
+            pair_cells.append(group_cells[touched])
+            pair_inside.append(inside[touched])
+
+        centre_ids, neighbor_cells, inside = self._merge_groups(
+            pair_centres, pair_cells, pair_inside)
+        return centre_ids, neighbor_cells, inside.astype(bool)
+
+    def _cells_in_box(
+        self, centres, half_widths, corner, stencil, cell_size, tolerance,
+    ):
+        """Check if the cells of the box of cells touch the box of a centre.
+
+        The box of cells of the centre ``i`` is made of the cells
+        ``corner[i] + stencil``. Returns if each cell touches the box of
+        its centre and if it is entirely within it, as arrays of shape
+        (len(centres), stencil size). Both are checked axis by axis, once
+        for each row of cells.
+
+        """
+        n_stencil = stencil.shape[1]
+        touched = np.ones((len(centres), n_stencil), dtype=bool)
+        inside = np.ones((len(centres), n_stencil), dtype=bool)
+        wrapped_axes = self._wrapped_axes()
+        for k in range(self.dim_):
+            k_cells = corner[:, k, np.newaxis] + np.arange(
+                stencil[k].max() + 1)
+            k_low, _ = self._cell_edges(k_cells, k)
+            k_diff = k_low + 0.5 * cell_size[k] - centres[:, k, np.newaxis]
+            if k in wrapped_axes:
+                low, high = self.periodic[k]
+                k_diff -= (high - low) * np.round(k_diff / (high - low))
+            np.abs(k_diff, out=k_diff)
+
+            k_half = half_widths[:, k, np.newaxis]
+            k_touched = k_diff - 0.5 * cell_size[k] <= k_half + tolerance
+            k_inside = k_diff + 0.5 * cell_size[k] <= k_half - tolerance
+            touched &= k_touched[:, stencil[k]]
+            inside &= k_inside[:, stencil[k]]
+        return touched, inside
+
+    def _in_box(self, centres, half_widths, centre_ids, points):
+        """Check if each point is within the box of its paired centre.
+
+        With wrapped axes the closest periodic image of each point is
+        checked.
+
+        """
+        diff = self._min_image(points - centres[centre_ids])
+        np.abs(diff, out=diff)
+        return np.all(diff <= half_widths[centre_ids], axis=1)
+
+    def _get_box_neighbors(self, centres, half_widths, need_distance):
+        """Retrieve the neighbors within the box around each centre.
+
+        The points of the cells entirely within a box are accepted whole,
+        those of the cells across its faces are compared axis by axis. The
+        results are flat as those of ``_get_neighbors``, with the distance
+        of each neighbor to its centre if ``need_distance`` is True, or NaN
+        otherwise.
+
+        """
+        centre_ids, neighbor_cells, inside = self._box_neighbor_cells(
+            centres, half_widths)
+        indices, length = self._cells_points(neighbor_cells)
+        centre_ids = np.repeat(centre_ids, length)
+        inside = np.repeat(inside, length)
+
+        boundary = np.flatnonzero(~inside)
+        inside[boundary] = self._in_box(
+            centres, half_widths, centre_ids[boundary],
+            self.data[indices[boundary]])
+        centre_ids, indices = centre_ids[inside], indices[inside]
+
+        if len(self.overflow_):
+            # the points out of the grid are tested against every centre
+            overflow = self.overflow_[~self.removed_[self.overflow_]]
+            overflow_ids = np.repeat(np.arange(len(centres)), len(overflow))
+            overflow = np.tile(overflow, len(centres))
+            in_box = self._in_box(
+                centres, half_widths, overflow_ids, self.data[overflow])
+            centre_ids, indices = self._merge_groups(
+                [centre_ids, overflow_ids[in_box]],
+                [indices, overflow[in_box]])
+
+        if not need_distance:
+            return centre_ids, np.full(len(indices), np.nan), indices
+        dis = self._pair_distance(centres, centre_ids, self.data[indices])
+        return centre_ids, dis, indices
+
+    def _near_boundary(self, centres, distance_upper_bound=None, reach=None):
+        if reach is None:
+            reach = self._axis_reach(distance_upper_bound)
+        mask = np.zeros((len(centres), self.dim_), dtype=bool)
+        for k in range(self.dim_):
+            if self.periodic[k] is None:
+                continue
+            mask[:, k] = abs(
+                centres[:, k] - self.periodic[k][0]) < reach[:, k]
+            mask[:, k] += abs(
+                centres[:, k] - self.periodic[k][1]) < reach[:, k]
+        return mask.sum(axis=1, dtype=bool)
+
+    def _mirror(self, centres, distance_upper_bound=None, reach=None):
+        """Mirror the centres across the periodic boundaries.
+
+        All the images of all the centres are computed at once. Only the
+        images whose bubble still touches the periodic domain are kept. The
+        span of the searches along each axis can be given as ``reach``
+        instead of the bubble radius, see ``_mirror_universe``.
+
+        Returns the kept images and, for each one, the row of its centre.
+
+        """
+        if reach is None:
+            reach = self._axis_reach(distance_upper_bound)
+        pd_hi, pd_low, periodic_edges, periodic_direc = (
+            self.periodic_conf_.pd_hi, self.periodic_conf_.pd_low,
+            self.periodic_conf_.periodic_edges,
+            self.periodic_conf_.periodic_direc)
+
+        # shape (centres, images, dim)
+        mirror_centres = (
+            centres[:, np.newaxis, :] - periodic_edges[np.newaxis, :, :])
+
+        mask = periodic_direc * reach[:, np.newaxis, :]
+        mask = mask + mirror_centres
+        mask = (mask >= pd_low) & (mask <= pd_hi)
+        mask = np.all(mask, axis=2)
+
+        mirror_ids, _ = np.nonzero(mask)
+        return mirror_centres[mask], mirror_ids
+
+    def _mirror_universe(
+        self, centres, distance_upper_bound=None, reach=None,
+    ):
+        """Generate Terran centres in the Mirror Universe.
+
+        The searches span the bubble radius along each axis, see
+        ``_axis_reach``, or ``reach`` if it is given, an array of shape
+        (len(centres), dim).
+
+        """
+        if reach is None:
+            reach = self._axis_reach(distance_upper_bound)
+        near_boundary = np.flatnonzero(
+            self._near_boundary(centres, reach=reach))
+
+        terran_centres, terran_indices = self._mirror(
+            centres[near_boundary], reach=reach[near_boundary])
+        return terran_centres, near_boundary[terran_indices]
+
+    def _get_terran_neighbors(
+        self, centres, centre_ids, distances, indices, distance_upper_bound,
+        distance_lower_bound=None, roots=True, need_distance=True,
+    ):
+        """Add the neighbors found across the periodic boundaries.
+
+        The neighbors of the mirror centres are merged with the given flat
+        results, keeping them sorted by centre.
+
+        """
+        terran_centres, terran_indices = self._mirror_universe(
+            centres, distance_upper_bound)
+        if len(terran_centres) == 0:
+            return centre_ids, distances, indices
+
+        # terran_centres are the centres in the mirror universe for those
+        # near the boundary.
+        if distance_lower_bound is not None:
+            distance_lower_bound = distance_lower_bound[terran_indices]
+        terran = self._get_neighbors(
+            terran_centres, distance_upper_bound[terran_indices],
+            distance_lower_bound, roots=roots, need_distance=need_distance)
+        return self._merge_terran(
+            (centre_ids, distances, indices), terran_indices, terran)
+
+    def _merge_terran(self, neighbors, terran_indices, terran):
+        """Merge the flat neighbors of the mirror centres into ``neighbors``.
+
+        ``terran_indices`` is the centre of each mirror centre, the centre
+        ids of the flat ``terran`` neighbors run over the mirror centres.
+
+        """
+        centre_ids, distances, indices = neighbors
+        terran_ids, terran_distances, terran_neighbors = terran
+
+        # terran_ids run over terran centres, map them to the normal centre
+        # and put each neighbor after the ones already found for it. Both
+        # are sorted by centre, so the merged position of each is known.
+        terran_ids = terran_indices[terran_ids]
+        n_pairs = len(centre_ids) + len(terran_ids)
+        terran_pos = np.searchsorted(centre_ids, terran_ids, side="right")
+        terran_pos += np.arange(len(terran_ids))
+        is_terran = np.zeros(n_pairs, dtype=bool)
+        is_terran[terran_pos] = True
+
+        merged = []
+        for normal, terran in (
+            (centre_ids, terran_ids),
+            (distances, terran_distances),
+            (indices, terran_neighbors),
+        ):
+            values = np.empty(n_pairs, dtype=normal.dtype)
+            values[terran_pos] = terran
+            values[~is_terran] = normal
+            merged.append(values)
+        return tuple(merged)
+
+    def _sort_neighbors(self, centre_ids, distances, indices, kind):
+        """Sort the flat neighbors results by distance within each centre."""
+        # sort by distance and then (stable) by centre
+        sorted_ind = np.argsort(distances, kind=kind)
+        sorted_ind = sorted_ind[
+            np.argsort(centre_ids[sorted_ind], kind="stable")]
+        return (
+            centre_ids[sorted_ind], distances[sorted_ind], indices[sorted_ind])
+
+    def _query_cost(self, reach):
+        """Estimate the size of the search of each centre.
+
+        The number of cells in the box of cells of each centre, times the
+        mean number of points of the cells if it is more than one. ``reach``
+        is how far the search of each centre spans along each axis, an
+        array of shape (len(centres), dim).
+
+        """
+        n_axis_cells = 2 * reach / self._cell_size() + 2
+        # along a mirrored axis the boxes of the mirror centres add up to
+        # the box across the boundary
+        max_cells = self.n_cells_.astype(float)
+        wrapped_axes = self._wrapped_axes()
+        for k, v in self.periodic.items():
+            if v is not None and k not in wrapped_axes:
+                max_cells[k] = np.inf
+        cost = np.prod(np.minimum(n_axis_cells, max_cells), axis=1)
+
+        n_cells = np.prod(self.n_cells_, dtype=float)
+        if self.grid_.cells is not None:
+            # the boxes larger than the occupied cells are made of them
+            n_cells = len(self.grid_.cells)
+            cost = np.minimum(cost, n_cells)
+        return cost * max(1., len(self.grid_.order) / max(n_cells, 1.))
+
+    def _chunk_bounds(self, n_jobs, n_centres, reach=None):
+        """Return where each chunk of centres starts, and the end.
+
+        The centres are split in at least ``n_jobs`` chunks. If ``reach``
+        is given the chunks are also split so that their searches are of
+        about ``QUERY_CHUNK_SIZE``, see ``_query_cost``.
+
+        """
+        n_chunks = min(n_jobs, n_centres)
+        bounds = np.linspace(0, n_centres, n_chunks + 1).astype(int)
+        if reach is None:
+            return bounds
+
+        # a new chunk starts where the cost before the centre goes over
+        # the next multiple of the chunk size
+        cost = np.cumsum(self._query_cost(reach))
+        chunk_ids = np.append(0., cost[:-1]) // QUERY_CHUNK_SIZE
+        starts = np.flatnonzero(np.diff(chunk_ids)) + 1
+        return np.union1d(bounds, starts)
+
+    def _run_chunks(self, func, n_jobs, centres, *args, reach=None):
+        """Run ``func`` over chunks of centres in a pool of threads.
+
+        The per-centre arrays in ``args`` are chunked as the centres. If
+        ``reach`` is given, how far the search of each centre spans along
+        each axis, the chunks are small enough to bound the memory of the
+        search, see ``_chunk_bounds``. The results of each chunk are
+        returned in order, together with the index of the first centre of
+        each chunk.
+
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        bounds = self._chunk_bounds(n_jobs, len(centres), reach)
+        chunks = [
+            [centres[start:stop]] + [arg[start:stop] for arg in args]
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+        if n_jobs == 1 or len(chunks) == 1:
+            results = [func(*chunk) for chunk in chunks]
+        else:
+            # The heavy numpy kernels release the GIL
+            with ThreadPoolExecutor(
+                    max_workers=min(n_jobs, len(chunks))) as executor:
+                results = list(executor.map(lambda c: func(*c), chunks))
+        return results, bounds[:-1]
+
+    def _run_flat(self, func, n_jobs, centres, *args, reach=None):
+        """Run a query with flat results over chunks of centres.
+
+        The flat results of the chunks are merged in the input order.
+
+        """
+        results, starts = self._run_chunks(
+            func, n_jobs, centres, *args, reach=reach)
+        if len(results) == 1:
+            return results[0]
+
+        centre_ids = np.concatenate([
+            ids + start for (ids, _, _), start in zip(results, starts)])
+        distances = np.concatenate([dis for _, dis, _ in results])
+        indices = np.concatenate([ind for _, _, ind in results])
+        return centre_ids, distances, indices
+
+    def _format_neighbors(
+        self, n_centres, centre_ids, distances, indices, return_format,
+        return_distance=True,
+    ):
+        """Give the flat neighbors results the format requested by the user.
+
+        ``centre_ids`` must be sorted.
+
+        """
+        offsets = np.zeros(n_centres + 1, dtype=int)
+        np.cumsum(
+            np.bincount(centre_ids, minlength=n_centres), out=offsets[1:])
+
+        if return_format == "csr":
+            if not return_distance:
+                return indices, offsets
+            return distances, indices, offsets
+
+        split_ind = offsets[1:-1]
+        if not return_distance:
+            return np.split(indices, split_ind)
+        return np.split(distances, split_ind), np.split(indices, split_ind)
+
+    def _bubble(
+        self, centres, distance_upper_bound, sorted, kind,
+        return_distance=True,
+    ):
+        """Find the neighbors within the given distances, as flat arrays."""
+        centres = self._wrap_centres(centres)
+        need_distance = return_distance or sorted
+        centre_ids, neighbors_distances, neighbors_indices = (
+            self._get_neighbors(
+                centres, distance_upper_bound, roots=return_distance,
+                need_distance=need_distance))
+
+        # We need to generate mirror centres for periodic boundaries...
+        if self.periodic_flag_ and self.periodic_mode == "mirror":
+            centre_ids, neighbors_distances, neighbors_indices = (
+                self._get_terran_neighbors(
+                    centres, centre_ids, neighbors_distances,
+                    neighbors_indices, distance_upper_bound,
+                    roots=return_distance, need_distance=need_distance))
+
+        if sorted:
+            return self._sort_neighbors(
+                centre_ids, neighbors_distances, neighbors_indices, kind)
+        return centre_ids, neighbors_distances, neighbors_indices
+
+    def _shell(
+        self, centres, distance_lower_bound, distance_upper_bound, sorted,
+        kind, return_distance=True,
+    ):
+        """Find the neighbors within the given shells, as flat arrays."""
+        centres = self._wrap_centres(centres)
+        need_distance = return_distance or sorted
+        centre_ids, neighbors_distances, neighbors_indices = (
+            self._get_neighbors(
+                centres, distance_upper_bound, distance_lower_bound,
+                roots=return_distance, need_distance=need_distance))
+
+        # We need to generate mirror centres for periodic boundaries...
+        if self.periodic_flag_ and self.periodic_mode == "mirror":
+            centre_ids, neighbors_distances, neighbors_indices = (
+                self._get_terran_neighbors(
+                    centres, centre_ids, neighbors_distances,
+                    neighbors_indices, distance_upper_bound,
+                    distance_lower_bound, roots=return_distance,
+                    need_distance=need_distance))
+
+        if sorted:
+            return self._sort_neighbors(
+                centre_ids, neighbors_distances, neighbors_indices, kind)
+        return centre_ids, neighbors_distances, neighbors_indices
+
+    def _box(self, centres, half_widths, sorted, kind, return_distance=True):
+        """Find the neighbors within the given boxes, as flat arrays."""
+        centres = self._wrap_centres(centres)
+        need_distance = return_distance or sorted
+        centre_ids, neighbors_distances, neighbors_indices = (
+            self._get_box_neighbors(centres, half_widths, need_distance))
+
+        # We need to generate mirror centres for periodic boundaries...
+        if self.periodic_flag_ and self.periodic_mode == "mirror":
+            terran_centres, terran_indices = self._mirror_universe(
+                centres, reach=half_widths)
+            if len(terran_centres):
+                terran = self._get_box_neighbors(
+                    terran_centres, half_widths[terran_indices],
+                    need_distance)
+                centre_ids, neighbors_distances, neighbors_indices = (
+                    self._merge_terran(
+                        (centre_ids, neighbors_distances, neighbors_indices),
+                        terran_indices, terran))
+
+        if sorted:
+            return self._sort_neighbors(
+                centre_ids, neighbors_distances, neighbors_indices, kind)
+        return centre_ids, neighbors_distances, neighbors_indices
+
+    def _count(self, centres, distance_upper_bound):
+        """Count the neighbors within the given distances of each centre."""
+        centres = self._wrap_centres(centres)
+        counts = self._count_neighbors(centres, distance_upper_bound)
+
+        # We need to generate mirror centres for periodic boundaries...
+        if self.periodic_flag_ and self.periodic_mode == "mirror":
+            terran_centres, terran_indices = self._mirror_universe(
+                centres, distance_upper_bound)
+            terran_counts = self._count_neighbors(
+                terran_centres, distance_upper_bound[terran_indices])
+            counts += np.bincount(
+                terran_indices, weights=terran_counts,
+                minlength=len(centres)).astype(int)
+        return counts
+
+    def _nearest(self, centres, distances, indices, kind):
+        """Find the n nearest-neighbors of each centre.
+
+        The results are written in place in ``distances`` and ``indices``,
+        arrays of shape (m, n).
+
+        """
+        if self._separable():
+            self._nearest_rings(centres, distances, indices, kind)
+        else:
+            self._nearest_shells(centres, distances, indices, kind)
+
+    def _nearest_rings(self, centres, best_distances, best_indices, kind):
+        """Find the n nearest-neighbors visiting rings of cells.
+
+        Each centre visits the rings of cells around its own cell, the ring
+        r being the cells at r cells of distance along some axis. The best n
+        neighbors found so far are kept for each centre and a ring is only
+        visited if the lower bound of the distance to its points is not
+        larger than the current n-th distance. With periodicity the images
+        of each centre in the mirror universe visit their own rings and
+        share the neighbors of the centre. In the 'wrap' mode the rings
+        wrap around the periodic axes instead.
+
+        """
+        centres = self._wrap_centres(centres)
+        wrapped_axes = self._wrapped_axes()
+        n_centres = len(centres)
+        grid_low, grid_high = self._grid_edges()
+        cell_size = self._cell_size()
+
+        # The sources that visit the rings: each centre followed by its
+        # images, so the sources are sorted by centre
+        shifts = np.zeros((1, self.dim_))
+        if self.periodic_flag_ and self.periodic_mode == "mirror":
+            shifts = np.concatenate(
+                (shifts, self.periodic_conf_.periodic_edges))
+        sources = centres[:, np.newaxis, :] - shifts[np.newaxis]
+        sources = sources.reshape(-1, self.dim_)
+        source_ids = np.repeat(np.arange(n_centres), len(shifts))
+
+        # Cell of each source, which can be out of the grid, and the first
+        # ring that touches the grid
+        source_cells = np.floor(
+            (sources - grid_low) / cell_size).astype(int)
+        out_low = np.maximum(-source_cells, 0)
+        out_high = np.maximum(source_cells - (self.n_cells_ - 1), 0)
+        out_cells = np.maximum(out_low, out_high)
+
+        # Distance from each source to the grid, a lower bound for all rings
+        grid_gap = np.maximum(
+            np.maximum(grid_low - sources, sources - grid_high),
+            0.)
+
+        # the wrapped centres are always within the grid
+        out_cells[:, wrapped_axes] = 0
+        grid_gap[:, wrapped_axes] = 0.
+
+        ring = np.max(out_cells, axis=1)
+        grid_gap = self._norm(grid_gap)
+
+        # Rings are visited in bands, which get wider while a centre has not
+        # found n neighbors yet, so empty regions are crossed quickly
+        width = np.ones(len(sources), dtype=int)
+
+        best_distances.fill(np.inf)
+        best_indices.fill(-1)
+        if len(self.overflow_):
+            # the points out of the grid are candidates of every source
+            overflow_ids, dis, inds = self._overflow_neighbors(
+                sources, np.full(len(sources), np.inf))
+            self._merge_nearest(
+                best_distances, best_indices, source_ids[overflow_ids], dis,
+                inds, kind)
+        step = np.max(cell_size * self._axis_scale())
+        live = np.arange(len(sources))
+        while True:
+            bound = np.maximum(
+                self._ring_lower_bound(
+                    sources[live], source_cells[live], ring[live],
+                    cell_size),
+                grid_gap[live])
+            kth = best_distances[source_ids[live], -1]
+
+            # The bounds only grow and kth only decreases, so a source whose
+            # bound is above kth is done
+            alive = np.isfinite(bound) & (bound <= kth)
+            live, bound, kth = live[alive], bound[alive], kth[alive]
+            if len(live) == 0:
+                break
+
+            # Visit first the sources closer to the neighbors of its centre
+            live_ids = source_ids[live]
+            first = np.flatnonzero(np.diff(live_ids, prepend=-1))
+            min_bound = np.minimum.reduceat(bound, first)
+            min_bound = np.repeat(min_bound, np.diff(first, append=len(live)))
+            active = bound <= min_bound + step
+            kth = kth[active]
+            active = live[active]
+
+            active_ids, neighbor_cells = self._ring_cells(
+                sources[active], source_cells[active], ring[active],
+                width[active], kth)
+            inds, length = self._cells_points(neighbor_cells)
+            inds_source = active[np.repeat(active_ids, length)]
+            dis = self._pair_distance(
+                sources, inds_source, self._grid_data()[inds])
+
+            self._merge_nearest(
+                best_distances, best_indices,
+                source_ids[inds_source], dis, inds, kind)
+            ring[active] += width[active]
+
+            found = np.isfinite(best_distances[source_ids[active], -1])
+            width[active] = np.where(found, 1, 2 * width[active])
+
+    def _ring_lower_bound(self, sources, source_cells, ring, cell_size):
+        """Lower bound of the distance to the points at ``ring`` or beyond.
+
+        A cell is at the ring r or beyond if along some axis it is at r or
+        more cells from the cell of the source. Returns inf when there are
+        no such cells in the grid.
+
+        Along a wrapped axis with N cells the cells go from ``-(N // 2)`` to
+        ``N - 1 - N // 2`` cells from the cell of the source,
+        and a point is at least as close as the nearest of both sides of
+        the ring.
+
+        """
+        b0, _ = self._grid_edges()
+        high_cells = source_cells + ring[:, np.newaxis]
+        low_cells = source_cells - ring[:, np.newaxis]
+        high_gap = b0 + high_cells * cell_size - sources
+        low_gap = sources - (b0 + (low_cells + 1) * cell_size)
+
+        wrapped = np.zeros(self.dim_, dtype=bool)
+        wrapped[self._wrapped_axes()] = True
+        high_gap[(high_cells > self.n_cells_ - 1) & ~wrapped] = np.inf
+        low_gap[(low_cells < 0) & ~wrapped] = np.inf
+        gap = np.minimum(high_gap, low_gap)
+        gap[(ring[:, np.newaxis] > self.n_cells_ // 2) & wrapped] = np.inf
+
+        # the distance of a separable metric is at least the scaled
+        # difference along any axis
+        scale = self._axis_scale()
+        bound = np.min(gap * scale, axis=1)
+
+        # the cells are found with rounding errors, be conservative
+        tolerance = CELL_TOLERANCE * np.max(cell_size * scale)
+        return np.maximum(bound - tolerance, 0.)
+
+    def _ring_cells(self, sources, source_cells, ring, width, kth):
+        """Retrieve the cells of the band of rings of each source.
+
+        The band of the source i goes from the ring ``ring[i]`` to the ring
+        ``ring[i] + width[i] - 1``. The cells farther than ``kth`` from the
+        source are discarded.
+
+        """
+        last_ring = ring + width - 1
+        cell_min = np.zeros(self.dim_, dtype=int)
+        cell_max = self.n_cells_ - 1
+        wrapped_axes = self._wrapped_axes()
+        if wrapped_axes:
+            # the cells of a wrapped axis are numbered relative to the
+            # cell of the source, so each one is seen only once
+            cell_min = np.broadcast_to(cell_min, source_cells.shape).copy()
+            cell_max = np.broadcast_to(cell_max, source_cells.shape).copy()
+            half_turn = self.n_cells_[wrapped_axes] // 2
+            cell_min[:, wrapped_axes] = (
+                source_cells[:, wrapped_axes] - half_turn)
+            cell_max[:, wrapped_axes] = (
+                cell_min[:, wrapped_axes] + self.n_cells_[wrapped_axes] - 1)
+        k_cell_min = np.clip(
+            source_cells - last_ring[:, np.newaxis], cell_min, cell_max)
+        k_cell_max = np.clip(
+            source_cells + last_ring[:, np.newaxis], cell_min, cell_max)
+
+        scale = self._axis_scale()
+        combine = self._combine_axes()
+        pair_sources, pair_cells = [], []
+        for group, corner, stencil in self._box_stencils(
+                k_cell_min, k_cell_max):
+            ring_dist = np.zeros((len(group), stencil.shape[1]), dtype=int)
+            cell_gap = np.zeros((len(group), stencil.shape[1]))
+            for k in range(self.dim_):
+                k_cells = corner[:, k, np.newaxis] + stencil[k]
+                ring_dist = np.maximum(
+                    ring_dist,
+                    np.abs(k_cells - source_cells[group, k, np.newaxis]))
+
+                # distance along the axis from the source to the cell
+                k_source = sources[group, k, np.newaxis]
+                k_low, k_high = self._cell_edges(k_cells, k)
+                k_gap = np.maximum(k_low - k_source, k_source - k_high)
+                if k in wrapped_axes:
+                    # or to the closest periodic image of the cell
+                    period = self.periodic[k][1] - self.periodic[k][0]
+                    for shift in (-period, period):
+                        k_gap = np.minimum(k_gap, np.maximum(
+                            k_low + shift - k_source,
+                            k_source - k_high - shift))
+                k_gap = np.maximum(k_gap, 0.) * scale[k]
+                combine(cell_gap, self._reduce(k_gap), out=cell_gap)
+
+            mask_cells = ring_dist >= ring[group, np.newaxis]
+            mask_cells &= cell_gap <= self._reduce(kth[group, np.newaxis])
+
+            group_cells = self._box_cells(corner, stencil)
+            pair_sources.append(group[np.nonzero(mask_cells)[0]])
+            pair_cells.append(group_cells[mask_cells])
+
+        return self._merge_groups(pair_sources, pair_cells)
+
+    def _merge_nearest(
+        self, best_distances, best_indices, centre_ids, distances, indices,
+        kind,
+    ):
+        """Merge new candidates into the n best neighbors of each centre."""
+        if len(centre_ids) == 0:
+            return
+        n = best_distances.shape[1]
+
+        # The candidates compete with the current best of their centres
+        touched = np.unique(centre_ids)
+        centre_ids = np.concatenate((centre_ids, np.repeat(touched, n)))
+        distances = np.concatenate(
+            (distances, best_distances[touched].ravel()))
+        indices = np.concatenate((indices, best_indices[touched].ravel()))
+        centre_ids, distances, indices = self._sort_neighbors(
+            centre_ids, distances, indices, kind)
+
+        # position of each candidate within its centre
+        rank = np.arange(len(centre_ids)) - np.searchsorted(
+            centre_ids, centre_ids)
+        keep = rank < n
+        best_distances[centre_ids[keep], rank[keep]] = distances[keep]
+        best_indices[centre_ids[keep], rank[keep]] = indices[keep]
+
+    def _nearest_shells(self, centres, distances, indices, kind):
+        """Find the n nearest-neighbors of each centre growing shells."""
+        # Initial definitions
+        N_centres, n = distances.shape
+        centres_lookup_ind = np.arange(0, N_centres)
+        n_found = np.zeros(N_centres, dtype=bool)
+        n_filled = np.zeros(N_centres, dtype=int)
+        lower_distance_tmp = np.zeros(N_centres)
+        upper_distance_tmp = np.zeros(N_centres)
+
+        # First estimation is the cell radii
+        cell_size = self._cell_size()
+        cell_radii = 0.5 * np.sum(cell_size ** 2) ** 0.5
+
+        upper_distance_tmp = cell_radii * np.ones(N_centres)
+
+        while not np.all(n_found):
+            ndis_tmp, nidx_tmp = self.shell_neighbors(
+                centres[~n_found],
+                distance_lower_bound=lower_distance_tmp[~n_found],
+                distance_upper_bound=upper_distance_tmp[~n_found])
+
+            for i_tmp, i in enumerate(centres_lookup_ind[~n_found]):
+                if n <= len(nidx_tmp[i_tmp]) + n_filled[i]:
+                    n_more = n - n_filled[i]
+                    n_found[i] = True
+                else:
+                    n_more = len(nidx_tmp[i_tmp])
+                    lower_distance_tmp[i] = upper_distance_tmp[i].copy()
+                    upper_distance_tmp[i] += cell_size.min()
+
+                sorted_ind = np.argsort(ndis_tmp[i_tmp], kind=kind)[:n_more]
+                filled = slice(n_filled[i], n_filled[i] + n_more)
+                distances[i, filled] = ndis_tmp[i_tmp][sorted_ind]
+                indices[i, filled] = nidx_tmp[i_tmp][sorted_ind]
+                n_filled[i] += n_more
+
+    # =========================================================================
+    # INSERT AND REMOVE
+    # =========================================================================
+
+    def insert(self, points):
+        """Add points to the built grid.
+
+        The points are merged into the cell index in a single pass, without
+        building the grid again. The bins of the grid do not change, so the
+        points out of the bins are kept in ``overflow_`` and tested against
+        every centre. The data is copied with the new points, the points
+        take the rows of the removed points first and then are appended.
+
+        Parameters
+        ----------
+        points: ndarray, shape (m,k)
+            The points to add.
+
+        Returns
+        -------
+        indices: ndarray, length m
+            The index of each new point in the data.
+
+        """
+        vlds.validate_points(points, self.data)
+
+        # the tombstones are dropped in the same pass over the index
+        self._compact()
+
+        free = np.flatnonzero(self.removed_)[:len(points)]
+        n_appended = len(points) - len(free)
+        indices = np.append(free, len(self.data) + np.arange(n_appended))
+
+        data = np.concatenate((self.data, points[len(free):]))
+        data[free] = points[:len(free)]
+        removed = np.append(self.removed_, np.zeros(n_appended, dtype=bool))
+        removed[free] = False
+
+        if self.unit_vectors:
+            # the vectors take the same rows as the points
+            points = distances.unit_vectors(points)
+            vectors = np.concatenate((self.vectors_, points[len(free):]))
+            vectors[free] = points[:len(free)]
+            self.vectors_ = vectors
+
+        flat_cells, in_grid = self._locate(points)
+        self.data, self.removed_ = data, removed
+        self.grid_ = self._insert_cells(indices[in_grid], flat_cells[in_grid])
+        self.overflow_ = np.append(self.overflow_, indices[~in_grid])
+        return indices
+
+    def remove(self, indices):
+        """Remove points from the built grid.
+
+        The points are marked as removed and the queries skip them, the
+        indices of the other points do not change. They stay in the cell
+        index as tombstones until they are more than a quarter of the
+        indexed points, then the index is compacted. Their rows of the data
+        are reused by the points inserted later.
+
+        Parameters
+        ----------
+        indices: int or ndarray of int
+            The index of the points to remove in the data.
+
+        """
+        indices = np.ravel(indices)
+        vlds.validate_indices(indices, self.removed_)
+        if indices.size == 0:
+            return
+
+        if not self.removed_.flags.writeable:
+            # loaded or shared grids
+            self.removed_ = self.removed_.copy()
+        self.removed_[indices] = True
+        self.n_tombstones_ += len(indices)
+
+        n_indexed = len(self.grid_.order) + len(self.overflow_)
+        if self.n_tombstones_ > COMPACT_FRACTION * n_indexed:
+            self._compact()
+
+    def update_positions(self, new_data):
+        """Move the points of the grid to new positions.
+
+        Meant for points that move a little at a time, as the particles of
+        a simulation between timesteps. The cell index is sorted again from
+        its current order, which is almost sorted as most points stay in
+        their cells, so the update is much cheaper than a new build. The
+        bins of the grid do not change, the points that leave them are kept
+        in ``overflow_`` as those inserted out of the bins.
+
+        Parameters
+        ----------
+        new_data: ndarray, shape (n,k)
+            The new position of every point of the data, in the same order.
+            The array is copied if the grid was built with copy_data=True.
+
+        Returns
+        -------
+        stats: grispy.core.UpdateStats
+            The time spent and the number of points that changed of cell.
+
+        """
+        t0 = time.time()
+        vlds.validate_points(new_data, self.data)
+        vlds.validate_equalsize(new_data, self.data)
+
+        self._compact()
+        grid = self.grid_
+        new_points = new_data
+        if self.unit_vectors:
+            new_points = distances.unit_vectors(new_data)
+        new_cells, _ = self._locate(new_points)
+
+        # The index sorted by the new cells, the points out of the bins
+        # first. It is almost sorted, as most points stay in their cell, and
+        # a stable sort is fast on it
+        cells = grid.cells
+        if cells is None:
+            cells = np.arange(len(grid.offsets) - 1)
+        old_cells = np.repeat(cells, np.diff(grid.offsets))
+        order = np.append(grid.order, self.overflow_)
+        old_cells = np.append(old_cells, np.full(len(self.overflow_), -1))
+        order_cells = new_cells[order]
+        n_migrated = np.count_nonzero(order_cells != old_cells)
+
+        by_cell = np.argsort(order_cells, kind="stable")
+        order, order_cells = order[by_cell], order_cells[by_cell]
+        n_overflow = np.searchsorted(order_cells, 0)
+        self.overflow_ = order[:n_overflow]
+        self.grid_ = self._make_index(
+            order[n_overflow:], order_cells[n_overflow:],
+            len(grid.offsets) - 1, sparse=grid.cells is not None)
+
+        self.data = new_data.copy() if self.copy_data else new_data
+        if self.unit_vectors:
+            self.vectors_ = new_points
+        return UpdateStats(
+            updatetime=time.time() - t0, n_migrated=n_migrated,
+            n_overflow=n_overflow)
+
+    # =========================================================================
+    # PERIODICITY
+    # =========================================================================
+
+    def set_periodicity(self, periodic, inplace=False):
+        """Set periodicity conditions.
+
+        This allows to define or change the periodicity limits without
+        having to construct the grid again. In the 'wrap' periodic mode the
+        cells are aligned with the periodic range, so the grid is built
+        again.
+
+        Important: The periodicity only works within one periodic range.
 
         Parameters
         ----------
@@ -594,18 +2938,118 @@ class GriSPy(object):
 
             periodic_attr = attr.fields(GriSPy).periodic
             periodic_attr.validator(self, periodic_attr, periodic)
+            if self.sky_bands or self.unit_vectors:
+                self._validate_sphere_periodic(periodic)
             self.periodic, self.periodic_conf_ = self._build_periodicity(
                 periodic=periodic, dim=self.dim_)
 
-            self.time_ = BuildStats(
-                buildtime=self.time_.buildtime,
-                datetime=self.time_.datetime,
-                periodicity_set_at=datetime.datetime.now())
+            if self.periodic_mode == "wrap":
+                grid_data = self._grid_data()
+                self.n_cells_ = self._resolve_n_cells(
+                    data=grid_data, dim=self.dim_)
+                self.grid_, self.axis_bins_ = self._build_grid(
+                    data=grid_data, n_cells=self.n_cells_, dim=self.dim_)
+                # all the points are within the new bins
+                self.overflow_ = EMPTY_ARRAY.copy()
+                self.n_tombstones_ = int(np.count_nonzero(self.removed_))
+
+            self.time_ = attr.evolve(
+                self.time_, periodicity_set_at=datetime.datetime.now(),
+                n_cells=tuple(self.n_cells_.tolist()))
         else:
-            return GriSPy(
-                data=self.data, N_cells=self.N_cells,
-                metric=self.metric, copy_data=self.copy_data,
-                periodic=periodic)
+            params = self._init_params()
+            params["periodic"] = periodic
+            gsp = GriSPy(data=self.data, **params)
+            if np.any(self.removed_):
+                gsp.remove(np.flatnonzero(self.removed_))
+            return gsp
+
+    # =========================================================================
+    # SHARED MEMORY
+    # =========================================================================
+
+    def to_shared_memory(self):
+        """Copy the grid to shared memory to use it from other processes.
+
+        The data, the unit vectors if indexed, the bins and the cell index
+        are copied once into ``multiprocessing.shared_memory`` blocks. Other
+        processes can create a GriSPy instance over those blocks with
+        ``from_shared_memory`` without copying or building the grid again.
+
+        Returns
+        -------
+        shared: grispy.shared.SharedGrid
+            The owner of the shared memory. It must be kept alive while the
+            grid is in use and released with ``close`` and ``unlink``, or used
+            as a context manager. Its ``index`` attribute is picklable and is
+            what the other processes need to attach to the grid.
+
+        """
+        from . import shared
+        return shared.share(self)
+
+    @classmethod
+    def from_shared_memory(cls, index):
+        """Attach to a grid exported with ``to_shared_memory``.
+
+        Parameters
+        ----------
+        index: grispy.shared.SharedIndex
+            The ``index`` of the exported grid.
+
+        Returns
+        -------
+        gsp: grispy.GriSPy
+            A grid whose arrays are read only views of the shared memory.
+            Editing the grid gives it its own arrays.
+
+        """
+        from . import shared
+        return shared.attach(index, cls=cls)
+
+    # =========================================================================
+    # STORAGE
+    # =========================================================================
+
+    def save(self, path):
+        """Save the built grid to disk.
+
+        The arrays of the grid are written as raw ``.npy`` files within the
+        directory ``path``, together with a small metadata file. Only grids
+        with a built-in metric can be saved.
+
+        Parameters
+        ----------
+        path: str or pathlib.Path
+            Directory where the grid is saved. It is created if needed.
+
+        """
+        from . import storage
+        storage.save(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a grid saved with ``save``.
+
+        Parameters
+        ----------
+        path: str or pathlib.Path
+            Directory where the grid was saved.
+        mmap: bool, optional
+            If True the arrays are memory-mapped from disk, so the load is
+            almost instantaneous and the pages are read only when needed.
+            The memory-mapped arrays are read only. If False the arrays are
+            read into memory. Default: True
+
+        Returns
+        -------
+        gsp: grispy.GriSPy
+            The saved grid. ``time_.loadtime`` has the time spent in the
+            load and the rest of ``time_`` is the one of the original build.
+
+        """
+        from . import storage
+        return storage.load(path, mmap=mmap, cls=cls)
 
     # =========================================================================
     # SEARCH API
@@ -617,6 +3061,9 @@ class GriSPy(object):
         distance_upper_bound=-1.0,
         sorted=False,
         kind="quicksort",
+        return_format="list",
+        return_distance=True,
+        n_jobs=1,
     ):
         """Find all points within given distances of each centre.
 
@@ -635,18 +3082,38 @@ class GriSPy(object):
             When sorted = True, the sorting algorithm can be specified in this
             keyword. Available algorithms are: ['quicksort', 'mergesort',
             'heapsort', 'stable']. Default: 'quicksort'
-        njobs: int, optional
-            Number of jobs for parallel computation. Not implemented yet.
+        return_format: str, optional
+            Format of the returned neighbors. With 'list' one array per
+            centre is returned. With 'csr' the neighbors of all the centres
+            are returned in contiguous arrays together with the offsets
+            where the neighbors of each centre start. Default: 'list'
+        return_distance: bool, optional
+            If False only the indices of the neighbors are returned, and the
+            distances to the neighbors are not computed when possible.
+            Default: True
+        n_jobs: int, optional
+            Number of jobs for parallel computation. The centres are split in
+            chunks, at least n_jobs and small enough to bound the memory,
+            that are searched in a pool of n_jobs threads. If -1 all the
+            available cores are used. Default: 1
 
         Returns
         -------
         distances: list, length m
-            Returns a list of m arrays. Each array has the distances to the
-            neighbors of that centre.
+            Only if return_distance=True. Returns a list of m arrays. Each
+            array has the distances to the neighbors of that centre. If
+            return_format='csr' this is a single array with the distances for
+            all the centres.
 
         indices: list, length m
             Returns a list of m arrays. Each array has the indices to the
-            neighbors of that centre.
+            neighbors of that centre. If return_format='csr' this is a single
+            array with the indices for all the centres.
+
+        offsets: ndarray, length m+1
+            Only if return_format='csr'. The neighbors of the centre i are
+            found in the positions offsets[i]:offsets[i+1] of the distances
+            and indices arrays.
 
         """
         # Validate iputs
@@ -654,52 +3121,31 @@ class GriSPy(object):
         vlds.validate_distance_bound(distance_upper_bound, self.periodic)
         vlds.validate_bool(sorted)
         vlds.validate_sortkind(kind)
+        vlds.validate_return_format(return_format)
+        vlds.validate_bool(return_distance)
+        vlds.validate_n_jobs(n_jobs)
         # Match distance_upper_bound shape with centres shape
         if np.isscalar(distance_upper_bound):
             distance_upper_bound *= np.ones(len(centres))
         else:
             vlds.validate_equalsize(centres, distance_upper_bound)
 
-        # Get neighbors
-        neighbor_cells = self._get_neighbor_cells(
-            centres, distance_upper_bound)
-
-        neighbors_distances, neighbors_indices = self._get_neighbor_distance(
-            centres, neighbor_cells)
-
-        # We need to generate mirror centres for periodic boundaries...
-        if self.periodic_flag_:
-            terran_centres, terran_indices = self._mirror_universe(
+        # Get neighbors, as chords of the unit vectors if they are indexed
+        if self.unit_vectors:
+            centres, distance_upper_bound = self._to_chords(
                 centres, distance_upper_bound)
-
-            # terran_centres are the centres in the mirror universe for those
-            # near the boundary.
-            terran_neighbor_cells = self._get_neighbor_cells(
-                terran_centres, distance_upper_bound[terran_indices])
-
-            terran_neighbors_distances, \
-                terran_neighbors_indices = self._get_neighbor_distance(
-                    terran_centres, terran_neighbor_cells)
-
-            for i, t in zip(terran_indices, np.arange(len(terran_centres))):
-                # i runs over normal indices that have a terran counterpart
-                # t runs over terran indices, 0 to len(terran_centres)
-                neighbors_distances[i] = np.concatenate(
-                    (neighbors_distances[i], terran_neighbors_distances[t]))
-
-                neighbors_indices[i] = np.concatenate(
-                    (neighbors_indices[i], terran_neighbors_indices[t]))
-
-        for i in range(len(centres)):
-            mask_distances = neighbors_distances[i] <= distance_upper_bound[i]
-            neighbors_distances[i] = neighbors_distances[i][mask_distances]
-            neighbors_indices[i] = neighbors_indices[i][mask_distances]
-            if sorted:
-                sorted_ind = np.argsort(neighbors_distances[i], kind=kind)
-                neighbors_distances[i] = neighbors_distances[i][sorted_ind]
-                neighbors_indices[i] = neighbors_indices[i][sorted_ind]
-
-        return neighbors_distances, neighbors_indices
+        worker = functools.partial(
+            self._bubble, sorted=sorted, kind=kind,
+            return_distance=return_distance)
+        centre_ids, neighbors_distances, neighbors_indices = self._run_flat(
+            worker, n_jobs, centres, distance_upper_bound,
+            reach=self._axis_reach(distance_upper_bound))
+        if self.unit_vectors and return_distance:
+            neighbors_distances = distances.chord_to_angle(neighbors_distances)
+
+        return self._format_neighbors(
+            len(centres), centre_ids, neighbors_distances, neighbors_indices,
+            return_format=return_format, return_distance=return_distance)
 
     def shell_neighbors(
         self,
@@ -708,6 +3154,9 @@ class GriSPy(object):
         distance_upper_bound=-1.0,
         sorted=False,
         kind="quicksort",
+        return_format="list",
+        return_distance=True,
+        n_jobs=1,
     ):
         """Find all points within given lower and upper distances of each centre.
 
@@ -730,18 +3179,38 @@ class GriSPy(object):
             When sorted = True, the sorting algorithm can be specified in this
             keyword. Available algorithms are: ['quicksort', 'mergesort',
             'heapsort', 'stable']. Default: 'quicksort'
-        njobs: int, optional
-            Number of jobs for parallel computation. Not implemented yet.
+        return_format: str, optional
+            Format of the returned neighbors. With 'list' one array per
+            centre is returned. With 'csr' the neighbors of all the centres
+            are returned in contiguous arrays together with the offsets
+            where the neighbors of each centre start. Default: 'list'
+        return_distance: bool, optional
+            If False only the indices of the neighbors are returned, and the
+            distances to the neighbors are not computed when possible.
+            Default: True
+        n_jobs: int, optional
+            Number of jobs for parallel computation. The centres are split in
+            chunks, at least n_jobs and small enough to bound the memory,
+            that are searched in a pool of n_jobs threads. If -1 all the
+            available cores are used. Default: 1
 
         Returns
         -------
         distances: list, length m
-            Returns a list of m arrays. Each array has the distances to the
-            neighbors of that centre.
+            Only if return_distance=True. Returns a list of m arrays. Each
+            array has the distances to the neighbors of that centre. If
+            return_format='csr' this is a single array with the distances for
+            all the centres.
 
         indices: list, length m
             Returns a list of m arrays. Each array has the indices to the
-            neighbors of that centre.
+            neighbors of that centre. If return_format='csr' this is a single
+            array with the indices for all the centres.
+
+        offsets: ndarray, length m+1
+            Only if return_format='csr'. The neighbors of the centre i are
+            found in the positions offsets[i]:offsets[i+1] of the distances
+            and indices arrays.
 
         """
         # Validate inputs
@@ -750,6 +3219,9 @@ class GriSPy(object):
         vlds.validate_sortkind(kind)
         vlds.validate_shell_distances(
             distance_lower_bound, distance_upper_bound, self.periodic)
+        vlds.validate_return_format(return_format)
+        vlds.validate_bool(return_distance)
+        vlds.validate_n_jobs(n_jobs)
 
         # Match distance bounds shapes with centres shape
         if np.isscalar(distance_lower_bound):
@@ -761,65 +3233,170 @@ class GriSPy(object):
         else:
             vlds.validate_equalsize(centres, distance_upper_bound)
 
-        # Get neighbors
-        neighbor_cells = self._get_neighbor_cells(
-            centres,
-            distance_upper_bound=distance_upper_bound,
-            distance_lower_bound=distance_lower_bound,
-            shell_flag=True)
-
-        neighbors_distances, neighbors_indices = self._get_neighbor_distance(
-            centres, neighbor_cells)
-
-        # We need to generate mirror centres for periodic boundaries...
-        if self.periodic_flag_:
-            terran_centres, terran_indices = self._mirror_universe(
-                centres, distance_upper_bound)
+        # Get neighbors, as chords of the unit vectors if they are indexed
+        if self.unit_vectors:
+            centres, distance_lower_bound, distance_upper_bound = (
+                self._to_chords(
+                    centres, distance_lower_bound, distance_upper_bound))
+        worker = functools.partial(
+            self._shell, sorted=sorted, kind=kind,
+            return_distance=return_distance)
+        centre_ids, neighbors_distances, neighbors_indices = self._run_flat(
+            worker, n_jobs, centres, distance_lower_bound,
+            distance_upper_bound,
+            reach=self._axis_reach(distance_upper_bound))
+        if self.unit_vectors and return_distance:
+            neighbors_distances = distances.chord_to_angle(neighbors_distances)
+
+        return self._format_neighbors(
+            len(centres), centre_ids, neighbors_distances, neighbors_indices,
+            return_format=return_format, return_distance=return_distance)
+
+    def box_neighbors(
+        self,
+        centres,
+        half_widths,
+        sorted=False,
+        kind="quicksort",
+        return_format="list",
+        return_distance=True,
+        n_jobs=1,
+    ):
+        """Find all points within a box around each centre.
 
-            # terran_centres are the centres in the mirror universe for those
-            # near the boundary.
-            terran_neighbor_cells = self._get_neighbor_cells(
-                terran_centres, distance_upper_bound[terran_indices])
+        The boxes are aligned with the axes, a point ``x`` is a neighbor of
+        the centre ``c`` if ``|x_k - c_k| <= half_widths[k]`` along every
+        axis k, with the closest periodic image of the point along the
+        periodic axes. The points of the cells entirely within a box are
+        accepted whole, and only those of the cells across its faces are
+        compared. The distances are those of the metric of the grid. Only
+        for grids of the data coordinates, not with sky_bands nor with
+        unit_vectors.
 
-            terran_neighbors_distances,\
-                terran_neighbors_indices = self._get_neighbor_distance(
-                    terran_centres, terran_neighbor_cells)
+        Parameters
+        ----------
+        centres: ndarray, shape (m,k)
+            The point or points to search for neighbors of.
+        half_widths: scalar or ndarray of shape (k,) or (m,k)
+            Half the side of the boxes along each axis. A scalar gives cubes,
+            an ndarray of shape (k,) the half width along each axis for every
+            centre, and an ndarray of shape (m,k) those of each centre.
+        sorted: bool, optional
+            If True the returned neighbors will be ordered by increasing
+            distance to the centre. Default: False.
+        kind: str, optional
+            When sorted = True, the sorting algorithm can be specified in this
+            keyword. Available algorithms are: ['quicksort', 'mergesort',
+            'heapsort', 'stable']. Default: 'quicksort'
+        return_format: str, optional
+            Format of the returned neighbors. With 'list' one array per
+            centre is returned. With 'csr' the neighbors of all the centres
+            are returned in contiguous arrays together with the offsets
+            where the neighbors of each centre start. Default: 'list'
+        return_distance: bool, optional
+            If False only the indices of the neighbors are returned, and no
+            distance is computed unless sorted is True. Default: True
+        n_jobs: int, optional
+            Number of jobs for parallel computation. The centres are split in
+            chunks, at least n_jobs and small enough to bound the memory,
+            that are searched in a pool of n_jobs threads. If -1 all the
+            available cores are used. Default: 1
 
-            for i, t in zip(terran_indices, np.arange(len(terran_centres))):
-                # i runs over normal indices that have a terran counterpart
-                # t runs over terran indices, 0 to len(terran_centres)
-                neighbors_distances[i] = np.concatenate(
-                    (neighbors_distances[i], terran_neighbors_distances[t]))
+        Returns
+        -------
+        distances: list, length m
+            Only if return_distance=True. Returns a list of m arrays. Each
+            array has the distances to the neighbors of that centre. If
+            return_format='csr' this is a single array with the distances for
+            all the centres.
 
-                neighbors_indices[i] = np.concatenate(
-                    (neighbors_indices[i], terran_neighbors_indices[t]))
+        indices: list, length m
+            Returns a list of m arrays. Each array has the indices to the
+            neighbors of that centre. If return_format='csr' this is a single
+            array with the indices for all the centres.
 
-        for i in range(len(centres)):
-            mask_distances_upper = (
-                neighbors_distances[i] <= distance_upper_bound[i])
+        offsets: ndarray, length m+1
+            Only if return_format='csr'. The neighbors of the centre i are
+            found in the positions offsets[i]:offsets[i+1] of the distances
+            and indices arrays.
 
-            mask_distances_lower = neighbors_distances[i][mask_distances_upper]
-            mask_distances_lower = (
-                mask_distances_lower > distance_lower_bound[i])
+        """
+        # Validate inputs
+        if self.sky_bands or self.unit_vectors:
+            raise ValueError(
+                "Box neighbors: Not available in a grid of the sphere, "
+                "with sky_bands or unit_vectors")
+        vlds.validate_centres(centres, self.data)
+        vlds.validate_half_widths(half_widths, centres, self.periodic)
+        vlds.validate_bool(sorted)
+        vlds.validate_sortkind(kind)
+        vlds.validate_return_format(return_format)
+        vlds.validate_bool(return_distance)
+        vlds.validate_n_jobs(n_jobs)
+        # Match half_widths shape with centres shape
+        half_widths = np.broadcast_to(
+            np.asarray(half_widths, dtype=float), centres.shape)
+
+        worker = functools.partial(
+            self._box, sorted=sorted, kind=kind,
+            return_distance=return_distance)
+        centre_ids, neighbors_distances, neighbors_indices = self._run_flat(
+            worker, n_jobs, centres, half_widths, reach=half_widths)
+
+        return self._format_neighbors(
+            len(centres), centre_ids, neighbors_distances, neighbors_indices,
+            return_format=return_format, return_distance=return_distance)
+
+    def count_neighbors(self, centres, distance_upper_bound=-1.0, n_jobs=1):
+        """Count the points within given distances of each centre.
+
+        The neighbors are the same as those of ``bubble_neighbors``, but only
+        their number is returned. The cells entirely within the distance of
+        a centre are counted whole, without computing any distance.
 
-            aux = neighbors_distances[i]
-            aux = aux[mask_distances_upper]
-            aux = aux[mask_distances_lower]
-            neighbors_distances[i] = aux
+        Parameters
+        ----------
+        centres: ndarray, shape (m,k)
+            The point or points to count the neighbors of.
+        distance_upper_bound: scalar or ndarray of length m
+            The radius of points to count. If a scalar is provided, the same
+            distance will apply for every centre. An ndarray with individual
+            distances can also be provided.
+        n_jobs: int, optional
+            Number of jobs for parallel computation. The centres are split in
+            chunks, at least n_jobs and small enough to bound the memory,
+            that are searched in a pool of n_jobs threads. If -1 all the
+            available cores are used. Default: 1
 
-            aux = neighbors_indices[i]
-            aux = aux[mask_distances_upper]
-            aux = aux[mask_distances_lower]
-            neighbors_indices[i] = aux
+        Returns
+        -------
+        counts: ndarray, length m
+            The number of neighbors of each centre.
 
-            if sorted:
-                sorted_ind = np.argsort(neighbors_distances[i], kind=kind)
-                neighbors_distances[i] = neighbors_distances[i][sorted_ind]
-                neighbors_indices[i] = neighbors_indices[i][sorted_ind]
+        """
+        # Validate inputs
+        vlds.validate_centres(centres, self.data)
+        vlds.validate_distance_bound(distance_upper_bound, self.periodic)
+        vlds.validate_n_jobs(n_jobs)
+        # Match distance_upper_bound shape with centres shape
+        if np.isscalar(distance_upper_bound):
+            distance_upper_bound *= np.ones(len(centres))
+        else:
+            vlds.validate_equalsize(centres, distance_upper_bound)
 
-        return neighbors_distances, neighbors_indices
+        # Count neighbors, within chords of the unit vectors if they are
+        # indexed
+        if self.unit_vectors:
+            centres, distance_upper_bound = self._to_chords(
+                centres, distance_upper_bound)
+        results, _ = self._run_chunks(
+            self._count, n_jobs, centres, distance_upper_bound,
+            reach=self._axis_reach(distance_upper_bound))
+        return np.concatenate(results).astype(int)
 
-    def nearest_neighbors(self, centres, n=1, kind="quicksort"):
+    def nearest_neighbors(
+        self, centres, n=1, kind="quicksort", return_format="list", n_jobs=1,
+    ):
         """Find the n nearest-neighbors for each centre.
 
         Parameters
@@ -833,62 +3410,55 @@ class GriSPy(object):
             to the centre. The sorting algorithm can be specified in this
             keyword. Available algorithms are: ['quicksort', 'mergesort',
             'heapsort', 'stable']. Default: 'quicksort'
-        njobs: int, optional
-            Number of jobs for parallel computation. Not implemented yet.
+        return_format: str, optional
+            Format of the returned neighbors. If 'list' a list of arrays is
+            returned, one for each centre. If 'dense' the neighbors are
+            returned as arrays of shape (m, n), as each centre has exactly n
+            neighbors. Default: 'list'
+        n_jobs: int, optional
+            Number of jobs for parallel computation. The centres are split in
+            n_jobs chunks that are searched in a pool of threads. If -1 all
+            the available cores are used. Default: 1
 
         Returns
         -------
-        distances: list, length m
+        distances: list, length m or ndarray, shape (m, n)
             Returns a list of m arrays. Each array has the distances to the
-            neighbors of that centre.
+            neighbors of that centre. If return_format='dense' this is a
+            single array with one row for each centre.
 
-        indices: list, length m
+        indices: list, length m or ndarray, shape (m, n)
             Returns a list of m arrays. Each array has the indices to the
-            neighbors of that centre.
+            neighbors of that centre. If return_format='dense' this is a
+            single array with one row for each centre.
 
         """
         # Validate input
         vlds.validate_centres(centres, self.data)
-        vlds.validate_n_nearest(n, self.data, self.periodic)
+        # In the 'wrap' mode each point is found only once
+        live_data = self.data
+        if np.any(self.removed_):
+            live_data = self.data[~self.removed_]
+        vlds.validate_n_nearest(
+            n, live_data,
+            self.periodic if self.periodic_mode == "mirror" else {})
         vlds.validate_sortkind(kind)
-
-        # Initial definitions
-        N_centres = len(centres)
-        centres_lookup_ind = np.arange(0, N_centres)
-        n_found = np.zeros(N_centres, dtype=bool)
-        lower_distance_tmp = np.zeros(N_centres)
-        upper_distance_tmp = np.zeros(N_centres)
-
-        # First estimation is the cell radii
-        cell_size = self.k_bins_[1, :] - self.k_bins_[0, :]
-        cell_radii = 0.5 * np.sum(cell_size ** 2) ** 0.5
-
-        upper_distance_tmp = cell_radii * np.ones(N_centres)
-
-        neighbors_indices = [EMPTY_ARRAY.copy() for _ in range(N_centres)]
-        neighbors_distances = [EMPTY_ARRAY.copy() for _ in range(N_centres)]
-        while not np.all(n_found):
-            ndis_tmp, nidx_tmp = self.shell_neighbors(
-                centres[~n_found],
-                distance_lower_bound=lower_distance_tmp[~n_found],
-                distance_upper_bound=upper_distance_tmp[~n_found])
-
-            for i_tmp, i in enumerate(centres_lookup_ind[~n_found]):
-                if n <= len(nidx_tmp[i_tmp]) + len(
-                    neighbors_indices[i]
-                ):
-                    n_more = n - len(neighbors_indices[i])
-                    n_found[i] = True
-                else:
-                    n_more = len(nidx_tmp[i_tmp])
-                    lower_distance_tmp[i] = upper_distance_tmp[i].copy()
-                    upper_distance_tmp[i] += cell_size.min()
-
-                sorted_ind = np.argsort(ndis_tmp[i_tmp], kind=kind)[:n_more]
-                neighbors_distances[i] = np.hstack((
-                    neighbors_distances[i], ndis_tmp[i_tmp][sorted_ind]))
-
-                neighbors_indices[i] = np.hstack((
-                    neighbors_indices[i], nidx_tmp[i_tmp][sorted_ind]))
-
-        return neighbors_distances, neighbors_indices
+        vlds.validate_return_format(
+            return_format, valid_formats=("list", "dense"))
+        vlds.validate_n_jobs(n_jobs)
+
+        # Each chunk of centres fills its own rows of the results
+        neighbors_distances = np.empty((len(centres), n))
+        neighbors_indices = np.empty((len(centres), n), dtype=int)
+        worker = functools.partial(self._nearest, kind=kind)
+        if self.unit_vectors:
+            # the rows are filled with chords of the unit vectors
+            (centres,) = self._to_chords(centres)
+        self._run_chunks(
+            worker, n_jobs, centres, neighbors_distances, neighbors_indices)
+        if self.unit_vectors:
+            neighbors_distances = distances.chord_to_angle(neighbors_distances)
+
+        if return_format == "dense":
+            return neighbors_distances, neighbors_indices
+        return list(neighbors_distances), list(neighbors_indices)
@@ -11,16 +11,175 @@
 # DOCS
 # =============================================================================
 
-"""Distances implementations for GriSPy."""
+"""Distances implementations for GriSPy.
+
+A metric can follow one of two protocols. A per-centre metric is called
+once for each centre as ``metric(c0, centres, dim)`` and returns the
+distance from the point ``c0`` to each of the points ``centres``. A batched
+metric, marked with the ``batched`` decorator, is called once for many
+centres as ``metric(centres, centre_ids, points)`` and returns the distance
+from ``centres[centre_ids[i]]`` to ``points[i]`` for each i, so the work
+that only depends on the centres is done once for all the pairs. The
+built-in metrics are batched, the ``*_pairs`` functions, and their
+per-centre versions are kept for direct use.
+
+"""
 
 
 # =============================================================================
 # IMPORTS
 # =============================================================================
 
+import functools
+
 import numpy as np
 
-from scipy.spatial.distance import cdist
+
+# =============================================================================
+# PROTOCOLS
+# =============================================================================
+
+def batched(metric):
+    """Mark a metric as batched.
+
+    A batched metric is called as ``metric(centres, centre_ids, points)``
+    and returns the flat distances from ``centres[centre_ids]`` to
+    ``points``. The pairs of each centre are contiguous, but a centre can
+    have no pairs. Use it as a decorator::
+
+        @distances.batched
+        def hamming(centres, centre_ids, points):
+            return (points != centres[centre_ids]).sum(axis=1)
+
+    """
+    metric.batched = True
+    return metric
+
+
+def is_batched(metric):
+    """Check if a metric was marked as batched."""
+    return getattr(metric, "batched", False) is True
+
+
+def per_centre(metric):
+    """Adapt a per-centre metric to the batched protocol.
+
+    ``metric(c0, centres, dim)`` is called once for each run of pairs with
+    the same centre.
+
+    """
+    @batched
+    @functools.wraps(metric)
+    def adapted(centres, centre_ids, points):
+        dis = np.empty(len(points))
+        edges = np.flatnonzero(np.diff(centre_ids)) + 1
+        edges = np.concatenate(([0], edges, [len(points)]))
+        for start, stop in zip(edges[:-1], edges[1:]):
+            if start == stop:
+                continue
+            dis[start:stop] = metric(
+                centres[centre_ids[start]], points[start:stop],
+                points.shape[1])
+        return dis
+
+    return adapted
+
+
+def _one_centre(metric, c0, centres, dim):
+    """Call the batched ``metric`` with the single centre ``c0``."""
+    c0 = np.reshape(c0, (1, dim))
+    centres = np.reshape(centres, (-1, dim))
+    return metric(c0, np.zeros(len(centres), dtype=int), centres)
+
+
+# =============================================================================
+# BATCHED METRICS
+# =============================================================================
+
+@batched
+def euclid_pairs(centres, centre_ids, points):
+    """Euclidean distance of each pair of centre and point."""
+    diff = points - centres[centre_ids]
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+@batched
+def manhattan_pairs(centres, centre_ids, points):
+    """Manhattan (L1) distance of each pair of centre and point."""
+    return np.abs(points - centres[centre_ids]).sum(axis=1)
+
+
+@batched
+def chebyshev_pairs(centres, centre_ids, points):
+    """Chebyshev (L-infinity) distance of each pair of centre and point."""
+    return np.abs(points - centres[centre_ids]).max(axis=1, initial=0.)
+
+
+@batched
+def minkowski_pairs(centres, centre_ids, points, p=2., weights=None):
+    """Minkowski distance of each pair of centre and point.
+
+    The distance is ``(sum_k w_k |x_k - c_k| ** p) ** (1 / p)``, with
+    ``p >= 1`` and the weights ``w_k`` of each axis, all ones by default.
+    With ``p = inf`` it is the largest difference along the axes.
+
+    """
+    diff = np.abs(points - centres[centre_ids])
+    if np.isinf(p):
+        return diff.max(axis=1, initial=0.)
+    if weights is not None:
+        diff *= np.asarray(weights, dtype=float) ** (1. / p)
+    return (diff ** p).sum(axis=1) ** (1. / p)
+
+
+@batched
+def haversine_pairs(centres, centre_ids, points):
+    """Haversine distance of each pair of centre and point, in degrees.
+
+    The trigonometry of the centres is computed once for each centre, not
+    once for each pair.
+
+    """
+    lat1 = np.deg2rad(centres[:, 1])
+    lon1 = np.deg2rad(centres[:, 0])[centre_ids]
+    clat1 = np.cos(lat1)[centre_ids]
+    lat1 = lat1[centre_ids]
+    lon2 = np.deg2rad(points[:, 0])
+    lat2 = np.deg2rad(points[:, 1])
+
+    sdlon = np.sin((lon2 - lon1) / 2.)
+    sdlat = np.sin((lat2 - lat1) / 2.)
+    clat2 = np.cos(lat2)
+    num1 = sdlat ** 2
+    num2 = clat1 * clat2 * sdlon ** 2
+    sep = 2 * np.arcsin(np.sqrt(num1 + num2))
+    return np.rad2deg(sep)
+
+
+@batched
+def vincenty_pairs(centres, centre_ids, points):
+    """Vincenty distance of each pair of centre and point, in degrees.
+
+    The trigonometry of the centres is computed once for each centre, not
+    once for each pair.
+
+    """
+    lat1 = np.deg2rad(centres[:, 1])
+    lon1 = np.deg2rad(centres[:, 0])[centre_ids]
+    slat1 = np.sin(lat1)[centre_ids]
+    clat1 = np.cos(lat1)[centre_ids]
+    lon2 = np.deg2rad(points[:, 0])
+    lat2 = np.deg2rad(points[:, 1])
+
+    sdlon = np.sin(lon2 - lon1)
+    cdlon = np.cos(lon2 - lon1)
+    slat2 = np.sin(lat2)
+    clat2 = np.cos(lat2)
+    num1 = clat2 * sdlon
+    num2 = clat1 * slat2 - slat1 * clat2 * cdlon
+    denominator = slat1 * slat2 + clat1 * clat2 * cdlon
+    sep = np.arctan2(np.sqrt(num1 ** 2 + num2 ** 2), denominator)
+    return np.rad2deg(sep)
 
 
 # =============================================================================
@@ -39,9 +198,7 @@ def euclid(c0, centres, dim):
     https://en.wikipedia.org/wiki/Euclidean_distance
 
     """
-    c0 = c0.reshape((-1, dim))
-    d = cdist(c0, centres).reshape((-1,))
-    return d
+    return _one_centre(euclid_pairs, c0, centres, dim)
 
 
 def haversine(c0, centres, dim):
@@ -55,19 +212,7 @@ def haversine(c0, centres, dim):
     https://en.wikipedia.org/wiki/Haversine_formula
 
     """
-    lon1 = np.deg2rad(c0[0])
-    lat1 = np.deg2rad(c0[1])
-    lon2 = np.deg2rad(centres[:, 0])
-    lat2 = np.deg2rad(centres[:, 1])
-
-    sdlon = np.sin((lon2 - lon1) / 2.)
-    sdlat = np.sin((lat2 - lat1) / 2.)
-    clat1 = np.cos(lat1)
-    clat2 = np.cos(lat2)
-    num1 = sdlat ** 2
-    num2 = clat1 * clat2 * sdlon ** 2
-    sep = 2 * np.arcsin(np.sqrt(num1 + num2))
-    return np.rad2deg(sep)
+    return _one_centre(haversine_pairs, c0, centres, dim)
 
 
 def vincenty(c0, centres, dim):
@@ -81,19 +226,41 @@ def vincenty(c0, centres, dim):
     distance. More info: https://en.wikipedia.org/wiki/Vincenty%27s_formulae
 
     """
-    lon1 = np.deg2rad(c0[0])
-    lat1 = np.deg2rad(c0[1])
-    lon2 = np.deg2rad(centres[:, 0])
-    lat2 = np.deg2rad(centres[:, 1])
+    return _one_centre(vincenty_pairs, c0, centres, dim)
 
-    sdlon = np.sin(lon2 - lon1)
-    cdlon = np.cos(lon2 - lon1)
-    slat1 = np.sin(lat1)
-    slat2 = np.sin(lat2)
-    clat1 = np.cos(lat1)
-    clat2 = np.cos(lat2)
-    num1 = clat2 * sdlon
-    num2 = clat1 * slat2 - slat1 * clat2 * cdlon
-    denominator = slat1 * slat2 + clat1 * clat2 * cdlon
-    sep = np.arctan2(np.sqrt(num1 ** 2 + num2 ** 2), denominator)
-    return np.rad2deg(sep)
+
+def unit_vectors(lonlat):
+    """Return the unit vectors of points given by longitude and latitude.
+
+    The longitude and latitude are the columns of ``lonlat``, in degrees.
+    Returns an array of shape (n, 3) with the cartesian coordinates
+    ``(x, y, z)`` of the points on the unit sphere. The euclidean distance
+    between two unit vectors is the chord of their angular distance, see
+    ``angle_to_chord``.
+
+    """
+    lon = np.deg2rad(lonlat[:, 0])
+    lat = np.deg2rad(lonlat[:, 1])
+    clat = np.cos(lat)
+    return np.stack(
+        [clat * np.cos(lon), clat * np.sin(lon), np.sin(lat)], axis=1)
+
+
+def angle_to_chord(angle):
+    """Chord of the unit sphere that spans an angle given in degrees.
+
+    The chord is ``2 sin(angle / 2)``, the angles larger than 180 degrees
+    span the diameter.
+
+    """
+    return 2. * np.sin(np.deg2rad(np.minimum(angle, 180.)) / 2.)
+
+
+def chord_to_angle(chord):
+    """Angle in degrees spanned by a chord of the unit sphere.
+
+    The inverse of ``angle_to_chord``, the chords are clipped to the
+    diameter as they are computed with rounding errors.
+
+    """
+    return np.rad2deg(2. * np.arcsin(np.minimum(chord, 2.) / 2.))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Compiled kernels for the neighbor searches.
+
+The kernels are compiled with Numba, which is an optional dependency. When
+Numba is not installed ``NUMBA_AVAILABLE`` is False and GriSPy uses its
+NumPy implementation instead.
+
+"""
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+NUMBA_AVAILABLE = numba is not None
+
+#: Relative tolerance to discard a cell, the cell edges are computed with
+#: rounding errors.
+CELL_TOLERANCE = 1.0e-9
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def _jit(func):
+    """Compile ``func`` with Numba if it is available."""
+    if not NUMBA_AVAILABLE:  # pragma: no cover
+        return func
+    return numba.njit(nogil=True)(func)
+
+
+@_jit
+def _grow(array, size):
+    """Return a copy of ``array`` with room for ``size`` elements."""
+    new = np.empty(size, dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+
+@_jit
+def _distance2(centres, i, data, j, periods):
+    """Squared distance from the centre i to the point j."""
+    dis2 = 0.
+    for k in range(centres.shape[1]):
+        diff = data[j, k] - centres[i, k]
+        if periods[k] > 0:
+            diff -= periods[k] * np.rint(diff / periods[k])
+        dis2 += diff * diff
+    return dis2
+
+
+@_jit
+def _cell_start(offsets, cells, flat_cell):
+    """Position in the index where the points of a flat cell start.
+
+    ``cells`` has the occupied cells of a sparse index, or is empty for a
+    dense index.
+
+    """
+    if len(cells) == 0:
+        return offsets[flat_cell]
+    return offsets[np.searchsorted(cells, flat_cell)]
+
+
+@_jit
+def _collect(
+    i, begin, end, centres, data, order, periods, upper2, lower2, size,
+    capacity, centre_ids, distances, indices,
+):
+    """Add the points ``order[begin:end]`` that are neighbors of centre i.
+
+    Returns the new size of the results and the results, which are grown
+    when they are full.
+
+    """
+    for pos in range(begin, end):
+        j = order[pos]
+        dis2 = _distance2(centres, i, data, j, periods)
+        if dis2 > upper2 or dis2 <= lower2:
+            continue
+
+        if size == capacity:
+            capacity *= 2
+            centre_ids = _grow(centre_ids, capacity)
+            distances = _grow(distances, capacity)
+            indices = _grow(indices, capacity)
+        centre_ids[size] = i
+        distances[size] = np.sqrt(dis2)
+        indices[size] = j
+        size += 1
+    return size, capacity, centre_ids, distances, indices
+
+
+@_jit
+def euclid_neighbors(
+    centres, distance_upper_bound, distance_lower_bound, data, order,
+    offsets, cells, bins_low, bins_high, n_cells, periods, count_only=False,
+):
+    """Find the neighbors of each centre within the given distances.
+
+    The cells of the box around each centre are traversed with the axis 0
+    varying faster, the cells farther than the upper bound are skipped and
+    the points of the other cells are kept if their euclidean distance ``d``
+    is ``lower < d <= upper``, compared as squared distances. The results
+    are the same, and in the same order, as those of the NumPy
+    implementation.
+
+    If ``count_only`` is True the neighbors are only counted. The cells
+    entirely within the upper bound are then counted whole, without any
+    distance computation.
+
+    Parameters
+    ----------
+    centres: ndarray, shape (m, k)
+        The centres, already within the periodic range of the wrapped axes.
+    distance_upper_bound, distance_lower_bound: ndarray, shape (m,)
+        The distances of each centre.
+    data: ndarray, shape (n, k)
+        The indexed points.
+    order, offsets, cells: ndarray
+        The cell index of the grid, see ``grispy.core.CellIndex``. For a
+        dense index ``cells`` is empty.
+    bins_low, bins_high: ndarray, shape (k,)
+        The first and last bin edges along each axis.
+    n_cells: ndarray, shape (k,)
+        The number of cells along each axis.
+    periods: ndarray, shape (k,)
+        The period of each wrapped axis, or zero for the axes that are not
+        wrapped.
+    count_only: bool, optional
+        If True the neighbors are not returned, only counted.
+
+    Returns
+    -------
+    centre_ids: ndarray
+        Index of the centre of each neighbor, sorted.
+    distances: ndarray
+        Distance of each neighbor to its centre.
+    indices: ndarray
+        Index of each neighbor in the data.
+    counts: ndarray, shape (m,)
+        Number of neighbors of each centre.
+
+    """
+    n_centres, dim = centres.shape
+    cell_size = (bins_high - bins_low) / n_cells
+    tolerance = CELL_TOLERANCE * cell_size.max()
+
+    strides = np.empty(dim, dtype=np.int64)
+    stride = 1
+    for k in range(dim):
+        strides[k] = stride
+        stride *= n_cells[k]
+
+    counts = np.zeros(n_centres, dtype=np.int64)
+    size = 0
+    capacity = 1 if count_only else max(16, 4 * n_centres)
+    centre_ids = np.empty(capacity, dtype=np.int64)
+    distances = np.empty(capacity, dtype=np.float64)
+    indices = np.empty(capacity, dtype=np.int64)
+
+    k_cell_min = np.empty(dim, dtype=np.int64)
+    k_cell_max = np.empty(dim, dtype=np.int64)
+    k_cell = np.empty(dim, dtype=np.int64)
+
+    for i in range(n_centres):
+        upper = distance_upper_bound[i]
+        lower = distance_lower_bound[i]
+
+        # the squared distances are compared, only the roots of the kept
+        # ones are taken
+        upper2 = upper * upper
+        lower2 = lower * lower if lower >= 0. else -1.
+
+        # The box of cells touched by the search radius
+        out_of_field = False
+        for k in range(dim):
+            c = centres[i, k]
+            width = bins_high[k] - bins_low[k]
+            x_min = n_cells[k] * (c - upper - bins_low[k]) / width
+            x_max = n_cells[k] * (c + upper - bins_low[k]) / width
+            if periods[k] > 0:
+                k_min, k_max = int(np.floor(x_min)), int(np.floor(x_max))
+                if k_max - k_min + 1 >= n_cells[k]:
+                    k_min, k_max = 0, n_cells[k] - 1
+            else:
+                if c - upper > bins_high[k] or c + upper < bins_low[k]:
+                    out_of_field = True
+                    break
+                k_min = min(max(int(x_min), 0), n_cells[k] - 1)
+                k_max = min(max(int(x_max), 0), n_cells[k] - 1)
+            k_cell_min[k] = k_min
+            k_cell_max[k] = k_max
+            k_cell[k] = k_min
+        if out_of_field:
+            continue
+
+        # The cells are visited by rows along the axis 0, as the points of
+        # consecutive cells of a row are consecutive in the index
+        row_len = k_cell_max[0] - k_cell_min[0] + 1
+        whole_row = periods[0] > 0 and row_len >= n_cells[0]
+        while True:
+            # flat index of the row and its distance to the centre, the
+            # closest and the farthest
+            flat_row = 0
+            gap2 = 0.
+            far2 = 0.
+            for k in range(1, dim):
+                wrapped_cell = k_cell[k]
+                if periods[k] > 0:
+                    wrapped_cell = k_cell[k] % n_cells[k]
+                flat_row += strides[k] * wrapped_cell
+
+                c = centres[i, k]
+                low = bins_low[k] + k_cell[k] * cell_size[k]
+                gap = max(low - c, c - (low + cell_size[k]))
+                if periods[k] > 0:
+                    gap = min(gap, max(
+                        low - periods[k] - c,
+                        c - (low + cell_size[k] - periods[k])))
+                    gap = min(gap, max(
+                        low + periods[k] - c,
+                        c - (low + cell_size[k] + periods[k])))
+                if gap > 0.:
+                    gap2 += gap * gap
+                far = max(c - low, low + cell_size[k] - c)
+                far2 += far * far
+
+            reach2 = (upper + tolerance) ** 2 - gap2
+            if reach2 >= 0.:
+                # only the cells of the row within the sphere
+                row_min, row_max = k_cell_min[0], k_cell_max[0]
+                if not whole_row:
+                    c = centres[i, 0]
+                    reach = np.sqrt(reach2)
+                    width = bins_high[0] - bins_low[0]
+                    x_min = n_cells[0] * (c - reach - bins_low[0]) / width
+                    x_max = n_cells[0] * (c + reach - bins_low[0]) / width
+                    if periods[0] > 0:
+                        x_min, x_max = np.floor(x_min), np.floor(x_max)
+                    row_min = max(row_min, int(x_min))
+                    row_max = min(row_max, int(x_max))
+
+                # runs of cells that do not wrap around the axis
+                start = row_min
+                while start <= row_max:
+                    first = start
+                    if periods[0] > 0:
+                        first = start % n_cells[0]
+                    stop = min(row_max, start + n_cells[0] - 1 - first)
+                    last = first + stop - start
+                    run_start = start
+                    start = stop + 1
+
+                    if not count_only:
+                        begin = _cell_start(offsets, cells, flat_row + first)
+                        end = _cell_start(offsets, cells, flat_row + last + 1)
+                        size, capacity, centre_ids, distances, indices = (
+                            _collect(
+                                i, begin, end, centres, data, order, periods,
+                                upper2, lower2, size, capacity, centre_ids,
+                                distances, indices))
+                        continue
+
+                    # the cells entirely within the sphere are counted whole
+                    c = centres[i, 0]
+                    for cell in range(first, last + 1):
+                        begin = _cell_start(offsets, cells, flat_row + cell)
+                        end = _cell_start(
+                            offsets, cells, flat_row + cell + 1)
+                        unwrapped_cell = cell - first + run_start
+                        low = bins_low[0] + unwrapped_cell * cell_size[0]
+                        far = max(c - low, low + cell_size[0] - c)
+                        if np.sqrt(far2 + far * far) + tolerance <= upper:
+                            counts[i] += end - begin
+                            continue
+                        for pos in range(begin, end):
+                            dis2 = _distance2(
+                                centres, i, data, order[pos], periods)
+                            if lower2 < dis2 <= upper2:
+                                counts[i] += 1
+
+            # next row of the box
+            k = 1
+            while k < dim:
+                k_cell[k] += 1
+                if k_cell[k] <= k_cell_max[k]:
+                    break
+                k_cell[k] = k_cell_min[k]
+                k += 1
+            if k >= dim:
+                break
+
+    if not count_only:
+        counts = np.bincount(centre_ids[:size], minlength=n_centres)
+    return centre_ids[:size], distances[:size], indices[:size], counts
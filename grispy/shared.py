@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Share a built GriSPy grid between processes.
+
+The arrays of the grid are copied once into ``multiprocessing.shared_memory``
+blocks. Other processes attach to the blocks and get a GriSPy instance whose
+arrays are views of the shared memory, so N workers use one copy of the
+grid instead of N. ``multiprocessing.shared_memory`` is only available since
+Python 3.8, before that ``SHARED_MEMORY_AVAILABLE`` is False and sharing a
+grid raises a RuntimeError.
+
+Example
+-------
+>>> with gsp.to_shared_memory() as shared:
+...     # shared.index is small and can be sent to the workers
+...     pool.map(work, [(shared.index, chunk) for chunk in chunks])
+
+and within each worker
+
+>>> gsp = GriSPy.from_shared_memory(index)
+
+"""
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import numpy as np
+
+import attr
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+SHARED_MEMORY_AVAILABLE = shared_memory is not None
+
+
+# =============================================================================
+# CLASSES
+# =============================================================================
+
+@attr.s(frozen=True)
+class SharedIndex:
+    """Description of a grid exported to shared memory.
+
+    This object is small and picklable, so it can be sent to other processes
+    to attach to the grid.
+
+    Attributes
+    ----------
+    arrays: dict
+        For each exported array, a tuple with the name of its shared memory
+        block, its shape and its dtype.
+    params: dict
+        The init params of the grid other than the data.
+    time_: grispy.core.BuildStats
+        Object containing the building time and the date of build.
+    """
+
+    arrays = attr.ib()
+    params = attr.ib()
+    time_ = attr.ib()
+
+
+@attr.s
+class SharedGrid:
+    """Owner of the shared memory blocks of an exported grid.
+
+    The blocks live until ``unlink`` is called. Used as a context manager
+    the blocks are released at exit.
+
+    Attributes
+    ----------
+    index: grispy.shared.SharedIndex
+        Description of the exported grid to attach to it.
+    blocks: list
+        The ``SharedMemory`` blocks of the grid.
+    """
+
+    index = attr.ib()
+    blocks = attr.ib(repr=False)
+
+    def __enter__(self):
+        """Return the shared grid."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the shared memory."""
+        self.close()
+        self.unlink()
+
+    def close(self):
+        """Close the access to the shared memory from this instance."""
+        for block in self.blocks:
+            block.close()
+
+    def unlink(self):
+        """Request the shared memory to be destroyed."""
+        for block in self.blocks:
+            block.unlink()
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def _check_available():
+    """Raise a RuntimeError if there is no shared memory support."""
+    if not SHARED_MEMORY_AVAILABLE:
+        raise RuntimeError(
+            "Shared memory: Requires multiprocessing.shared_memory, "
+            "available since Python 3.8"
+        )
+
+
+def share(gsp):
+    """Copy the arrays of a built grid into shared memory.
+
+    Parameters
+    ----------
+    gsp: grispy.GriSPy
+        The grid to export.
+
+    Returns
+    -------
+    shared: grispy.shared.SharedGrid
+        The owner of the shared memory. Its ``index`` can be used to attach
+        to the grid from any process.
+
+    """
+    _check_available()
+
+    blocks, arrays = [], {}
+    for name, array in gsp._index_arrays().items():
+        array = np.asarray(array)
+        block = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+
+        blocks.append(block)
+        arrays[name] = (block.name, array.shape, array.dtype.str)
+
+    index = SharedIndex(
+        arrays=arrays, params=gsp._init_params(), time_=gsp.time_)
+    return SharedGrid(index=index, blocks=blocks)
+
+
+def attach(index, cls=None):
+    """Create a GriSPy that uses a grid exported to shared memory.
+
+    No array is copied, the arrays are read only views of the blocks. The
+    blocks stay open while the returned instance exists.
+
+    Parameters
+    ----------
+    index: grispy.shared.SharedIndex
+        Description of the exported grid.
+    cls: type, optional
+        The GriSPy class to create. Default: grispy.GriSPy
+
+    Returns
+    -------
+    gsp: grispy.GriSPy
+        The grid, with its arrays read from the shared memory.
+
+    """
+    from .core import GriSPy
+
+    _check_available()
+    cls = GriSPy if cls is None else cls
+
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in index.arrays.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        arrays[name] = view
+        blocks.append(block)
+
+    gsp = cls._from_arrays(arrays, params=index.params, time_=index.time_)
+
+    # keep the blocks open as long as the grid exists
+    gsp.shared_blocks_ = blocks
+    return gsp
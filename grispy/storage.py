@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Save and load built GriSPy grids.
+
+A saved grid is a directory with one raw ``.npy`` file for each array of
+the grid (the data, the bins and the cell index) and a JSON file with the
+params and the building stats. The ``.npy`` files can be memory-mapped, so
+loading a grid does not read nor rebuild anything.
+
+"""
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import json
+import time
+import pathlib
+import datetime
+
+import numpy as np
+
+import attr
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+METADATA_FILE = "grispy.json"
+
+FORMAT_VERSION = 1
+
+# The dates of the build stats, datetime.fromisoformat needs Python 3.7
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def _params_to_json(params):
+    """Convert the init params in something JSON can store."""
+    params = dict(params)
+    params["periodic"] = [
+        [axis, limits] for axis, limits in params["periodic"].items()]
+    if not isinstance(params["N_cells"], str):
+        params["N_cells"] = np.asarray(params["N_cells"]).tolist()
+    for name in ("expected_radius", "mean_occupancy"):
+        # the numpy scalars are accepted too
+        if isinstance(params[name], np.generic):
+            params[name] = params[name].item()
+    if params["metric_params"] is not None:
+        params["metric_params"] = {
+            key: np.asarray(value).tolist()
+            for key, value in params["metric_params"].items()}
+    return params
+
+
+def _params_from_json(params):
+    """Inverse of ``_params_to_json``."""
+    params = dict(params)
+    params["periodic"] = {
+        axis: (None if limits is None else tuple(limits))
+        for axis, limits in params["periodic"]}
+    if isinstance(params["N_cells"], list):
+        params["N_cells"] = tuple(params["N_cells"])
+    return params
+
+
+def save(gsp, path):
+    """Save a built grid in the directory ``path``.
+
+    Parameters
+    ----------
+    gsp: grispy.GriSPy
+        The grid to save.
+    path: str or pathlib.Path
+        Directory where the grid is saved. It is created if needed.
+
+    """
+    if callable(gsp.metric):
+        raise TypeError(
+            "Save: Only grids with a built-in metric can be saved. "
+            "Got instead metric {}".format(gsp.metric))
+
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    arrays = gsp._index_arrays()
+    for name, array in arrays.items():
+        np.save(path / (name + ".npy"), array, allow_pickle=False)
+
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "arrays": list(arrays),
+        "params": _params_to_json(gsp._init_params()),
+        "time": {
+            "buildtime": gsp.time_.buildtime,
+            "periodicity_set_at": gsp.time_.periodicity_set_at.strftime(
+                DATETIME_FORMAT),
+            "datetime": gsp.time_.datetime.strftime(DATETIME_FORMAT)}}
+    with open(path / METADATA_FILE, "w") as fp:
+        json.dump(metadata, fp, indent=2)
+
+
+def load(path, mmap=True, cls=None):
+    """Load a grid saved with ``save``.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+        Directory where the grid was saved.
+    mmap: bool, optional
+        If True the arrays are memory-mapped read only. Otherwise they are
+        read into memory. Default: True
+    cls: type, optional
+        The GriSPy class to create. Default: grispy.GriSPy
+
+    Returns
+    -------
+    gsp: grispy.GriSPy
+        The saved grid.
+
+    """
+    from .core import GriSPy, BuildStats
+
+    t0 = time.time()
+    cls = GriSPy if cls is None else cls
+    path = pathlib.Path(path)
+
+    with open(path / METADATA_FILE) as fp:
+        metadata = json.load(fp)
+    if metadata["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            "Load: Unknown format version {}. Expected {}".format(
+                metadata["format_version"], FORMAT_VERSION))
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(
+            path / (name + ".npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in metadata["arrays"]}
+
+    saved_time = metadata["time"]
+    time_ = BuildStats(
+        buildtime=saved_time["buildtime"],
+        periodicity_set_at=datetime.datetime.strptime(
+            saved_time["periodicity_set_at"], DATETIME_FORMAT),
+        datetime=datetime.datetime.strptime(
+            saved_time["datetime"], DATETIME_FORMAT))
+
+    gsp = cls._from_arrays(
+        arrays, params=_params_from_json(metadata["params"]), time_=time_)
+    gsp.time_ = attr.evolve(
+        gsp.time_, loadtime=time.time() - t0,
+        n_cells=tuple(gsp.n_cells_.tolist()))
+    return gsp
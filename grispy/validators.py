@@ -43,6 +43,51 @@ def validate_centres(centres, data):
         raise ValueError("Centres: Array must have real numbers")
 
 
+def validate_points(points, data):
+    """Validate method params: points."""
+    # Chek if numpy array
+    if not isinstance(points, np.ndarray):
+        raise TypeError(
+            "Points: Argument must be a numpy array."
+            "Got instead type {}".format(type(points))
+        )
+
+    # Check if data has the expected dimension
+    if points.ndim != 2 or points.shape[1] != data.shape[1]:
+        raise ValueError(
+            "Points: Array has the wrong shape. Expected shape of (n, {}), "
+            "got instead {}".format(data.shape[1], points.shape)
+        )
+
+    # Check if every data point is valid
+    if not np.isfinite(points).all():
+        raise ValueError("Points: Array must have real numbers")
+
+
+def validate_indices(indices, removed):
+    """Validate method params: indices of the points to remove."""
+    # Check if integer array
+    indices = np.asarray(indices)
+    if indices.size == 0:
+        # no points, whatever the dtype of the empty array
+        return
+    if not np.issubdtype(indices.dtype, np.integer):
+        raise TypeError(
+            "Indices: Argument must be an array of integers. "
+            "Got instead type {}".format(indices.dtype)
+        )
+
+    # Check if the points exist
+    if np.any((indices < 0) | (indices >= len(removed))):
+        raise ValueError(
+            "Indices: Must be between 0 and {}".format(len(removed) - 1)
+        )
+    if np.any(removed[indices]):
+        raise ValueError("Indices: Some points were already removed")
+    if len(np.unique(indices)) != indices.size:
+        raise ValueError("Indices: Must not be repeated")
+
+
 def validate_equalsize(a, b):
     """Check if two arrays have the same lenght."""
     if len(a) != len(b):
@@ -72,6 +117,40 @@ def validate_distance_bound(distance, periodic):
             )
 
 
+def validate_half_widths(half_widths, centres, periodic):
+    """Half widths of the boxes, scalar or numpy array by axis or centre."""
+    # Check if type is valid
+    if not (np.isscalar(half_widths) or isinstance(half_widths, np.ndarray)):
+        raise TypeError(
+            "Half widths: Must be either a scalar or a numpy array. "
+            "Got instead type {}".format(type(half_widths))
+        )
+
+    # Check if shape is valid
+    dim = centres.shape[1]
+    if np.ndim(half_widths) and np.shape(half_widths) not in (
+            (dim,), centres.shape):
+        raise ValueError(
+            "Half widths: Array has the wrong shape. Expected shape of ({},) "
+            "or {}, got instead {}".format(
+                dim, centres.shape, np.shape(half_widths))
+        )
+
+    # Check if value is valid
+    if not np.all(np.asarray(half_widths) >= 0):
+        raise ValueError("Half widths: Must be positive.")
+
+    # Check half widths are not larger than the periodic range of the axis
+    half_widths = np.broadcast_to(half_widths, centres.shape)
+    for k, v in periodic.items():
+        if v is None:
+            continue
+        if np.any(half_widths[:, k] > (v[1] - v[0])):
+            raise ValueError(
+                "Half widths can not be higher than the periodicity range"
+            )
+
+
 def validate_shell_distances(lower_bound, upper_bound, periodic):
     """Distance bounds, upper and lower, can be scalar or numpy array."""
     validate_distance_bound(lower_bound, periodic)
@@ -111,6 +190,39 @@ def validate_sortkind(kind):
         )
 
 
+def validate_return_format(return_format, valid_formats=("list", "csr")):
+    """Define valid formats for the returned neighbors."""
+    # Chek if string
+    if not isinstance(return_format, str):
+        raise TypeError(
+            "Return format: Format name must be a string. "
+            "Got instead type {}".format(type(return_format))
+        )
+
+    # Check if name is valid
+    if return_format not in valid_formats:
+        raise ValueError(
+            "Return format: Got an invalid name: '{}'. "
+            "Options are: {}".format(return_format, list(valid_formats))
+        )
+
+
+def validate_n_jobs(n_jobs):
+    """Validate method params: n_jobs."""
+    # Chek if int
+    if not isinstance(n_jobs, int) or isinstance(n_jobs, bool):
+        raise TypeError(
+            "n_jobs: Argument must be an integer. "
+            "Got instead type {}".format(type(n_jobs))
+        )
+    # Check if number is valid, i.e. positive or -1 for all the cores
+    if n_jobs < 1 and n_jobs != -1:
+        raise ValueError(
+            "n_jobs: Argument must be a positive integer or -1. "
+            "Got instead {}".format(n_jobs)
+        )
+
+
 def validate_n_nearest(n, data, periodic):
     """Validate method params: n_nearest."""
     # Chek if int
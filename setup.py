@@ -35,6 +35,8 @@ from setuptools import setup
 
 REQUIREMENTS = ["numpy", "scipy", "attrs", "matplotlib"]
 
+EXTRAS_REQUIREMENTS = {"numba": ["numba"]}
+
 PATH = pathlib.Path(os.path.abspath(os.path.dirname(__file__)))
 
 with open(PATH / "README.md") as fp:
@@ -87,7 +89,8 @@ def do_setup():
         packages=["grispy"],
         py_modules=["ez_setup"],
 
-        install_requires=REQUIREMENTS)
+        install_requires=REQUIREMENTS,
+        extras_require=EXTRAS_REQUIREMENTS)
 
 
 if __name__ == "__main__":
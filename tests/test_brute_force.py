@@ -10,7 +10,7 @@
 
 import pytest
 import numpy as np
-from grispy import GriSPy
+from grispy import GriSPy, core, distances
 from numpy.testing import assert_equal, assert_, assert_almost_equal
 
 
@@ -216,6 +216,46 @@ class Test_grispy:
             assert_almost_equal(b[i], d, decimal=16)
 
 
+class Test_nearest_neighbors_3d:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(42)
+        self.lbox = 10.0
+        self.data = self.random.uniform(0, self.lbox, size=(500, 3))
+        self.centres = self.random.uniform(0, self.lbox, size=(20, 3))
+        self.n_nearest = 16
+
+    def brute_force(self, shifts):
+        distances = []
+        for centre in self.centres:
+            d = np.concatenate([
+                np.sqrt(np.sum((self.data - centre + s) ** 2, axis=1))
+                for s in shifts])
+            distances.append(np.sort(d)[:self.n_nearest])
+        return distances
+
+    def test_nearest_neighbors_precision(self):
+        gsp = GriSPy(self.data, N_cells=8)
+        b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
+        expected = self.brute_force([np.zeros(3)])
+        for i in range(len(self.centres)):
+            assert_almost_equal(b[i], expected[i], decimal=14)
+            d = np.sqrt(np.sum((self.data[ind[i]] - self.centres[i]) ** 2, 1))
+            assert_almost_equal(d, b[i], decimal=14)
+
+    def test_nearest_neighbors_periodic_precision(self):
+        periodic = {0: (0, self.lbox), 2: (0, self.lbox)}
+        gsp = GriSPy(self.data, N_cells=8, periodic=periodic)
+        b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
+        shifts = [
+            np.array([x, 0, z])
+            for x in (-self.lbox, 0, self.lbox)
+            for z in (-self.lbox, 0, self.lbox)]
+        expected = self.brute_force(shifts)
+        for i in range(len(self.centres)):
+            assert_almost_equal(b[i], expected[i], decimal=14)
+
+
 class Test_periodicity_grispy:
 
     def setup_method(self, *args):
@@ -297,6 +337,766 @@ class Test_periodicity_grispy:
                 assert_(dis[i] >= upper_radii * (1.0 - self.eps))
 
 
+class Test_wrap_grispy:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(7)
+        self.lbox = 10.0
+        self.data = self.random.uniform(0, self.lbox, size=(500, 3))
+        self.centres = self.random.uniform(
+            -0.2 * self.lbox, 1.2 * self.lbox, size=(20, 3))
+        self.periodic = {0: (0, self.lbox), 1: (0, self.lbox)}
+        self.upper_radii = 0.3 * self.lbox
+        self.lower_radii = 0.2 * self.lbox
+        self.n_nearest = 16
+
+    def make_gsp(self):
+        return GriSPy(
+            self.data, N_cells=8, periodic=self.periodic,
+            periodic_mode="wrap")
+
+    def min_image_distances(self, centre):
+        diff = self.data - centre
+        for k in self.periodic:
+            diff[:, k] -= self.lbox * np.round(diff[:, k] / self.lbox)
+        return np.sqrt(np.sum(diff ** 2, axis=1))
+
+    def test_bubble_precision(self):
+        gsp = self.make_gsp()
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        for i, centre in enumerate(self.centres):
+            d = self.min_image_distances(centre)
+            mask = d <= self.upper_radii
+            assert_equal(len(b[i]), mask.sum())
+            assert_almost_equal(b[i], np.sort(d[mask]), decimal=14)
+            assert_almost_equal(d[ind[i]], b[i], decimal=14)
+
+    def test_shell_precision(self):
+        gsp = self.make_gsp()
+        b, ind = gsp.shell_neighbors(
+            self.centres,
+            distance_lower_bound=self.lower_radii,
+            distance_upper_bound=self.upper_radii,
+            sorted=True)
+        for i, centre in enumerate(self.centres):
+            d = self.min_image_distances(centre)
+            mask = (d <= self.upper_radii) & (d > self.lower_radii)
+            assert_equal(len(b[i]), mask.sum())
+            assert_almost_equal(b[i], np.sort(d[mask]), decimal=14)
+
+    def test_nearest_neighbors_precision(self):
+        gsp = self.make_gsp()
+        b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
+        for i, centre in enumerate(self.centres):
+            d = self.min_image_distances(centre)
+            assert_almost_equal(
+                b[i], np.sort(d)[:self.n_nearest], decimal=14)
+            assert_almost_equal(d[ind[i]], b[i], decimal=14)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_per_axis_cells(self, periodic_mode):
+        gsp = GriSPy(
+            self.data, N_cells=(8, 3, 5), periodic=self.periodic,
+            periodic_mode=periodic_mode)
+        centres = self.centres % self.lbox
+        b, ind = gsp.bubble_neighbors(
+            centres, distance_upper_bound=self.upper_radii, sorted=True)
+        nb, nind = gsp.nearest_neighbors(centres, n=self.n_nearest)
+        for i, centre in enumerate(centres):
+            d = self.min_image_distances(centre)
+            assert_almost_equal(
+                b[i], np.sort(d[d <= self.upper_radii]), decimal=14)
+            assert_almost_equal(
+                nb[i], np.sort(d)[:self.n_nearest], decimal=14)
+
+    def test_same_as_mirror(self):
+        gsp_wrap = self.make_gsp()
+        gsp_mirror = GriSPy(self.data, N_cells=8, periodic=self.periodic)
+        centres = self.centres % self.lbox
+        b_wrap, ind_wrap = gsp_wrap.bubble_neighbors(
+            centres, distance_upper_bound=self.upper_radii, sorted=True)
+        b_mirror, ind_mirror = gsp_mirror.bubble_neighbors(
+            centres, distance_upper_bound=self.upper_radii, sorted=True)
+        for i in range(len(centres)):
+            assert_almost_equal(b_wrap[i], b_mirror[i], decimal=14)
+            assert_equal(np.sort(ind_wrap[i]), np.sort(ind_mirror[i]))
+
+
+class Test_count_neighbors:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(42)
+        self.lbox = 10.0
+        self.data = self.random.uniform(0, self.lbox, size=(2000, 3))
+        self.centres = self.random.uniform(0, self.lbox, size=(40, 3))
+        self.upper_radii = self.random.uniform(0, 0.5 * self.lbox, size=40)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    @pytest.mark.parametrize("periodic_axes", [[], [0], [0, 1, 2]])
+    def test_same_as_bubble(self, periodic_mode, periodic_axes):
+        periodic = {k: (0, self.lbox) for k in periodic_axes}
+        gsp = GriSPy(
+            self.data, N_cells=8, periodic=periodic,
+            periodic_mode=periodic_mode)
+        dist, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        assert_equal(counts, [len(i) for i in ind])
+
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, n_jobs=3)
+        assert_equal(counts, [len(i) for i in ind])
+
+    def test_haversine(self):
+        data = self.random.uniform(0, np.pi, size=(1000, 2))
+        gsp = GriSPy(data, metric="haversine")
+        dist, ind = gsp.bubble_neighbors(data[:20], distance_upper_bound=0.3)
+        counts = gsp.count_neighbors(data[:20], distance_upper_bound=0.3)
+        assert_equal(counts, [len(i) for i in ind])
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_cells_inside(self, periodic_mode):
+        periodic = {0: (0, self.lbox)}
+        gsp = GriSPy(
+            self.data, N_cells=8, periodic=periodic,
+            periodic_mode=periodic_mode)
+        centres = gsp._wrap_centres(self.centres)
+        lower_radii = 0.5 * self.upper_radii
+        centre_ids, cells, inside = gsp._get_neighbor_cells(
+            centres, self.upper_radii, lower_radii, shell_flag=True,
+            classify=True)
+        assert_(inside.any())
+
+        centre_ids, dis, _ = gsp._get_neighbor_distance(
+            centres, centre_ids[inside], cells[inside])
+        assert_(np.all(dis <= self.upper_radii[centre_ids]))
+        assert_(np.all(dis > lower_radii[centre_ids]))
+
+    @pytest.mark.parametrize("return_format", ["list", "csr"])
+    def test_indices_only(self, return_format):
+        periodic = {0: (0, self.lbox)}
+        gsp = GriSPy(self.data, N_cells=8, periodic=periodic)
+        expected = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format=return_format)
+        result = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format=return_format, return_distance=False)
+        if return_format == "csr":
+            assert_equal(result[0], expected[1])
+            assert_equal(result[1], expected[2])
+        else:
+            for r, e in zip(result, expected[1]):
+                assert_equal(r, e)
+
+        expected = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=0.5 * self.upper_radii,
+            distance_upper_bound=self.upper_radii, sorted=True,
+            return_format=return_format)
+        result = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=0.5 * self.upper_radii,
+            distance_upper_bound=self.upper_radii, sorted=True,
+            return_format=return_format, return_distance=False)
+        if return_format == "csr":
+            assert_equal(result[0], expected[1])
+        else:
+            for r, e in zip(result, expected[1]):
+                assert_equal(r, e)
+
+
+class Test_cell_pruning:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(99)
+        # cells much longer along the axis 0 than along the others
+        self.data = self.random.uniform(0, 1, size=(3000, 4)) * [
+            40, 4, 2, 1]
+        self.centres = self.data[:30] + self.random.normal(size=(30, 4))
+        self.upper_radii = self.random.uniform(0.5, 5, size=30)
+        self.lower_radii = self.random.uniform(0.2, 1, size=30) * (
+            self.upper_radii)
+
+    def test_bubble_and_shell(self):
+        gsp = GriSPy(self.data, N_cells=6)
+        _, b_ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        _, s_ind = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=self.lower_radii,
+            distance_upper_bound=self.upper_radii)
+        for i, centre in enumerate(self.centres):
+            d = np.sqrt(np.sum((self.data - centre) ** 2, axis=1))
+            expected = np.flatnonzero(d <= self.upper_radii[i])
+            assert_equal(np.sort(b_ind[i]), expected)
+            expected = np.flatnonzero(
+                (d <= self.upper_radii[i]) & (d > self.lower_radii[i]))
+            assert_equal(np.sort(s_ind[i]), expected)
+
+
+class Test_sparse_index:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(7)
+        self.data = self.random.uniform(0, 1, size=(2000, 7))
+        self.centres = self.random.uniform(-0.1, 1.1, size=(30, 7))
+        self.upper_radii = self.random.uniform(0, 0.6, size=30)
+        self.lower_radii = 0.5 * self.upper_radii
+
+    def sorted_neighbors(self, result):
+        # the same neighbors of each centre, in any order
+        distances, indices = result
+        by_index = [np.argsort(ind) for ind in indices]
+        return (
+            [dis[order] for dis, order in zip(distances, by_index)],
+            [ind[order] for ind, order in zip(indices, by_index)])
+
+    def test_brute_force(self):
+        gsp = GriSPy(self.data, N_cells=6, index_mode="sparse")
+        _, b_ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        n_dis, n_ind = gsp.nearest_neighbors(self.centres, n=4)
+        for i, centre in enumerate(self.centres):
+            d = np.sqrt(np.sum((self.data - centre) ** 2, axis=1))
+            expected = np.flatnonzero(d <= self.upper_radii[i])
+            assert_equal(np.sort(b_ind[i]), expected)
+            assert_equal(counts[i], len(expected))
+            assert_almost_equal(n_dis[i], np.sort(d)[:4], decimal=10)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_same_as_dense(self, periodic_mode):
+        params = dict(
+            N_cells=5, periodic={0: (0, 1), 3: (0, 1)},
+            periodic_mode=periodic_mode)
+        dense = GriSPy(self.data, index_mode="dense", **params)
+        sparse = GriSPy(self.data, index_mode="sparse", **params)
+
+        for method, kwargs in (
+            ("bubble_neighbors", dict(distance_upper_bound=self.upper_radii)),
+            ("shell_neighbors", dict(
+                distance_lower_bound=self.lower_radii,
+                distance_upper_bound=self.upper_radii)),
+        ):
+            expected = self.sorted_neighbors(
+                getattr(dense, method)(self.centres, **kwargs))
+            result = self.sorted_neighbors(
+                getattr(sparse, method)(self.centres, **kwargs))
+            for r, e in zip(result[0], expected[0]):
+                assert_almost_equal(r, e, decimal=10)
+            for r, e in zip(result[1], expected[1]):
+                assert_equal(r, e)
+
+        assert_equal(
+            sparse.count_neighbors(self.centres, self.upper_radii),
+            dense.count_neighbors(self.centres, self.upper_radii))
+
+        expected, _ = dense.nearest_neighbors(self.centres, n=4)
+        result, _ = sparse.nearest_neighbors(self.centres, n=4)
+        assert_almost_equal(result, expected, decimal=10)
+
+
+class Test_insert_remove:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(11)
+        self.data = self.random.uniform(0.2, 0.8, size=(500, 3))
+        self.centres = self.random.uniform(-0.1, 1.1, size=(20, 3))
+        self.upper_radii = self.random.uniform(0, 0.5, size=20)
+        self.lower_radii = 0.4 * self.upper_radii
+
+    def edit(self, gsp):
+        # some points out of the bins and enough removals to compact
+        for _ in range(10):
+            live = np.flatnonzero(~gsp.removed_)
+            gsp.remove(self.random.choice(live, 40, replace=False))
+            points = self.random.uniform(0, 1, size=(30, 3))
+            indices = gsp.insert(points)
+            assert_equal(gsp.data[indices], points)
+        gsp.remove(np.flatnonzero(~gsp.removed_)[:20])
+        assert_(gsp.n_tombstones_ > 0)
+        assert_(len(gsp.overflow_) > 0)
+
+    @pytest.mark.parametrize("index_mode", ["dense", "sparse"])
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_brute_force(self, index_mode, periodic_mode):
+        gsp = GriSPy(
+            self.data.copy(), N_cells=8, index_mode=index_mode,
+            periodic_mode=periodic_mode)
+        self.edit(gsp)
+
+        _, b_ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        _, s_ind = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=self.lower_radii,
+            distance_upper_bound=self.upper_radii)
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=5)
+
+        live = ~gsp.removed_
+        for i, centre in enumerate(self.centres):
+            d = np.sqrt(np.sum((gsp.data - centre) ** 2, axis=1))
+            expected = np.flatnonzero((d <= self.upper_radii[i]) & live)
+            assert_equal(np.sort(b_ind[i]), expected)
+            assert_equal(counts[i], len(expected))
+            expected = np.flatnonzero(
+                (d <= self.upper_radii[i]) & (d > self.lower_radii[i]) & live)
+            assert_equal(np.sort(s_ind[i]), expected)
+            assert_almost_equal(n_dis[i], np.sort(d[live])[:5], decimal=10)
+
+    def test_wrap_periodic(self):
+        periodic = {0: (0, 1), 2: (0, 1)}
+        gsp = GriSPy(
+            self.data.copy(), N_cells=8, periodic=periodic,
+            periodic_mode="wrap")
+        self.edit(gsp)
+        live = np.flatnonzero(~gsp.removed_)
+        rebuilt = GriSPy(
+            gsp.data[live], N_cells=8, periodic=periodic,
+            periodic_mode="wrap")
+
+        _, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        _, expected = rebuilt.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        for r, e in zip(ind, expected):
+            assert_equal(np.sort(r), np.sort(live[e]))
+
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=5)
+        expected, _ = rebuilt.nearest_neighbors(self.centres, n=5)
+        assert_almost_equal(n_dis, expected, decimal=10)
+
+    def test_compaction(self):
+        gsp = GriSPy(self.data.copy(), N_cells=8)
+        gsp.remove(np.arange(100))
+        assert_equal(gsp.n_tombstones_, 100)
+        assert_equal(len(gsp.grid_.order), 500)
+
+        # more than a quarter of the indexed points
+        gsp.remove(np.arange(100, 130))
+        assert_equal(gsp.n_tombstones_, 0)
+        assert_equal(np.sort(gsp.grid_.order), np.arange(130, 500))
+
+        # the rows of the removed points are reused
+        indices = gsp.insert(self.random.uniform(0.3, 0.7, size=(140, 3)))
+        assert_equal(indices, np.append(np.arange(130), np.arange(500, 510)))
+        assert_equal(len(gsp.data), 510)
+        assert_equal(np.sort(gsp.grid_.order), np.arange(510))
+
+
+class Test_update_positions:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(13)
+        self.data = self.random.uniform(0, 1, size=(2000, 3))
+        self.centres = self.random.uniform(0, 1, size=(20, 3))
+        self.upper_radii = self.random.uniform(0, 0.3, size=20)
+
+    @pytest.mark.parametrize("index_mode", ["dense", "sparse"])
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_same_as_build(self, index_mode, periodic_mode):
+        periodic = {0: (0, 1), 1: (0, 1), 2: (0, 1)}
+        params = dict(
+            N_cells=8, periodic=periodic, periodic_mode=periodic_mode,
+            index_mode=index_mode)
+        gsp = GriSPy(self.data, **params)
+        gsp.remove(np.arange(0, 2000, 9))
+
+        positions = self.data
+        for _ in range(3):
+            positions = positions + self.random.normal(
+                0, 0.02, size=positions.shape)
+            stats = gsp.update_positions(positions)
+            assert_(stats.n_migrated > 0)
+        assert_equal(gsp.data, positions)
+
+        # in the 'wrap' mode the cells wrap around, no point is out of them
+        live = np.flatnonzero(~gsp.removed_)
+        low = [bins[0] for bins in gsp.axis_bins_]
+        high = [bins[-1] for bins in gsp.axis_bins_]
+        out = np.any(
+            (positions[live] < low) | (positions[live] >= high), axis=1)
+        if periodic_mode == "mirror":
+            assert_equal(stats.n_overflow, np.count_nonzero(out))
+            assert_equal(np.sort(gsp.overflow_), live[out])
+        else:
+            assert_equal(stats.n_overflow, 0)
+
+        rebuilt = GriSPy(positions[live], **params)
+        _, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        _, expected = rebuilt.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        for r, e in zip(ind, expected):
+            assert_equal(np.sort(r), np.sort(live[e]))
+
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=5)
+        expected, _ = rebuilt.nearest_neighbors(self.centres, n=5)
+        assert_almost_equal(n_dis, expected, decimal=10)
+
+    def test_n_migrated(self):
+        gsp = GriSPy(self.data, N_cells=8)
+        stats = gsp.update_positions(self.data.copy())
+        assert_equal(stats.n_migrated, 0)
+
+        # move a cell along the axis 0 the points of the first half
+        positions = self.data.copy()
+        positions[:1000, 0] += 0.2 * (positions[:1000, 0] < 0.5)
+        bins = gsp.axis_bins_[0]
+        old_cells = np.searchsorted(bins, self.data[:, 0], side="right")
+        new_cells = np.searchsorted(bins, positions[:, 0], side="right")
+        stats = gsp.update_positions(positions)
+        moved = np.count_nonzero(new_cells != old_cells)
+        assert_equal(stats.n_migrated, moved)
+
+
+class Test_sky_bands:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(17)
+        self.data = self.sky(3000)
+        # close to the poles and across the longitude 0
+        self.centres = np.vstack([self.sky(30), [
+            [0.01, 89.9], [359.99, -89.5], [180., 90.], [359.9, 10.],
+            [-0.5, 3.], [360.5, -3.]]])
+
+    def sky(self, n):
+        lon = self.random.uniform(0, 360, size=n)
+        lat = np.rad2deg(np.arcsin(self.random.uniform(-1, 1, size=n)))
+        return np.stack([lon, lat], axis=1)
+
+    def brute_force(self, metric, centre, data):
+        return getattr(distances, metric)(centre, data, 2)
+
+    @pytest.mark.parametrize("metric", ["haversine", "vincenty"])
+    @pytest.mark.parametrize("index_mode", ["dense", "sparse"])
+    @pytest.mark.parametrize("radius", [0.5, 5., 30., 120.])
+    def test_brute_force(self, metric, index_mode, radius):
+        gsp = GriSPy(
+            self.data, N_cells=(32, 16), metric=metric, sky_bands=True,
+            index_mode=index_mode)
+        upper = np.full(len(self.centres), radius)
+        _, ind = gsp.bubble_neighbors(self.centres, distance_upper_bound=upper)
+        _, shell_ind = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=upper / 2,
+            distance_upper_bound=upper)
+        counts = gsp.count_neighbors(self.centres, distance_upper_bound=upper)
+        for i, centre in enumerate(self.centres):
+            dis = self.brute_force(metric, centre, self.data)
+            in_shell = (dis <= radius) & (dis > radius / 2)
+            assert_equal(np.sort(ind[i]), np.flatnonzero(dis <= radius))
+            assert_equal(np.sort(shell_ind[i]), np.flatnonzero(in_shell))
+            assert_equal(counts[i], len(ind[i]))
+
+    def test_nearest_neighbors(self):
+        gsp = GriSPy(self.data, metric="haversine", sky_bands=True)
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=5)
+        for i, centre in enumerate(self.centres):
+            dis = self.brute_force("haversine", centre, self.data)
+            assert_almost_equal(n_dis[i], np.sort(dis)[:5], decimal=10)
+
+    def test_bands(self):
+        gsp = GriSPy(
+            self.data, N_cells=(64, 16), metric="haversine", sky_bands=True)
+        assert_equal(gsp.n_cells_, [64, 16])
+        band_cells, _ = gsp._sky_bands(gsp.axis_bins_)
+        assert_equal(len(band_cells), 16)
+        assert_(band_cells.max() == 64)
+        assert_(band_cells[0] < 20 and band_cells[-1] < 20)
+        assert_equal(len(gsp.grid_.offsets), band_cells.sum() + 1)
+
+    def test_auto_patch(self):
+        # a patch across the longitude 0, the cells are sized by its arc
+        lon = np.mod(self.random.uniform(-5, 5, size=3000), 360)
+        lat = self.random.uniform(-3, 3, size=3000)
+        data = np.stack([lon, lat], axis=1)
+        gsp = GriSPy(data, N_cells="auto", metric="haversine", sky_bands=True)
+        assert_(gsp.n_cells_[0] > 360)
+        _, ind = gsp.bubble_neighbors(data[:20], distance_upper_bound=0.3)
+        for i, centre in enumerate(data[:20]):
+            dis = self.brute_force("haversine", centre, data)
+            assert_equal(np.sort(ind[i]), np.flatnonzero(dis <= 0.3))
+
+    def test_edited(self):
+        gsp = GriSPy(
+            self.data.copy(), N_cells=16, metric="haversine", sky_bands=True)
+        gsp.insert(self.sky(200))
+        gsp.remove(np.arange(0, 3000, 4))
+        positions = gsp.data.copy()
+        positions[:, 0] += 1.5
+        positions[:, 1] = np.clip(positions[:, 1] + 0.5, -90, 90)
+        gsp.update_positions(positions)
+
+        live = ~gsp.removed_
+        _, ind = gsp.bubble_neighbors(self.centres, distance_upper_bound=6.)
+        for i, centre in enumerate(self.centres):
+            dis = self.brute_force("haversine", centre, positions)
+            assert_equal(np.sort(ind[i]), np.flatnonzero((dis <= 6.) & live))
+
+
+class Test_unit_vectors:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(19)
+        lon = self.random.uniform(0, 360, size=3000)
+        lat = np.rad2deg(np.arcsin(self.random.uniform(-1, 1, size=3000)))
+        self.data = np.stack([lon, lat], axis=1)
+        # close to the poles and across the longitude 0
+        self.centres = np.vstack([self.data[:30], [
+            [0.01, 89.9], [359.99, -89.5], [180., 90.], [-0.5, 3.]]])
+
+    @pytest.mark.parametrize("backend", ["numpy", "numba"])
+    @pytest.mark.parametrize("index_mode", ["dense", "sparse"])
+    @pytest.mark.parametrize("radius", [0.5, 5., 30., 120., 200.])
+    def test_brute_force(self, backend, index_mode, radius):
+        gsp = GriSPy(
+            self.data, N_cells=16, metric="haversine", unit_vectors=True,
+            backend=backend, index_mode=index_mode)
+        upper = np.full(len(self.centres), radius)
+        dis, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=upper, sorted=True)
+        _, shell_ind = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=upper / 2,
+            distance_upper_bound=upper)
+        counts = gsp.count_neighbors(self.centres, distance_upper_bound=upper)
+        for i, centre in enumerate(self.centres):
+            expected = distances.haversine(centre, self.data, 2)
+            in_shell = (expected <= radius) & (expected > radius / 2)
+            assert_equal(np.sort(ind[i]), np.flatnonzero(expected <= radius))
+            assert_almost_equal(dis[i], expected[ind[i]], decimal=8)
+            assert_equal(np.sort(shell_ind[i]), np.flatnonzero(in_shell))
+            assert_equal(counts[i], len(ind[i]))
+
+    def test_nearest_neighbors(self):
+        gsp = GriSPy(self.data, metric="vincenty", unit_vectors=True)
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=5)
+        for i, centre in enumerate(self.centres):
+            expected = distances.vincenty(centre, self.data, 2)
+            assert_almost_equal(n_dis[i], np.sort(expected)[:5], decimal=8)
+
+    def test_auto_cells(self):
+        # the cells are sized by the area of the sky with the points
+        gsp = GriSPy(
+            self.data, N_cells="auto", metric="haversine", unit_vectors=True)
+        assert_equal(gsp.dim_, 3)
+        cell_side = np.sqrt(4 * np.pi * gsp.mean_occupancy / len(self.data))
+        assert_equal(gsp.n_cells_, np.full(3, int(2 / cell_side)))
+
+    def test_edited(self):
+        gsp = GriSPy(
+            self.data.copy(), N_cells=16, metric="haversine",
+            unit_vectors=True)
+        gsp.insert(self.data[:200] + [0.5, 0.])
+        gsp.remove(np.arange(0, 3000, 4))
+        positions = gsp.data.copy()
+        positions[:, 0] += 1.5
+        positions[:, 1] = np.clip(positions[:, 1] + 0.5, -90, 90)
+        gsp.update_positions(positions)
+
+        live = ~gsp.removed_
+        _, ind = gsp.bubble_neighbors(self.centres, distance_upper_bound=6.)
+        for i, centre in enumerate(self.centres):
+            expected = distances.haversine(centre, positions, 2)
+            assert_equal(
+                np.sort(ind[i]), np.flatnonzero((expected <= 6.) & live))
+
+
+class Test_separable_metrics:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(24)
+        self.data = self.random.uniform(0, 10, size=(2000, 3))
+        self.centres = self.random.uniform(0, 10, size=(40, 3))
+        self.periodic = {0: (0, 10), 2: (0, 10)}
+        # the reach along each axis stays within half the period
+        self.upper = self.random.uniform(0.5, 2., size=len(self.centres))
+
+    def brute_force(self, metric_params, periodic):
+        params = dict(metric_params)
+        params.setdefault("weights", None)
+        dis = np.empty((len(self.centres), len(self.data)))
+        for i, centre in enumerate(self.centres):
+            diff = self.data - centre
+            for k, (low, high) in periodic.items():
+                period = high - low
+                diff[:, k] -= period * np.round(diff[:, k] / period)
+            dis[i] = distances.minkowski_pairs(
+                np.zeros((1, 3)), np.zeros(len(diff), dtype=int), diff,
+                **params)
+        return dis
+
+    @pytest.mark.parametrize("metric, metric_params", [
+        ("manhattan", {}),
+        ("chebyshev", {}),
+        ("minkowski", {"p": 3}),
+        ("minkowski", {"p": np.inf}),
+        ("euclid", {"weights": [1., 4., 0.25]}),
+        ("manhattan", {"weights": [2., 1., 0.5]}),
+        ("minkowski", {"p": 1.5, "weights": [0.3, 1., 3.]}),
+    ])
+    @pytest.mark.parametrize("periodic_mode", [None, "mirror", "wrap"])
+    def test_brute_force(self, metric, metric_params, periodic_mode):
+        periodic = {} if periodic_mode is None else self.periodic
+        gsp = GriSPy(
+            self.data, N_cells=8, metric=metric,
+            metric_params=metric_params or None, periodic=periodic,
+            periodic_mode=periodic_mode or "mirror")
+        params = dict(metric_params)
+        params.setdefault("p", {"manhattan": 1, "chebyshev": np.inf}.get(
+            metric, 2))
+        expected = self.brute_force(params, periodic)
+
+        upper, lower = self.upper, 0.4 * self.upper
+        dis, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=upper)
+        _, shell_ind = gsp.shell_neighbors(
+            self.centres, distance_lower_bound=lower,
+            distance_upper_bound=upper)
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=upper)
+        n_dis, _ = gsp.nearest_neighbors(self.centres, n=7)
+        for i in range(len(self.centres)):
+            in_bubble = expected[i] <= upper[i]
+            in_shell = in_bubble & (expected[i] > lower[i])
+            assert_equal(np.sort(ind[i]), np.flatnonzero(in_bubble))
+            assert_almost_equal(dis[i], expected[i][ind[i]], decimal=10)
+            assert_equal(np.sort(shell_ind[i]), np.flatnonzero(in_shell))
+            assert_equal(counts[i], in_bubble.sum())
+            assert_almost_equal(
+                n_dis[i], np.sort(expected[i])[:7], decimal=10)
+
+    def test_chebyshev_box(self):
+        # the points of a cube are counted from the cells within it, with
+        # only the cells on its faces tested point by point
+        gsp = GriSPy(self.data, N_cells=10, metric="chebyshev")
+        counts = gsp.count_neighbors(
+            np.array([[5., 5., 5.]]), distance_upper_bound=2.)
+        expected = np.all(np.abs(self.data - 5.) <= 2., axis=1).sum()
+        assert_equal(counts, [expected])
+
+    def test_weights_numba(self):
+        # the compiled kernels are not weighted, the search falls back
+        weights = [1., 4., 0.25]
+        gsp = GriSPy(
+            self.data, N_cells=8, backend="numba",
+            metric_params={"weights": weights})
+        _, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper)
+        expected = self.brute_force({"weights": weights}, {})
+        for i in range(len(self.centres)):
+            assert_equal(
+                np.sort(ind[i]), np.flatnonzero(expected[i] <= self.upper[i]))
+
+
+class Test_box_neighbors:
+
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(25)
+        self.data = self.random.uniform(0, 10, size=(3000, 3))
+        self.centres = self.random.uniform(0, 10, size=(50, 3))
+        self.half_widths = self.random.uniform(0.2, 3., size=(50, 3))
+        self.periodic = {0: (0, 10), 2: (0, 10)}
+
+    def brute_force(self, data, centre, half_widths, periodic):
+        diff = data - centre
+        for k, (low, high) in periodic.items():
+            period = high - low
+            diff[:, k] -= period * np.round(diff[:, k] / period)
+        in_box = np.all(np.abs(diff) <= half_widths, axis=1)
+        return np.flatnonzero(in_box), np.sqrt(np.sum(diff ** 2, axis=1))
+
+    @pytest.mark.parametrize("index_mode", ["dense", "sparse"])
+    @pytest.mark.parametrize("periodic_mode", [None, "mirror", "wrap"])
+    def test_brute_force(self, index_mode, periodic_mode):
+        periodic = {} if periodic_mode is None else self.periodic
+        gsp = GriSPy(
+            self.data, N_cells=8, periodic=periodic,
+            periodic_mode=periodic_mode or "mirror", index_mode=index_mode)
+        dis, ind = gsp.box_neighbors(
+            self.centres, self.half_widths, sorted=True)
+        for i, centre in enumerate(self.centres):
+            expected, expected_dis = self.brute_force(
+                self.data, centre, self.half_widths[i], periodic)
+            assert_equal(np.sort(ind[i]), expected)
+            assert_almost_equal(
+                dis[i], np.sort(expected_dis[expected]), decimal=12)
+
+    def test_half_widths_by_axis(self):
+        gsp = GriSPy(self.data, N_cells=8)
+        _, ind = gsp.box_neighbors(self.centres, self.half_widths[0])
+        _, cube_ind = gsp.box_neighbors(self.centres, 1.5)
+        for i, centre in enumerate(self.centres):
+            expected, _ = self.brute_force(
+                self.data, centre, self.half_widths[0], {})
+            assert_equal(np.sort(ind[i]), expected)
+            expected, _ = self.brute_force(self.data, centre, 1.5, {})
+            assert_equal(np.sort(cube_ind[i]), expected)
+
+    def test_edited(self):
+        gsp = GriSPy(self.data.copy(), N_cells=8)
+        gsp.insert(self.random.uniform(10, 12, size=(100, 3)))
+        gsp.remove(np.arange(0, 3000, 3))
+
+        live = ~gsp.removed_
+        _, ind = gsp.box_neighbors(self.centres + 1.5, 2., n_jobs=2)
+        for i, centre in enumerate(self.centres + 1.5):
+            expected, _ = self.brute_force(gsp.data, centre, 2., {})
+            assert_equal(np.sort(ind[i]), expected[live[expected]])
+
+
+class Test_query_chunks:
+    def setup_method(self, *args):
+        self.random = np.random.RandomState(1234)
+        self.lbox = 10.0
+        self.data = self.random.uniform(0, self.lbox, size=(2000, 3))
+        self.centres = self.random.uniform(0, self.lbox, size=(50, 3))
+        self.upper_radii = self.random.uniform(0, 0.4 * self.lbox, size=50)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_same_as_one_chunk(self, periodic_mode, monkeypatch):
+        gsp = GriSPy(
+            self.data, N_cells=8, periodic={0: (0, self.lbox)},
+            periodic_mode=periodic_mode)
+        queries = [
+            lambda: gsp.bubble_neighbors(
+                self.centres, distance_upper_bound=self.upper_radii,
+                sorted=True, return_format="csr"),
+            lambda: gsp.shell_neighbors(
+                self.centres, distance_lower_bound=0.5 * self.upper_radii,
+                distance_upper_bound=self.upper_radii, sorted=True,
+                return_format="csr"),
+            lambda: gsp.box_neighbors(
+                self.centres, np.repeat(
+                    0.5 * self.upper_radii[:, np.newaxis], 3, axis=1),
+                sorted=True, return_format="csr", n_jobs=2),
+        ]
+        expected = [query() for query in queries]
+
+        monkeypatch.setattr(core, "QUERY_CHUNK_SIZE", 64)
+        bounds = gsp._chunk_bounds(
+            1, len(self.centres), gsp._axis_reach(self.upper_radii))
+        assert_(len(bounds) > 10)
+        assert_equal(bounds[[0, -1]], [0, len(self.centres)])
+        for query, result in zip(queries, expected):
+            for array, expected_array in zip(query(), result):
+                assert_equal(array, expected_array)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_count(self, periodic_mode, monkeypatch):
+        gsp = GriSPy(
+            self.data, N_cells=8, periodic={0: (0, self.lbox)},
+            periodic_mode=periodic_mode)
+        _, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+
+        monkeypatch.setattr(core, "QUERY_CHUNK_SIZE", 64)
+        counts = gsp.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        assert_equal(counts, [len(i) for i in ind])
+
+
 class Test_hypersphere_grispy:
     @pytest.fixture
     def gsp(self):
@@ -13,7 +13,7 @@ import pytest
 import numpy as np
 
 from grispy import GriSPy
-from grispy.core import BuildStats, PeriodicityConf
+from grispy.core import BuildStats, CellIndex, PeriodicityConf
 
 from numpy.testing import assert_equal, assert_
 
@@ -53,7 +53,9 @@ class Test_data_consistency:
 
     def test_grid_attrs(self, gsp):
         assert_(isinstance(gsp.k_bins_, np.ndarray))
-        assert_(isinstance(gsp.grid_, dict))
+        assert_(isinstance(gsp.axis_bins_, list))
+        assert_(isinstance(gsp.n_cells_, np.ndarray))
+        assert_(isinstance(gsp.grid_, CellIndex))
         assert_(isinstance(gsp.dim_, int))
         assert_(isinstance(gsp.periodic_flag_, bool))
         assert_(isinstance(gsp.periodic_conf_, PeriodicityConf))
@@ -121,6 +123,117 @@ class Test_data_consistency:
         assert_equal(len(b), len(self.centres))
         assert_equal(len(ind), len(self.centres))
 
+    def test_bubble_radius_edge(self, gsp):
+        # the points at exactly the radius are neighbors of the bubble but
+        # not of a shell with that lower bound
+        centre = np.array([[0.0, 0.0, 0.0]])
+        b, ind = gsp.bubble_neighbors(
+            centre, distance_upper_bound=1.0, sorted=True)
+        assert_equal(b[0], [0.0, 1.0, 1.0, 1.0])
+        assert_equal(np.sort(ind[0][1:]), [1, 2, 4])
+
+        b, ind = gsp.shell_neighbors(
+            centre, distance_lower_bound=1.0, distance_upper_bound=2.0**0.5,
+            sorted=True)
+        assert_equal(len(b[0]), 3)
+        assert_equal(np.sort(ind[0]), [3, 5, 6])
+
+    def test_bubble_csr_query(self, gsp):
+
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii[0],
+            sorted=True)
+        b_csr, ind_csr, offsets = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii[0],
+            sorted=True, return_format="csr")
+        assert_(isinstance(b_csr, np.ndarray))
+        assert_(isinstance(ind_csr, np.ndarray))
+        assert_equal(len(offsets), len(self.centres) + 1)
+        assert_equal(offsets[-1], len(b_csr))
+        for i in range(len(self.centres)):
+            assert_equal(b_csr[offsets[i]:offsets[i + 1]], b[i])
+            assert_equal(ind_csr[offsets[i]:offsets[i + 1]], ind[i])
+
+    def test_box_query(self, gsp):
+
+        b, ind = gsp.box_neighbors(self.centres, 0.5, sorted=True)
+        assert_(isinstance(b, list))
+        assert_equal(len(ind), len(self.centres))
+        b_csr, ind_csr, offsets = gsp.box_neighbors(
+            self.centres, 0.5, sorted=True, return_format="csr")
+        ind_only = gsp.box_neighbors(
+            self.centres, 0.5, sorted=True, return_distance=False)
+        for i in range(len(self.centres)):
+            assert_equal(b_csr[offsets[i]:offsets[i + 1]], b[i])
+            assert_equal(ind_csr[offsets[i]:offsets[i + 1]], ind[i])
+            assert_equal(ind_only[i], ind[i])
+
+    def test_shell_csr_query(self, gsp):
+
+        b, ind = gsp.shell_neighbors(
+            self.centres,
+            distance_lower_bound=self.lower_radii[0],
+            distance_upper_bound=self.upper_radii[0],
+            sorted=True)
+        b_csr, ind_csr, offsets = gsp.shell_neighbors(
+            self.centres,
+            distance_lower_bound=self.lower_radii[0],
+            distance_upper_bound=self.upper_radii[0],
+            sorted=True, return_format="csr")
+        assert_equal(len(offsets), len(self.centres) + 1)
+        assert_equal(offsets[-1], len(ind_csr))
+        for i in range(len(self.centres)):
+            assert_equal(b_csr[offsets[i]:offsets[i + 1]], b[i])
+            assert_equal(ind_csr[offsets[i]:offsets[i + 1]], ind[i])
+
+    def test_nearest_dense_query(self, gsp):
+
+        b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
+        b_dense, ind_dense = gsp.nearest_neighbors(
+            self.centres, n=self.n_nearest, return_format="dense")
+        assert_(isinstance(b_dense, np.ndarray))
+        assert_(isinstance(ind_dense, np.ndarray))
+        assert_equal(b_dense.shape, (len(self.centres), self.n_nearest))
+        assert_equal(ind_dense.shape, (len(self.centres), self.n_nearest))
+        for i in range(len(self.centres)):
+            assert_equal(b_dense[i], b[i])
+            assert_equal(ind_dense[i], ind[i])
+
+    def test_parallel_query(self, gsp):
+
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii[0],
+            sorted=True)
+        b_par, ind_par = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii[0],
+            sorted=True, n_jobs=2)
+        assert_equal(len(b_par), len(self.centres))
+        for i in range(len(self.centres)):
+            assert_equal(b_par[i], b[i])
+            assert_equal(ind_par[i], ind[i])
+
+        b, ind = gsp.shell_neighbors(
+            self.centres,
+            distance_lower_bound=self.lower_radii[0],
+            distance_upper_bound=self.upper_radii[0],
+            sorted=True)
+        b_par, ind_par, offsets = gsp.shell_neighbors(
+            self.centres,
+            distance_lower_bound=self.lower_radii[0],
+            distance_upper_bound=self.upper_radii[0],
+            sorted=True, return_format="csr", n_jobs=-1)
+        for i in range(len(self.centres)):
+            assert_equal(b_par[offsets[i]:offsets[i + 1]], b[i])
+            assert_equal(ind_par[offsets[i]:offsets[i + 1]], ind[i])
+
+        b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
+        b_par, ind_par = gsp.nearest_neighbors(
+            self.centres, n=self.n_nearest, n_jobs=3)
+        assert_equal(len(b_par), len(self.centres))
+        for i in range(len(self.centres)):
+            assert_equal(b_par[i], b[i])
+            assert_equal(ind_par[i], ind[i])
+
     def test_nearest_neighbors_multiple_query(self, gsp):
 
         b, ind = gsp.nearest_neighbors(self.centres, n=self.n_nearest)
@@ -175,10 +288,12 @@ class Test_data_consistency_periodic:
         assert_equal(t_cen.shape[1], r_cen.shape[1])
 
     def test_mirror(self, gsp):
-        t_cen = gsp._mirror(
+        t_cen, t_ind = gsp._mirror(
             np.array([[0, 0, 0]]), distance_upper_bound=self.upper_radii
         )
         assert_(isinstance(t_cen, np.ndarray))
+        assert_(isinstance(t_ind, np.ndarray))
+        assert_equal(len(t_cen), len(t_ind))
 
     def test_near_boundary(self, gsp):
         mask = gsp._near_boundary(
@@ -371,6 +486,27 @@ class Test_valid_query_input:
                 kind=self.kind,
             )
 
+    def test_invalid_half_widths(self, gsp):
+        # Not a scalar nor an array
+        with pytest.raises(TypeError):
+            gsp.box_neighbors(self.centres, [0.5, 0.5, 0.5])
+        # Negative
+        with pytest.raises(ValueError):
+            gsp.box_neighbors(self.centres, -0.5)
+        # Neither one by axis nor one by axis of each centre
+        with pytest.raises(ValueError):
+            gsp.box_neighbors(self.centres, np.full(10, 0.5))
+        with pytest.raises(ValueError):
+            gsp.box_neighbors(self.centres, np.full((10, 2), 0.5))
+        # Larger than the periodic range
+        with pytest.raises(ValueError):
+            gsp.box_neighbors(self.centres, np.array([2.5, 0.5, 0.5]))
+        # Not in a grid of the sphere
+        sky = np.random.uniform(-1, 1, size=(100, 2)) * [180, 90]
+        gsp = GriSPy(sky, metric="haversine", unit_vectors=True)
+        with pytest.raises(ValueError):
+            gsp.box_neighbors(sky[:5], 1.)
+
     def test_invalid_bool(self, gsp):
 
         # Invalid type
@@ -405,6 +541,52 @@ class Test_valid_query_input:
                 kind=bad_kind,
             )
 
+    def test_invalid_return_format(self, gsp):
+
+        # Invalid type
+        bad_format = None
+        with pytest.raises(TypeError):
+            gsp.bubble_neighbors(
+                self.centres,
+                distance_upper_bound=self.upper_radii,
+                return_format=bad_format,
+            )
+
+        # Invalid name
+        bad_format = "dict"
+        with pytest.raises(ValueError):
+            gsp.bubble_neighbors(
+                self.centres,
+                distance_upper_bound=self.upper_radii,
+                return_format=bad_format,
+            )
+
+        # Only list and dense for the nearest neighbors
+        bad_format = "csr"
+        with pytest.raises(ValueError):
+            gsp.nearest_neighbors(
+                self.centres, n=1, return_format=bad_format)
+
+    def test_invalid_n_jobs(self, gsp):
+
+        # Invalid type
+        bad_n_jobs = 2.0
+        with pytest.raises(TypeError):
+            gsp.bubble_neighbors(
+                self.centres,
+                distance_upper_bound=self.upper_radii,
+                n_jobs=bad_n_jobs,
+            )
+
+        # Invalid value
+        bad_n_jobs = 0
+        with pytest.raises(ValueError):
+            gsp.nearest_neighbors(
+                self.centres,
+                n=self.n,
+                n_jobs=bad_n_jobs,
+            )
+
     def test_invalid_nnearest(self, gsp):
 
         # Invalid type
@@ -434,6 +616,46 @@ class Test_valid_query_input:
                 kind=self.kind,
             )
 
+    def test_invalid_insert(self, gsp):
+        # not a numpy array
+        with pytest.raises(TypeError):
+            gsp.insert([[1, 1, 1]])
+        # wrong dimension
+        with pytest.raises(ValueError):
+            gsp.insert(np.zeros((2, 2)))
+        # not finite
+        with pytest.raises(ValueError):
+            gsp.insert(np.array([[np.nan, 1, 1]]))
+
+    def test_invalid_update_positions(self, gsp):
+        # not the same number of points
+        with pytest.raises(ValueError):
+            gsp.update_positions(gsp.data[:-1])
+        # wrong dimension
+        with pytest.raises(ValueError):
+            gsp.update_positions(gsp.data[:, :2])
+
+    def test_invalid_remove(self, gsp):
+        # not integers
+        with pytest.raises(TypeError):
+            gsp.remove([0.5])
+        # not a point
+        with pytest.raises(ValueError):
+            gsp.remove([len(gsp.data)])
+        # repeated
+        with pytest.raises(ValueError):
+            gsp.remove([1, 1])
+        # already removed
+        gsp.remove([1])
+        with pytest.raises(ValueError):
+            gsp.remove([1])
+
+    def test_remove_nothing(self, gsp):
+        gsp.remove([])
+        gsp.remove(np.array([], dtype=int))
+        assert_(not np.any(gsp.removed_))
+        assert_equal(gsp.n_tombstones_, 0)
+
 
 class Test_valid_init:
 
@@ -561,6 +783,150 @@ class Test_valid_init:
                 copy_data=self.copy_data,
             )
 
+    @pytest.mark.parametrize("bad_N_cells, error", [
+        ("best", ValueError),
+        ((10, 10), ValueError),
+        ((10, 10.5, 10), TypeError),
+        ((10, 0, 10), ValueError),
+    ])
+    def test_invalid_Ncells_per_axis(self, gsp, bad_N_cells, error):
+        with pytest.raises(error):
+            GriSPy(
+                self.data,
+                N_cells=bad_N_cells,
+                periodic=self.periodic,
+                metric=self.metric,
+                copy_data=self.copy_data,
+            )
+
+    def test_invalid_Ncells_too_many(self, gsp):
+        data = np.random.uniform(size=(100, 11))
+        # 64 ** 11 cells can not be indexed
+        with pytest.raises(ValueError, match="N_cells:"):
+            GriSPy(data)
+        with pytest.raises(ValueError, match="N_cells:"):
+            GriSPy(self.data, N_cells=(2 ** 21, 2 ** 21, 2 ** 21))
+        # but a sparse grid of fewer cells can
+        gsp = GriSPy(data, N_cells=(64,) * 10 + (4,))
+        assert_(gsp.grid_.cells is not None)
+
+    @pytest.mark.parametrize("name", ["expected_radius", "mean_occupancy"])
+    def test_invalid_auto_params(self, gsp, name):
+        # not a number
+        with pytest.raises(TypeError):
+            GriSPy(self.data, N_cells="auto", **{name: "big"})
+
+        # not positive
+        with pytest.raises(ValueError):
+            GriSPy(self.data, N_cells="auto", **{name: 0})
+
+    def test_invalid_periodic_mode(self, gsp):
+        # Periodic mode name is wrong
+        bad_periodic_mode = "minimum_image"
+        with pytest.raises(ValueError):
+            GriSPy(
+                self.data,
+                N_cells=self.N_cells,
+                periodic=self.periodic,
+                metric=self.metric,
+                copy_data=self.copy_data,
+                periodic_mode=bad_periodic_mode,
+            )
+
+    def test_invalid_backend(self, gsp):
+        # Backend name is wrong
+        bad_backend = "cython"
+        with pytest.raises(ValueError):
+            GriSPy(
+                self.data,
+                N_cells=self.N_cells,
+                periodic=self.periodic,
+                metric=self.metric,
+                copy_data=self.copy_data,
+                backend=bad_backend,
+            )
+
+    def test_invalid_index_mode(self, gsp):
+        # Index mode name is wrong
+        with pytest.raises(ValueError):
+            GriSPy(self.data, N_cells=self.N_cells, index_mode="compressed")
+
+    def test_invalid_sky_bands(self, gsp):
+        sky = self.data[:, :2] * [180, 90]
+        # sky_bands is not bool
+        with pytest.raises(TypeError):
+            GriSPy(sky, metric="haversine", sky_bands=1)
+        # Only with the angular metrics
+        with pytest.raises(ValueError):
+            GriSPy(sky, sky_bands=True)
+        # Only longitudes and latitudes
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric="haversine", sky_bands=True)
+        # Latitudes out of range
+        with pytest.raises(ValueError):
+            GriSPy(sky * 2, metric="haversine", sky_bands=True)
+        # The longitude already wraps around
+        with pytest.raises(ValueError):
+            GriSPy(
+                sky, metric="haversine", sky_bands=True,
+                periodic={0: (0, 360)})
+        gsp = GriSPy(sky, metric="haversine", sky_bands=True)
+        with pytest.raises(ValueError):
+            gsp.set_periodicity({0: (0, 360)}, inplace=True)
+
+    def test_invalid_unit_vectors(self, gsp):
+        sky = self.data[:, :2] * [180, 90]
+        # unit_vectors is not bool
+        with pytest.raises(TypeError):
+            GriSPy(sky, metric="haversine", unit_vectors="yes")
+        # Only with the angular metrics
+        with pytest.raises(ValueError):
+            GriSPy(sky, unit_vectors=True)
+        # Only longitudes and latitudes
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric="haversine", unit_vectors=True)
+        # Not in sky bands too
+        with pytest.raises(ValueError):
+            GriSPy(
+                sky, metric="haversine", unit_vectors=True, sky_bands=True)
+        # One number of cells for each axis of the 3D grid
+        with pytest.raises(ValueError):
+            GriSPy(
+                sky, N_cells=(8, 8), metric="haversine", unit_vectors=True)
+        gsp = GriSPy(
+            sky, N_cells=(8, 8, 4), metric="haversine", unit_vectors=True)
+        with pytest.raises(ValueError):
+            gsp.set_periodicity({0: (0, 360)}, inplace=True)
+
+    def test_invalid_metric_params(self, gsp):
+        # metric_params is not a dict
+        with pytest.raises(TypeError):
+            GriSPy(self.data, metric="minkowski", metric_params=3)
+        # The key is not of the metric
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric="euclid", metric_params={"p": 3})
+        with pytest.raises(ValueError):
+            GriSPy(
+                self.data, metric="chebyshev",
+                metric_params={"weights": [1, 1, 1]})
+        # p is not a real number not smaller than 1
+        with pytest.raises(TypeError):
+            GriSPy(self.data, metric="minkowski", metric_params={"p": "2"})
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric="minkowski", metric_params={"p": 0.5})
+        # Not one positive weight per dimension
+        with pytest.raises(TypeError):
+            GriSPy(self.data, metric_params={"weights": ["a", "b", "c"]})
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric_params={"weights": [1, 2]})
+        with pytest.raises(ValueError):
+            GriSPy(self.data, metric_params={"weights": [1, 0, 2]})
+        # The weights have no effect with p = inf
+        with pytest.raises(ValueError, match="p = inf"):
+            GriSPy(
+                self.data, metric="minkowski",
+                metric_params={"p": np.inf, "weights": [1, 100, 1]})
+
     def test_invalid_copy_data(self, gsp):
         # copy_data is not bool
         bad_copy_data = 42
@@ -618,3 +984,73 @@ class Test_set_periodicity:
 
         assert gsp.periodic_flag_ is False
         assert gsp.periodic == {}
+
+    def test_per_axis_cells(self, gsp):
+        gsp = GriSPy(gsp.data, N_cells=(8, 4, 2))
+        assert_equal(gsp.n_cells_, [8, 4, 2])
+        assert_equal([len(bins) for bins in gsp.axis_bins_], [9, 5, 3])
+        assert_(gsp.k_bins_ is None)
+        assert_equal(len(gsp.grid_.offsets), 8 * 4 * 2 + 1)
+        assert_equal(gsp.time_.n_cells, (8, 4, 2))
+
+    def test_auto_cells(self, gsp):
+        # a thin slab, the cells are about cubic
+        random = np.random.RandomState(42)
+        data = random.uniform(0, 1, size=(10000, 3)) * [100, 100, 1]
+        gsp = GriSPy(data, N_cells="auto", mean_occupancy=10)
+        assert_equal(gsp.n_cells_[2], 1)
+        assert_equal(gsp.n_cells_[0], gsp.n_cells_[1])
+        occupancy = len(data) / np.prod(gsp.n_cells_)
+        assert_(10 <= occupancy < 20)
+        assert_equal(gsp.time_.n_cells, tuple(gsp.n_cells_))
+
+        # the cells are not much smaller than the expected radius
+        gsp = GriSPy(data, N_cells="auto", expected_radius=20.)
+        assert_equal(gsp.n_cells_, [19, 19, 1])
+
+    def test_index_mode(self, gsp):
+        # only the occupied cells are in a sparse index
+        sparse = GriSPy(gsp.data, N_cells=16, index_mode="sparse")
+        cells = sparse.grid_.cells
+        assert_(len(cells) <= len(gsp.data))
+        assert_equal(len(sparse.grid_.offsets), len(cells) + 1)
+        assert_(np.all(np.diff(cells) > 0))
+        assert_(np.all(np.diff(sparse.grid_.offsets) > 0))
+
+        dense = GriSPy(gsp.data, N_cells=16, index_mode="dense")
+        assert_(dense.grid_.cells is None)
+        assert_equal(dense.grid_.offsets[cells + 1] - dense.grid_.offsets[
+            cells], np.diff(sparse.grid_.offsets))
+
+        # with many more cells than points the index is sparse
+        auto = GriSPy(gsp.data, N_cells=(1000, 1000, 1000))
+        assert_(auto.grid_.cells is not None)
+        auto = GriSPy(gsp.data, N_cells=4)
+        assert_(auto.grid_.cells is None)
+
+    def test_set_periodicity_inplace_wrap(self, gsp):
+        gsp = GriSPy(gsp.data, periodic_mode="wrap")
+        periodicity = {0: (-50, 50)}
+
+        gsp.set_periodicity(periodicity, inplace=True)
+
+        # the cells of the periodic axis are aligned with the range
+        assert_equal(gsp.axis_bins_[0][[0, -1]], [-50, 50])
+        assert gsp.set_periodicity({}).periodic_mode == "wrap"
+
+    def test_set_periodicity_inplace_wrap_unit_vectors(self, gsp):
+        random = np.random.RandomState(22)
+        sky = random.uniform(-1, 1, size=(500, 2)) * [180, 90]
+        gsp = GriSPy(
+            sky, N_cells=8, metric="haversine", unit_vectors=True,
+            periodic_mode="wrap")
+        _, ind = gsp.bubble_neighbors(sky[:10], distance_upper_bound=15.)
+
+        # the grid is built again from the unit vectors
+        gsp.set_periodicity({}, inplace=True)
+        assert_equal(gsp.dim_, 3)
+        assert_equal(len(gsp.n_cells_), 3)
+        _, ind_set = gsp.bubble_neighbors(
+            sky[:10], distance_upper_bound=15.)
+        for i in range(10):
+            assert_equal(np.sort(ind_set[i]), np.sort(ind[i]))
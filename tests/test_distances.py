@@ -237,3 +237,105 @@ def test_custom_distance_hamming():
             6, 555, 935, 268, 615, 661, 680, 817, 75, 919, 922, 927, 52, 77,
             859, 70, 544, 189, 340, 691, 453, 570, 126, 140, 67, 284, 662,
             590, 527])
+
+
+def test_unit_vectors_chord():
+    # La cuerda entre los vectores unitarios es la distancia angular
+    random = np.random.RandomState(7)
+    lonlat = random.uniform(0, 1, size=(100, 2)) * [360, 180] - [0, 90]
+    vectors = distances.unit_vectors(lonlat)
+    np.testing.assert_almost_equal(np.linalg.norm(vectors, axis=1), 1.)
+
+    chords = np.linalg.norm(vectors - vectors[0], axis=1)
+    angles = distances.haversine(lonlat[0], lonlat, dim=2)
+    np.testing.assert_almost_equal(
+        distances.chord_to_angle(chords), angles, decimal=8)
+    np.testing.assert_almost_equal(
+        distances.angle_to_chord(angles), chords, decimal=12)
+    assert distances.angle_to_chord(270.) == 2.
+
+
+def test_batched_builtin():
+    # Las metricas por lotes dan las mismas distancias que por centro
+    random = np.random.RandomState(11)
+    centres = random.uniform(-60, 60, size=(5, 2))
+    points = random.uniform(-60, 60, size=(40, 2))
+    centre_ids = np.sort(random.randint(0, 5, size=40))
+    for name in ["euclid", "haversine", "vincenty"]:
+        pairs = getattr(distances, name + "_pairs")
+        assert distances.is_batched(pairs)
+        expected = [
+            getattr(distances, name)(centres[i], points[j:j + 1], 2)[0]
+            for j, i in enumerate(centre_ids)]
+        np.testing.assert_almost_equal(
+            pairs(centres, centre_ids, points), expected, decimal=12)
+
+
+def test_minkowski_pairs():
+    random = np.random.RandomState(12)
+    centres = random.uniform(-10, 10, size=(4, 3))
+    points = random.uniform(-10, 10, size=(30, 3))
+    centre_ids = np.sort(random.randint(0, 4, size=30))
+    diff = np.abs(points - centres[centre_ids])
+    np.testing.assert_almost_equal(
+        distances.minkowski_pairs(centres, centre_ids, points, p=1),
+        distances.manhattan_pairs(centres, centre_ids, points), decimal=12)
+    np.testing.assert_almost_equal(
+        distances.minkowski_pairs(centres, centre_ids, points, p=np.inf),
+        distances.chebyshev_pairs(centres, centre_ids, points), decimal=12)
+    np.testing.assert_almost_equal(
+        distances.minkowski_pairs(centres, centre_ids, points),
+        distances.euclid_pairs(centres, centre_ids, points), decimal=12)
+    np.testing.assert_almost_equal(
+        distances.chebyshev_pairs(centres, centre_ids, points),
+        diff.max(axis=1), decimal=12)
+
+    # Los pesos multiplican los terminos de cada eje
+    weights = np.array([0.5, 2., 1.])
+    expected = np.sum(weights * diff ** 3, axis=1) ** (1 / 3)
+    np.testing.assert_almost_equal(
+        distances.minkowski_pairs(
+            centres, centre_ids, points, p=3, weights=weights),
+        expected, decimal=12)
+
+
+def test_per_centre_adapter():
+    calls = []
+
+    def manhattan(c0, centres, dim):
+        calls.append(len(centres))
+        return np.abs(centres - c0).sum(axis=1)
+
+    adapted = distances.per_centre(manhattan)
+    assert distances.is_batched(adapted)
+    assert not distances.is_batched(manhattan)
+
+    centres = np.array([[0., 0.], [1., 1.], [2., 2.]])
+    points = np.array([[1., 0.], [0., 3.], [3., 3.], [0., 0.]])
+    # el centro 1 no tiene puntos
+    dis = adapted(centres, np.array([0, 0, 2, 2]), points)
+    np.testing.assert_almost_equal(dis, [1, 3, 2, 4])
+    assert calls == [2, 2]
+
+
+def test_custom_distance_batched():
+    random = np.random.RandomState(1)
+    data = random.uniform(0, 100, size=(1000, 2))
+    centres = random.uniform(0, 100, size=(20, 2))
+
+    def manhattan(c0, centres, dim):
+        return np.abs(centres - c0).sum(axis=1)
+
+    @distances.batched
+    def manhattan_pairs(centres, centre_ids, points):
+        return np.abs(points - centres[centre_ids]).sum(axis=1)
+
+    gsp = GriSPy(data, N_cells=10, metric=manhattan)
+    gsp_batched = GriSPy(data, N_cells=10, metric=manhattan_pairs)
+    dis, ind = gsp.bubble_neighbors(
+        centres, distance_upper_bound=8., sorted=True)
+    dis_b, ind_b = gsp_batched.bubble_neighbors(
+        centres, distance_upper_bound=8., sorted=True)
+    for i in range(len(centres)):
+        np.testing.assert_almost_equal(dis_b[i], dis[i])
+        np.testing.assert_equal(ind_b[i], ind[i])
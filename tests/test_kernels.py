@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+import pytest
+
+import numpy as np
+
+from grispy import GriSPy, kernels
+
+from numpy.testing import assert_equal, assert_
+
+
+class Test_numba_backend:
+
+    @pytest.fixture
+    def data(self):
+        random = np.random.RandomState(1234)
+        self.lbox = 10.0
+        self.centres = random.uniform(
+            -0.2 * self.lbox, 1.2 * self.lbox, size=(30, 3))
+        self.upper_radii = random.uniform(0, 0.6 * self.lbox, size=30)
+        self.lower_radii = 0.5 * self.upper_radii
+        return random.uniform(0, self.lbox, size=(1000, 3))
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    @pytest.mark.parametrize("periodic_axes", [[], [0], [1, 2]])
+    def test_same_results(self, data, periodic_mode, periodic_axes):
+        pytest.importorskip("numba")
+
+        periodic = {k: (0, self.lbox) for k in periodic_axes}
+        params = dict(
+            N_cells=8, periodic=periodic, periodic_mode=periodic_mode)
+        gsp_numpy = GriSPy(data, **params)
+        gsp_numba = GriSPy(data, backend="numba", **params)
+        assert_(gsp_numba._use_numba())
+
+        # the same neighbors and in the same order
+        expected = gsp_numpy.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        result = gsp_numba.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        for r, e in zip(result, expected):
+            assert_equal(r, e)
+
+        expected = gsp_numpy.shell_neighbors(
+            self.centres, distance_lower_bound=self.lower_radii,
+            distance_upper_bound=self.upper_radii, return_format="csr")
+        result = gsp_numba.shell_neighbors(
+            self.centres, distance_lower_bound=self.lower_radii,
+            distance_upper_bound=self.upper_radii, return_format="csr")
+        for r, e in zip(result, expected):
+            assert_equal(r, e)
+
+        expected = gsp_numpy.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        result = gsp_numba.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        assert_equal(result, expected)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_per_axis_cells(self, data, periodic_mode):
+        pytest.importorskip("numba")
+
+        params = dict(
+            N_cells=(8, 3, 5), periodic={0: (0, self.lbox)},
+            periodic_mode=periodic_mode)
+        gsp_numpy = GriSPy(data, **params)
+        gsp_numba = GriSPy(data, backend="numba", **params)
+
+        expected = gsp_numpy.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        result = gsp_numba.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        for r, e in zip(result, expected):
+            assert_equal(r, e)
+
+    @pytest.mark.parametrize("periodic_mode", ["mirror", "wrap"])
+    def test_sparse_index(self, data, periodic_mode):
+        pytest.importorskip("numba")
+
+        params = dict(
+            N_cells=40, periodic={1: (0, self.lbox)},
+            periodic_mode=periodic_mode)
+        gsp_numpy = GriSPy(data, index_mode="dense", **params)
+        gsp_numba = GriSPy(
+            data, index_mode="sparse", backend="numba", **params)
+
+        expected = gsp_numpy.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        result = gsp_numba.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        for r, e in zip(result, expected):
+            assert_equal(r, e)
+
+        expected = gsp_numpy.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        result = gsp_numba.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        assert_equal(result, expected)
+
+    def test_edited_grid(self, data):
+        pytest.importorskip("numba")
+
+        gsp_numpy = GriSPy(data, N_cells=8)
+        gsp_numba = GriSPy(data, N_cells=8, backend="numba")
+        points = np.random.RandomState(5).uniform(
+            -0.5 * self.lbox, 1.5 * self.lbox, size=(50, 3))
+        for gsp in (gsp_numpy, gsp_numba):
+            gsp.remove(np.arange(0, 1000, 7))
+            gsp.insert(points)
+            gsp.remove([3, 5])
+
+        expected = gsp_numpy.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        result = gsp_numba.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii,
+            return_format="csr")
+        for r, e in zip(result, expected):
+            assert_equal(r, e)
+
+        expected = gsp_numpy.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        result = gsp_numba.count_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        assert_equal(result, expected)
+
+    def test_fallback(self, data, monkeypatch):
+        # Numba not installed
+        monkeypatch.setattr(kernels, "NUMBA_AVAILABLE", False)
+        gsp = GriSPy(data, backend="numba")
+        assert_(not gsp._use_numba())
+
+        expected = GriSPy(data).bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        result = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii)
+        for r, e in zip(result[1], expected[1]):
+            assert_equal(r, e)
+
+    def test_only_euclid(self, data):
+        gsp = GriSPy(data[:, :2], metric="haversine", backend="numba")
+        assert_(not gsp._use_numba())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+import pickle
+import multiprocessing
+
+import pytest
+
+import numpy as np
+
+from grispy import GriSPy, shared
+
+from numpy.testing import assert_equal, assert_
+
+
+def _query(args):
+    index, centres, radii = args
+    gsp = GriSPy.from_shared_memory(index)
+    return gsp.bubble_neighbors(
+        centres, distance_upper_bound=radii, sorted=True)
+
+
+@pytest.mark.skipif(
+    not shared.SHARED_MEMORY_AVAILABLE, reason="requires Python 3.8")
+class Test_shared_memory:
+
+    @pytest.fixture
+    def gsp(self):
+        random = np.random.RandomState(1234)
+        self.lbox = 100.0
+        self.data = random.uniform(0, self.lbox, size=(1000, 3))
+        self.centres = random.uniform(0, self.lbox, size=(10, 3))
+        self.upper_radii = 10.0
+        self.periodic = {0: (0, self.lbox), 1: (0, self.lbox)}
+        return GriSPy(self.data, N_cells=16, periodic=self.periodic)
+
+    def test_attach(self, gsp):
+        with gsp.to_shared_memory() as shared:
+            index = pickle.loads(pickle.dumps(shared.index))
+            attached = GriSPy.from_shared_memory(index)
+
+            assert_(isinstance(attached, GriSPy))
+            assert_(attached.data is not gsp.data)
+            assert_equal(attached.data, gsp.data)
+            assert_equal(attached.k_bins_, gsp.k_bins_)
+            assert_equal(attached.grid_.order, gsp.grid_.order)
+            assert_equal(attached.grid_.offsets, gsp.grid_.offsets)
+            assert_equal(attached.N_cells, gsp.N_cells)
+            assert_equal(attached.periodic, gsp.periodic)
+            assert_equal(attached.time_, gsp.time_)
+
+            b, ind = gsp.bubble_neighbors(
+                self.centres, distance_upper_bound=self.upper_radii,
+                sorted=True)
+            b_sh, ind_sh = attached.bubble_neighbors(
+                self.centres, distance_upper_bound=self.upper_radii,
+                sorted=True)
+            for i in range(len(self.centres)):
+                assert_equal(b_sh[i], b[i])
+                assert_equal(ind_sh[i], ind[i])
+            del attached
+
+    def test_attach_read_only(self, gsp):
+        with gsp.to_shared_memory() as shared:
+            attached = GriSPy.from_shared_memory(shared.index)
+
+            assert_equal(len(attached.shared_blocks_), len(shared.blocks))
+            assert_(not attached.data.flags.writeable)
+            assert_(not attached.grid_.order.flags.writeable)
+            assert_(gsp.shared_blocks_ is None)
+
+            # editing the grid does not write to the shared memory
+            attached.remove([0, 1])
+            attached.insert(self.centres[:2])
+            assert_(attached.removed_.flags.writeable)
+            other = GriSPy.from_shared_memory(shared.index)
+            assert_equal(other.data, gsp.data)
+            assert_equal(other.grid_.order, gsp.grid_.order)
+            del attached, other
+
+    def test_attach_unit_vectors(self):
+        random = np.random.RandomState(5)
+        data = random.uniform(0, 1, size=(500, 2)) * [360, 180] - [0, 90]
+        gsp = GriSPy(data, N_cells=8, metric="haversine", unit_vectors=True)
+        with gsp.to_shared_memory() as shared:
+            attached = GriSPy.from_shared_memory(shared.index)
+
+            # the vectors are shared as the data, not computed again
+            assert_(not attached.vectors_.flags.writeable)
+            assert_equal(attached.vectors_, gsp.vectors_)
+            b, ind = gsp.bubble_neighbors(
+                data[:10], distance_upper_bound=20., sorted=True)
+            b_sh, ind_sh = attached.bubble_neighbors(
+                data[:10], distance_upper_bound=20., sorted=True)
+            for i in range(10):
+                assert_equal(b_sh[i], b[i])
+                assert_equal(ind_sh[i], ind[i])
+            del attached
+
+    def test_process_pool(self, gsp):
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+
+        with gsp.to_shared_memory() as shared:
+            chunks = [
+                (shared.index, self.centres[:5], self.upper_radii),
+                (shared.index, self.centres[5:], self.upper_radii)]
+            with multiprocessing.Pool(2) as pool:
+                results = pool.map(_query, chunks)
+
+        b_sh = results[0][0] + results[1][0]
+        ind_sh = results[0][1] + results[1][1]
+        for i in range(len(self.centres)):
+            assert_equal(b_sh[i], b[i])
+            assert_equal(ind_sh[i], ind[i])
+
+
+def test_shared_memory_not_available(monkeypatch):
+    monkeypatch.setattr(shared, "SHARED_MEMORY_AVAILABLE", False)
+    gsp = GriSPy(np.random.RandomState(1234).uniform(size=(10, 2)))
+    with pytest.raises(RuntimeError):
+        gsp.to_shared_memory()
+    with pytest.raises(RuntimeError):
+        GriSPy.from_shared_memory(None)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the
+#   GriSPy Project (https://github.com/mchalela/GriSPy).
+# Copyright (c) 2019, Martin Chalela
+# License: MIT
+#   Full Text: https://github.com/mchalela/GriSPy/blob/master/LICENSE
+
+
+import datetime
+
+import pytest
+
+import numpy as np
+
+import attr
+
+from grispy import GriSPy
+
+from numpy.testing import assert_equal, assert_
+
+
+class Test_storage:
+
+    @pytest.fixture
+    def gsp(self):
+        random = np.random.RandomState(1234)
+        self.lbox = 100.0
+        self.data = random.uniform(0, self.lbox, size=(1000, 3))
+        self.centres = random.uniform(0, self.lbox, size=(10, 3))
+        self.upper_radii = 10.0
+        self.periodic = {0: (0, self.lbox), 1: (0, self.lbox)}
+        return GriSPy(self.data, N_cells=16, periodic=self.periodic)
+
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_save_load(self, gsp, tmp_path, mmap):
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid", mmap=mmap)
+
+        assert_(isinstance(loaded, GriSPy))
+        assert_equal(isinstance(loaded.data, np.memmap), mmap)
+        assert_equal(loaded.data, gsp.data)
+        assert_equal(loaded.k_bins_, gsp.k_bins_)
+        assert_equal(loaded.grid_.order, gsp.grid_.order)
+        assert_equal(loaded.grid_.offsets, gsp.grid_.offsets)
+        assert_equal(loaded.N_cells, gsp.N_cells)
+        assert_equal(loaded.metric, gsp.metric)
+        assert_equal(loaded.periodic, gsp.periodic)
+        assert_(loaded.periodic_flag_)
+
+        assert_equal(loaded.time_.buildtime, gsp.time_.buildtime)
+        assert_equal(loaded.time_.datetime, gsp.time_.datetime)
+        assert_equal(
+            loaded.time_.periodicity_set_at, gsp.time_.periodicity_set_at)
+        assert_(gsp.time_.loadtime is None)
+        assert_(loaded.time_.loadtime >= 0)
+
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        for i in range(len(self.centres)):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+    def test_save_load_whole_seconds(self, gsp, tmp_path):
+        built = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        gsp.time_ = attr.evolve(
+            gsp.time_, datetime=built, periodicity_set_at=built)
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.time_.datetime, built)
+        assert_equal(loaded.time_.periodicity_set_at, built)
+
+    def test_save_load_numpy_scalars(self, gsp, tmp_path):
+        gsp = GriSPy(
+            self.data, N_cells="auto", expected_radius=np.int64(10),
+            mean_occupancy=np.float32(4.))
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.expected_radius, 10)
+        assert_equal(loaded.mean_occupancy, 4.)
+        assert_equal(loaded.n_cells_, gsp.n_cells_)
+
+    def test_save_load_per_axis_cells(self, gsp, tmp_path):
+        gsp = GriSPy(self.data, N_cells=(8, 4, 2))
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.N_cells, (8, 4, 2))
+        assert_equal(loaded.n_cells_, [8, 4, 2])
+        assert_equal(loaded.time_.n_cells, (8, 4, 2))
+        for bins_ld, bins in zip(loaded.axis_bins_, gsp.axis_bins_):
+            assert_equal(bins_ld, bins)
+
+    def test_save_load_sparse(self, gsp, tmp_path):
+        gsp = GriSPy(self.data, N_cells=64, index_mode="sparse")
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.index_mode, "sparse")
+        assert_equal(loaded.grid_.cells, gsp.grid_.cells)
+        assert_equal(loaded.grid_.offsets, gsp.grid_.offsets)
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        for i in range(len(self.centres)):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+    def test_save_load_edited(self, gsp, tmp_path):
+        gsp.remove(np.arange(10))
+        gsp.insert(np.array([[-5., 0., 0.], [0.5, 0.5, 0.5]]))
+        gsp.remove([20])
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.removed_, gsp.removed_)
+        assert_equal(loaded.overflow_, gsp.overflow_)
+        assert_equal(loaded.n_tombstones_, gsp.n_tombstones_)
+        b, ind = gsp.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            self.centres, distance_upper_bound=self.upper_radii, sorted=True)
+        for i in range(len(self.centres)):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+        # the memory-mapped arrays are not written
+        loaded.remove([21])
+        assert_(loaded.removed_[21])
+
+    def test_save_load_sky_bands(self, tmp_path):
+        random = np.random.RandomState(5)
+        data = random.uniform(0, 1, size=(500, 2)) * [360, 180] - [0, 90]
+        gsp = GriSPy(data, N_cells=16, metric="haversine", sky_bands=True)
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_(loaded.sky_bands)
+        assert_equal(loaded.grid_.offsets, gsp.grid_.offsets)
+        centres = data[:10]
+        b, ind = gsp.bubble_neighbors(
+            centres, distance_upper_bound=20., sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            centres, distance_upper_bound=20., sorted=True)
+        for i in range(len(centres)):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+    def test_save_load_unit_vectors(self, tmp_path):
+        random = np.random.RandomState(5)
+        data = random.uniform(0, 1, size=(500, 2)) * [360, 180] - [0, 90]
+        gsp = GriSPy(data, N_cells=8, metric="haversine", unit_vectors=True)
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(len(loaded.axis_bins_), 3)
+        # the vectors are mapped as the data, not computed again
+        assert_(isinstance(loaded.vectors_, np.memmap))
+        assert_equal(loaded.vectors_, gsp.vectors_)
+        b, ind = gsp.bubble_neighbors(
+            data[:10], distance_upper_bound=20., sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            data[:10], distance_upper_bound=20., sorted=True)
+        for i in range(10):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+    @pytest.mark.parametrize("metric_params", [
+        {"p": np.inf}, {"p": 3., "weights": np.array([1., 2., 3.])}])
+    def test_save_load_metric_params(self, tmp_path, metric_params):
+        random = np.random.RandomState(6)
+        data = random.uniform(0, 1, size=(500, 3))
+        gsp = GriSPy(
+            data, N_cells=8, metric="minkowski", metric_params=metric_params)
+        gsp.save(tmp_path / "grid")
+        loaded = GriSPy.load(tmp_path / "grid")
+
+        assert_equal(loaded.metric_params, metric_params)
+        b, ind = gsp.bubble_neighbors(
+            data[:10], distance_upper_bound=0.2, sorted=True)
+        b_ld, ind_ld = loaded.bubble_neighbors(
+            data[:10], distance_upper_bound=0.2, sorted=True)
+        for i in range(10):
+            assert_equal(b_ld[i], b[i])
+            assert_equal(ind_ld[i], ind[i])
+
+    def test_save_custom_metric(self, tmp_path):
+        def metric(c0, centres, dim):
+            return np.zeros(len(centres))
+
+        gsp = GriSPy(np.random.rand(10, 2), metric=metric)
+        with pytest.raises(TypeError):
+            gsp.save(tmp_path / "grid")